@@ -1,11 +1,11 @@
 from zope.interface import implements
-from zope.component import adapts, getUtility, queryUtility
+from zope.component import adapts
 
-from plone.behavior.interfaces import IBehavior
 from plone.behavior.interfaces import IBehaviorAssignable
 
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.interfaces import IDexterityContent
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.utils import getFTI
 
 class DexterityBehaviorAssignable(object):
     """Support plone.behavior behaviors stored in the FTI
@@ -15,16 +15,15 @@ class DexterityBehaviorAssignable(object):
     adapts(IDexterityContent)
     
     def __init__(self, context):
-        self.fti = getUtility(IDexterityFTI, name=context.portal_type)
+        self.context = context
+        self.portal_type = context.portal_type
+    
+    @property
+    def fti(self):
+        return getFTI(self.portal_type)
     
     def supports(self, behavior_interface):
-        for behavior in self.enumerateBehaviors():
-            if behavior_interface in behavior.interface._implied:
-                return True
-        return False
+        return behavior_interface in SCHEMA_CACHE.behaviorInterfaces(self.portal_type)
         
     def enumerateBehaviors(self):
-        for name in self.fti.behaviors:
-            behavior = queryUtility(IBehavior, name=name)
-            if behavior is not None:
-                yield behavior
\ No newline at end of file
+        return iter(SCHEMA_CACHE.behaviorRegistrations(self.portal_type))
\ No newline at end of file
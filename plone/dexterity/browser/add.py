@@ -1,11 +1,10 @@
-from zope.component import getUtility, createObject
+from zope.component import createObject
 from zope.publisher.browser import BrowserPage
 from zope.event import notify
 
 from z3c.form import form, button
 from plone.z3cform import layout
 
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.i18n import MessageFactory as _
 
 from plone.dexterity.browser.base import DexterityExtensibleForm
@@ -13,6 +12,7 @@ from plone.dexterity.utils import addContentToContainer
 from plone.dexterity.events import AddBegunEvent
 from plone.dexterity.events import AddCancelledEvent
 from plone.dexterity.utils import getAdditionalSchemata
+from plone.dexterity.utils import getFTI
 
 from Acquisition import aq_inner, aq_base
 from Acquisition.interfaces import IAcquirer
@@ -47,7 +47,7 @@ class DefaultAddForm(DexterityExtensibleForm, form.AddForm):
     # API
     
     def create(self, data):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
+        fti = getFTI(self.portal_type)
         
         container = aq_inner(self.context)
         content = createObject(fti.factory)
@@ -73,7 +73,7 @@ class DefaultAddForm(DexterityExtensibleForm, form.AddForm):
 
     def add(self, object):
         
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
+        fti = getFTI(self.portal_type)
         container = aq_inner(self.context)
         new_object = addContentToContainer(container, object)
         
@@ -125,7 +125,7 @@ class DefaultAddForm(DexterityExtensibleForm, form.AddForm):
     @property
     def label(self):
         portal_type = self.portal_type
-        fti = getUtility(IDexterityFTI, name=portal_type)
+        fti = getFTI(portal_type)
         type_name = fti.Title()
         return _(u"Add ${name}", mapping={'name': type_name})
 
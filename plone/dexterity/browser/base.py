@@ -1,8 +1,7 @@
 
 from plone.autoform.form import AutoExtensibleForm
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.utils import getAdditionalSchemata
-from zope.component import getUtility
+from plone.dexterity.utils import getFTI
 from zope.i18nmessageid import MessageFactory
 
 
@@ -17,14 +16,14 @@ class DexterityExtensibleForm(AutoExtensibleForm):
 
     @property
     def description(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
+        fti = getFTI(self.portal_type)
         return fti.Description()
 
     # AutoExtensibleForm contract
 
     @property
     def schema(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
+        fti = getFTI(self.portal_type)
         return fti.lookupSchema()
 
     @property
@@ -1,16 +1,15 @@
-from zope.component import getUtility
 from zope.event import notify
 
 from z3c.form import form, button
 from plone.z3cform import layout
 
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.i18n import MessageFactory as _
 from plone.dexterity.events import EditBegunEvent
 from plone.dexterity.events import EditCancelledEvent
 from plone.dexterity.events import EditFinishedEvent
 
 from plone.dexterity.browser.base import DexterityExtensibleForm
+from plone.dexterity.utils import getFTI
 
 from Products.CMFCore.utils import getToolByName
 from Products.statusmessages.interfaces import IStatusMessage
@@ -66,7 +65,7 @@ class DefaultEditForm(DexterityExtensibleForm, form.EditForm):
 
     @property
     def fti(self):
-        return getUtility(IDexterityFTI, name=self.portal_type)
+        return getFTI(self.portal_type)
     
     @property
     def label(self):
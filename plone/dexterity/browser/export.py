@@ -0,0 +1,201 @@
+import json
+import decimal
+import datetime
+
+from collections import deque
+
+from Acquisition import aq_base
+from DateTime import DateTime
+
+from Products.Five.browser import BrowserView
+
+from plone.uuid.interfaces import IUUID
+
+from plone.dexterity.interfaces import IDexterityContainer
+from plone.dexterity.interfaces import IDexterityContent
+from plone.dexterity.content import asDictionaries
+
+# Number of objects loaded, and ghostified again, at a time
+BATCH_SIZE = 500
+
+
+def jsonDefault(value):
+    """Convert field values that the json module does not know about
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time,)):
+        return value.isoformat()
+    if isinstance(value, DateTime):
+        return value.ISO8601()
+    if isinstance(value, (set, frozenset,)):
+        return list(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+
+    # Rich text
+    raw = getattr(aq_base(value), 'raw', None)
+    if raw is not None:
+        return {'raw': raw, 'mimeType': getattr(value, 'mimeType', None)}
+
+    # Files and images; the data itself is left out
+    filename = getattr(aq_base(value), 'filename', None)
+    if filename is not None:
+        size = getattr(value, 'getSize', None)
+        return {'filename': filename,
+                'contentType': getattr(value, 'contentType', None),
+                'size': size is not None and size() or None}
+
+    try:
+        return unicode(value)
+    except UnicodeError:
+        return repr(value)
+
+
+def iterContents(container, recursive=False, after=None, batchSize=BATCH_SIZE):
+    """Yield (key, object) for the Dexterity content in the container, in
+    order of id. If recursive is True, the contents of each child container
+    follow the child itself. key is the path of the object relative to the
+    container.
+
+    If after is given, only the objects following the one with that key are
+    yielded, so that an interrupted export can be resumed. Ids before it are
+    skipped without loading the objects.
+
+    Objects are loaded batchSize at a time, in one round trip if the ZODB
+    connection supports prefetching.
+    """
+    resume = rest = None
+    if after:
+        parts = after.split('/', 1)
+        resume = parts[0]
+        if len(parts) > 1:
+            rest = parts[1]
+
+    tree = aq_base(container)._tree
+    if resume is not None:
+        keys = tree.keys(min=resume)
+    else:
+        keys = tree.keys()
+    prefetch = getattr(container._p_jar, 'prefetch', None)
+
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) < batchSize:
+            continue
+        for item in _iterBatch(container, batch, recursive, resume, rest,
+                               batchSize, prefetch):
+            yield item
+        batch = []
+    for item in _iterBatch(container, batch, recursive, resume, rest,
+                           batchSize, prefetch):
+        yield item
+
+
+def _iterBatch(container, keys, recursive, resume, rest, batchSize, prefetch):
+    if not keys:
+        return
+    tree = aq_base(container)._tree
+    if prefetch is not None:
+        prefetch([tree[key] for key in keys])
+
+    for key in keys:
+        obj = container._getOb(key)
+        if not IDexterityContent.providedBy(obj):
+            continue
+
+        # The object to resume after has been exported already, but its
+        # contents may not have been
+        after = None
+        if key == resume:
+            after = rest
+        else:
+            yield key, obj
+
+        if recursive and IDexterityContainer.providedBy(obj):
+            for childKey, child in iterContents(obj, True, after, batchSize):
+                yield '%s/%s' % (key, childKey), child
+
+
+def ghostify(objects):
+    """Turn unmodified persistent objects back into ghosts, to release the
+    memory their state uses
+    """
+    for obj in objects:
+        deactivate = getattr(aq_base(obj), '_p_deactivate', None)
+        if deactivate is not None:
+            deactivate()
+
+
+def exportLines(container, recursive=False, after=None, batchSize=BATCH_SIZE):
+    """Yield a line of JSON for each Dexterity object in the container, as
+    found by iterContents(). Each line holds the object's key, id,
+    portal_type and UID, and the values of its schema fields.
+
+    Every batchSize objects, the exported objects are ghostified and the
+    ZODB cache is garbage collected, so that memory use stays bounded
+    however large the tree is.
+    """
+    pending = deque()
+    done = []
+
+    def objects():
+        for key, obj in iterContents(container, recursive, after, batchSize):
+            pending.append((key, obj))
+            yield obj
+
+    connection = container._p_jar
+    for fields in asDictionaries(objects(), checkConstraints=True):
+        key, obj = pending.popleft()
+        data = {'key': key,
+                'id': obj.getId(),
+                'portal_type': obj.portal_type,
+                'uid': IUUID(obj, None),
+                'fields': fields}
+        try:
+            line = json.dumps(data, sort_keys=True, default=jsonDefault)
+        except UnicodeDecodeError:
+            # Binary data in a bytes field
+            line = json.dumps(data, sort_keys=True, default=jsonDefault,
+                              encoding='latin-1')
+        yield line + '\n'
+
+        done.append(obj)
+        if len(done) >= batchSize:
+            ghostify(done)
+            done = []
+            if connection is not None:
+                connection.cacheGC()
+
+
+class ExportView(BrowserView):
+    """Export the Dexterity content in the container as newline-delimited
+    JSON. Pass 'recursive' in the request to include the contents of
+    subfolders, and 'after' with the key of the last line received to
+    resume an interrupted export.
+
+    The output is streamed to the client with response.write(), one batch
+    of lines at a time, while the ZODB connection is still open, so that
+    it is never held in memory and the client receives the first lines
+    straight away.
+    """
+
+    batchSize = BATCH_SIZE
+
+    def __call__(self):
+        recursive = bool(self.request.get('recursive'))
+        after = self.request.get('after') or None
+
+        response = self.request.response
+        response.setHeader('Content-Type', 'application/x-ndjson')
+        response.setHeader('Content-Disposition',
+                           'attachment; filename="%s.jsonl"' % self.context.getId())
+
+        chunk = []
+        for line in exportLines(self.context, recursive, after, self.batchSize):
+            chunk.append(line)
+            if len(chunk) >= self.batchSize:
+                response.write(''.join(chunk))
+                chunk = []
+        if chunk:
+            response.write(''.join(chunk))
+        return ''
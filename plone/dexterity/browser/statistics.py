@@ -0,0 +1,22 @@
+import json
+
+from Products.Five.browser import BrowserView
+
+from plone.dexterity.schema import getCacheStatistics
+from plone.dexterity.schema import resetCacheStatistics
+from plone.dexterity.indexing import indexingQueueStatistics
+
+
+class CacheStatisticsView(BrowserView):
+    """Return the schema cache statistics, and those of the site's indexing
+    queue, as JSON. POST with 'reset' in the request to reset the cache
+    statistics afterwards.
+    """
+
+    def __call__(self):
+        statistics = getCacheStatistics()
+        statistics['indexingQueue'] = indexingQueueStatistics(self.context)
+        if self.request.get('REQUEST_METHOD') == 'POST' and 'reset' in self.request.form:
+            resetCacheStatistics()
+        self.request.response.setHeader('Content-Type', 'application/json')
+        return json.dumps(statistics, sort_keys=True)
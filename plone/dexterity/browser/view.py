@@ -1,9 +1,7 @@
-from zope.component import getUtility
-
 from plone.autoform.view import WidgetsView
 
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.utils import getAdditionalSchemata
+from plone.dexterity.utils import getFTI
 
 
 class DefaultView(WidgetsView):
@@ -13,7 +11,7 @@ class DefaultView(WidgetsView):
 
     @property
     def schema(self):
-        fti = getUtility(IDexterityFTI, name=self.context.portal_type)
+        fti = getFTI(self.context.portal_type)
         return fti.lookupSchema()
 
     @property
@@ -1,10 +1,10 @@
 from Acquisition import Explicit, aq_base, aq_parent
 from DateTime import DateTime
-from zExceptions import Unauthorized
 from OFS.PropertyManager import PropertyManager
 from OFS.SimpleItem import SimpleItem
 
 from copy import deepcopy
+from weakref import WeakValueDictionary
 
 from zope.component import queryUtility
 
@@ -14,6 +14,7 @@ from zope.interface.declarations import implementedBy
 from zope.interface.declarations import getObjectSpecification
 from zope.interface.declarations import ObjectSpecificationDescriptor
 
+from zope.schema import getFieldsInOrder
 from zope.security.interfaces import IPermission
 
 from zope.annotation import IAttributeAnnotatable
@@ -23,8 +24,6 @@ from plone.dexterity.interfaces import IDexterityItem
 from plone.dexterity.interfaces import IDexterityContainer
 
 from plone.dexterity.schema import SCHEMA_CACHE
-from plone.dexterity.utils import iterSchemata
-from zope.schema import getFieldsInOrder
 
 from zope.container.contained import Contained
 
@@ -52,10 +51,21 @@ from plone.autoform.interfaces import READ_PERMISSIONS_KEY
 from plone.supermodel.utils import mergedTaggedValueDict
 
 from plone.dexterity.filerepresentation import DAVResourceMixin, DAVCollectionMixin
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.utils import datify
 from plone.dexterity.utils import safe_utf8
 from plone.dexterity.utils import safe_unicode
+from plone.dexterity.utils import queryFTI
+from plone.dexterity.utils import iterSchemata
+from plone.dexterity.utils import getTypeProfile
+from plone.dexterity.utils import usesFTIBehaviors
+from plone.dexterity.utils import indexingDeferred
+from plone.dexterity.utils import unindexingDeferred
+from plone.dexterity.utils import deleteContentsInContainer
+from plone.dexterity.indexing import queueReindex
+from plone.dexterity.security import checkPermission
+from plone.dexterity.indexing import indexesForEvent
+from plone.dexterity.indexing import asyncIndexingEnabled
+from plone.dexterity.indexing import queueAsyncReindex
 
 _marker = object()
 _zone = DateTime().timezone()
@@ -63,6 +73,35 @@ FLOOR_DATE = DateTime(1970, 0)  # always effective
 CEILING_DATE = DateTime(2500, 0)  # never expires
 
 
+def _isoDate(date, zone):
+    return date.toZone(zone).ISO()
+
+
+# Specifications shared by all instances with the same schema, subtypes and
+# direct (or class) specification. Sharing them saves memory and means the
+# adapter registry's lookup cache is keyed by one object per combination
+# rather than by one object per content instance. Entries go away when no
+# instance refers to the specification any more.
+_specCache = WeakValueDictionary()
+
+
+def internSpecification(schema, subtypes, spec):
+    """Return a shared specification for instances providing the given
+    schema and subtypes in addition to spec.
+    """
+    # Interfaces compare equal by name, so use identity for the key. The
+    # cached specification holds on to all of these, so an id cannot be
+    # reused whilst its entry is alive.
+    key = (id(schema), tuple(map(id, subtypes)), id(spec))
+    interned = _specCache.get(key)
+    if interned is None:
+        dynamically_provided = [] if schema is None else [schema]
+        dynamically_provided.extend(subtypes)
+        dynamically_provided.append(spec)
+        interned = _specCache.setdefault(key, Implements(*dynamically_provided))
+    return interned
+
+
 class FTIAwareSpecification(ObjectSpecificationDescriptor):
     """A __providedBy__ decorator that returns the interfaces provided by
     the object, plus the schema interface set in the FTI.
@@ -88,7 +127,7 @@ class FTIAwareSpecification(ObjectSpecificationDescriptor):
         if portal_type is None:
             return spec
 
-        fti = queryUtility(IDexterityFTI, name=portal_type)
+        fti = queryFTI(portal_type)
         if fti is None:
             return spec
 
@@ -113,15 +152,11 @@ class FTIAwareSpecification(ObjectSpecificationDescriptor):
             if cache[:-1] == updated:
                 return cached_spec
 
-        dynamically_provided = [] if schema is None else [schema]
-        dynamically_provided.extend(subtypes)
-
         # If we have neither a schema, nor a subtype, then we're also done.
-        if not dynamically_provided:
+        if schema is None and not subtypes:
             return spec
 
-        dynamically_provided.append(spec)
-        spec = Implements(*dynamically_provided)
+        spec = internSpecification(schema, subtypes, spec)
         inst._v__providedBy__ = updated + (spec, )
 
         return spec
@@ -131,6 +166,9 @@ class AttributeValidator(Explicit):
     """Decide whether attributes should be accessible. This is set as the
     __allow_access_to_unprotected_subobjects__ variable in Dexterity's content
     classes.
+
+    Permission checks can be memoized for the request, see
+    plone.dexterity.security.
     """
 
     def __call__(self, name, value):
@@ -141,26 +179,26 @@ class AttributeValidator(Explicit):
 
         context = aq_parent(self)
 
-        schema = self._get_schema(context)
-        if schema is None:
+        profile = self._get_profile(context)
+        if profile is None:
             return 1
 
-        info = mergedTaggedValueDict(schema, READ_PERMISSIONS_KEY)
+        info = profile.readPermissions
 
         if name not in info:
             return 1
 
         permission = queryUtility(IPermission, name=info[name])
         if permission is not None:
-            return getSecurityManager().checkPermission(permission.title, context)
+            return checkPermission(permission.title, context)
 
         return 0
 
-    def _get_schema(self, inst):
+    def _get_profile(self, inst):
         portal_type = getattr(inst, 'portal_type', None)
         if portal_type is not None:
             try:
-                return SCHEMA_CACHE.get(portal_type)
+                return SCHEMA_CACHE.profile(portal_type)
             except (ValueError, AttributeError,):
                 pass
         return None
@@ -251,15 +289,19 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         if name.startswith('__'):
             raise AttributeError(name)
 
-        # attribute was not found; try to look it up in the schema and return
-        # a default
-        schema = SCHEMA_CACHE.get(self.portal_type)
-        if schema is not None:
-            field = schema.get(name, None)
-            if field is not None:
-                return deepcopy(field.default)
+        # attribute was not found; try to look it up in the schema and
+        # subtypes and return a default
+        defaults = SCHEMA_CACHE.defaults(self.portal_type)
+        if defaults is not None:
+            default = defaults.get(name)
+            if default is not None:
+                copy, value = default
+                if copy:
+                    return deepcopy(value.default)
+                return value
+            raise AttributeError(name)
 
-        # do the same for each subtype
+        # the schema could not be found, but we may still have subtypes
         for schema in SCHEMA_CACHE.subtypes(self.portal_type):
             field = schema.get(name, None)
             if field is not None:
@@ -292,6 +334,26 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         self.addCreator()
         self.setModificationDate()
 
+    @security.protected(permissions.ModifyPortalContent)
+    def indexObject(self):
+        """Index the object in the portal catalog, unless indexing is being
+        deferred by createContentsInContainer() or done asynchronously.
+        """
+        if indexingDeferred(self):
+            return
+        if asyncIndexingEnabled() and queueAsyncReindex(self):
+            return
+        CMFCatalogAware.indexObject(self)
+
+    @security.protected(permissions.ModifyPortalContent)
+    def unindexObject(self):
+        """Unindex the object from the portal catalog, unless unindexing is
+        being deferred by deleteContentsInContainer().
+        """
+        if unindexingDeferred(self):
+            return
+        CMFCatalogAware.unindexObject(self)
+
     @security.protected(permissions.ModifyPortalContent)
     def addCreator(self, creator=None):
         """ Add creator to Dublin Core creators.
@@ -313,7 +375,30 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         if modification_date is None:
             self.modification_date = DateTime()
         else:
-            self.modification_date = self._datify(modification_date)
+            self.modification_date = datify(modification_date)
+
+    def _formatted(self, name, source, format, *args):
+        """Return format(source, *args), remembering the result until the
+        object is next committed.
+
+        The Dublin Core date accessors are called many times for each object
+        when it is indexed and listed, and formatting dates is not cheap.
+        The memo is a volatile attribute keyed by _p_serial, and each entry
+        is only used if the attribute it was made from is still the same
+        object. Writes through the mutators, or by setting the attribute
+        directly, therefore never see a stale value.
+        """
+        serial = self._p_serial
+        memo = self.__dict__.get('_v_dublinCore')
+        if memo is None or memo[0] != serial:
+            memo = self._v_dublinCore = (serial, {})
+        key = (name,) + args
+        entry = memo[1].get(key)
+        if entry is not None and entry[0] is source:
+            return entry[1]
+        value = format(source, *args)
+        memo[1][key] = (source, value)
+        return value
 
     # IMinimalDublinCore
 
@@ -382,7 +467,7 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         date = getattr(self, 'effective_date', None)
         if date is None:
             date = self.modified()
-        return date.toZone(zone).ISO()
+        return self._formatted('Date', date, _isoDate, zone)
 
     @security.protected(permissions.View)
     def CreationDate(self, zone=None):
@@ -391,7 +476,8 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
             zone = _zone
         # return unknown if never set properly
         if self.creation_date:
-            return self.creation_date.toZone(zone).ISO()
+            return self._formatted('CreationDate', self.creation_date,
+                                   _isoDate, zone)
         else:
             return 'Unknown'
 
@@ -401,7 +487,7 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         if zone is None:
             zone = _zone
         ed = getattr(self, 'effective_date', None)
-        return ed and ed.toZone(zone).ISO() or 'None'
+        return ed and self._formatted('EffectiveDate', ed, _isoDate, zone) or 'None'
 
     @security.protected(permissions.View)
     def ExpirationDate(self, zone=None):
@@ -409,14 +495,15 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         if zone is None:
             zone = _zone
         ed = getattr(self, 'expiration_date', None)
-        return ed and ed.toZone(zone).ISO() or 'None'
+        return ed and self._formatted('ExpirationDate', ed, _isoDate, zone) or 'None'
 
     @security.protected(permissions.View)
     def ModificationDate(self, zone=None):
         # Dublin Core Date element - date resource last modified.
         if zone is None:
             zone = _zone
-        return self.modified().toZone(zone).ISO()
+        return self._formatted('ModificationDate', self.modified(), _isoDate,
+                               zone)
 
     @security.protected(permissions.View)
     def Identifier(self):
@@ -537,8 +624,10 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
     def getField(self, name):
         """Given a field name, return a field instance. Party hard.
         """
-        fields = self.getFields()
-        for field in fields:
+        profile = getTypeProfile(self)
+        if profile is not None:
+            return profile.fieldsByName.get(name)
+        for field in self.getFields():
             if field.getName() == name:
                 return field
         return None
@@ -548,50 +637,65 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         Because of behaviors, fields are distributed across several
         schemata. Fields will be returned in proper order.
         """
+        profile = getTypeProfile(self)
+        if profile is not None:
+            return list(profile.fields)
         fields = []
         for schemata in iterSchemata(self):
-            fieldsInOrder = getFieldsInOrder(schemata)
-            # TODO: once python 2.6 support is out, make this an OrderedDict
-            for orderedField in fieldsInOrder:
-                fields.append(orderedField[-1])
+            for name, field in getFieldsInOrder(schemata):
+                fields.append(field)
         return fields
 
     def getFieldNames(self):
-        """Return a list of the names of the fields. Just some convenience
-        cause I love yo faces!
+        """Return a list of the names of the fields, in order. Unlike
+        asDictionary(), this does not look at the values.
         """
-        return self.asDictionary().keys()
-
-    def asDictionary(self, checkConstraints=False):
+        profile = getTypeProfile(self)
+        if profile is not None:
+            return list(profile.fieldNames)
+        names = []
+        for field in self.getFields():
+            name = field.getName()
+            if name not in names:
+                names.append(name)
+        return names
+
+    def asDictionary(self, checkConstraints=False, fields=None):
         """Return a dictionary of key, value pairs of all fields.
         If checkContraints is True, it will onyl return values
         that the authenticated user is allowed to see. Otherwise,
-        all attribute,value pairs are returned.
+        all attribute,value pairs are returned. If fields is given,
+        only the fields with those names are included.
+
+        Each schema is adapted only once, rather than once per field as
+        getValue() does.
         """
         hotness = {}  # pep8
-        fields = self.getFields()
-        for field in fields:
+        if fields is not None:
+            fields = frozenset(fields)
+        adapters = {}
+        for field in self.getFields():
+            name = field.getName()
+            if fields is not None and name not in fields:
+                continue
             if checkConstraints:
                 if not self.canViewField(field):
                     continue
-            hotness[field.getName()] = self.getValue(field)
+            schema = field.interface
+            try:
+                behaviorAdapter = adapters[schema]
+            except KeyError:
+                behaviorAdapter = adapters[schema] = schema(self)
+            hotness[name] = getattr(behaviorAdapter, name)
         return hotness
 
     def canViewField(self, field):
         """returns True if the logged in user has permission to view this
         field
         """
-        info = mergedTaggedValueDict(field.interface, READ_PERMISSIONS_KEY)
-
-        # If there is no specific read permission, assume it is view
-        if field not in info:
-            return getSecurityManager().checkPermission(AccessControl.Permissions.view,
-                                                        self)
-
-        permission = queryUtility(IPermission, name=info[field])
+        permission = _readPermission(field)
         if permission is not None:
-            return getSecurityManager().checkPermission(permission.title, self)
-
+            return checkPermission(permission, self)
         return False
 
     def getValue(self, field):
@@ -608,6 +712,100 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager, Contain
         return getattr(behaviorAdapter, field.getName())
 
 
+def _readPermission(field, info=None):
+    """Return the title of the permission needed to read the field, or None
+    if it names a permission that does not exist. info is the field's
+    schema's read permissions tagged value, if already known.
+    """
+    if info is None:
+        info = mergedTaggedValueDict(field.interface, READ_PERMISSIONS_KEY)
+
+    # If there is no specific read permission, assume it is view
+    name = field.getName()
+    if name not in info:
+        return AccessControl.Permissions.view
+
+    permission = queryUtility(IPermission, name=info[name])
+    if permission is not None:
+        return permission.title
+    return None
+
+
+def _extractionPlan(portal_type, checkConstraints=False, fields=None):
+    """Work out how to extract the values of the given fields (or all
+    fields) from instances of a portal_type. Returns a list of
+    (name, schema, permission) tuples, in field order. permission is the
+    title of the permission to check, or None if the field must be left
+    out when checking constraints.
+    """
+    profile = SCHEMA_CACHE.profile(portal_type)
+    if profile is None:
+        return []
+
+    plan = []
+    permissions = {}
+    for field in profile.fields:
+        name = field.getName()
+        if fields is not None and name not in fields:
+            continue
+        schema = field.interface
+        permission = None
+        if checkConstraints:
+            if schema not in permissions:
+                permissions[schema] = mergedTaggedValueDict(schema, READ_PERMISSIONS_KEY)
+            permission = _readPermission(field, permissions[schema])
+        plan.append((name, schema, permission))
+    return plan
+
+
+def asDictionaries(objects, checkConstraints=False, fields=None):
+    """Return a generator of the asDictionary() of each of the objects, in
+    order.
+
+    The fields to extract, the schemata to adapt to and the permissions to
+    check are worked out once per portal_type rather than once per object,
+    and each permission is checked once per object. objects is consumed
+    lazily and nothing is kept of the objects once their dictionary has
+    been yielded, so this can be used to stream large result sets.
+
+    Objects whose behaviors are not the ones enabled in the FTI fall back
+    to asDictionary().
+    """
+    if fields is not None:
+        fields = frozenset(fields)
+    plans = {}
+
+    for obj in objects:
+        if not usesFTIBehaviors(obj):
+            yield obj.asDictionary(checkConstraints, fields)
+            continue
+
+        portal_type = getattr(aq_base(obj), 'portal_type', None)
+        try:
+            plan = plans[portal_type]
+        except KeyError:
+            plan = plans[portal_type] = _extractionPlan(
+                portal_type, checkConstraints, fields)
+
+        allowed = {}
+        adapters = {}
+        hotness = {}
+        for name, schema, permission in plan:
+            if checkConstraints:
+                if permission is None:
+                    continue
+                if permission not in allowed:
+                    allowed[permission] = checkPermission(permission, obj)
+                if not allowed[permission]:
+                    continue
+            try:
+                behaviorAdapter = adapters[schema]
+            except KeyError:
+                behaviorAdapter = adapters[schema] = schema(obj)
+            hotness[name] = getattr(behaviorAdapter, name)
+        yield hotness
+
+
 class Item(PasteBehaviourMixin, BrowserDefaultMixin, DexterityContent):
     """A non-containerish, CMFish item
     """
@@ -660,6 +858,10 @@ class Container(
     Description = DexterityContent.Description
     setDescription = DexterityContent.setDescription
 
+    # Make sure indexing can be deferred for containers, too
+    indexObject = DexterityContent.indexObject
+    unindexObject = DexterityContent.unindexObject
+
     def __init__(self, id=None, **kwargs):
         CMFOrderedBTreeFolderBase.__init__(self, id)
         DexterityContent.__init__(self, id, **kwargs)
@@ -679,17 +881,18 @@ class Container(
 
         If the current user does not have permission to delete one of the
         objects, an Unauthorized exception will be raised.
+
+        The objects are deleted in bulk, see deleteContentsInContainer().
         """
         if ids is None:
             ids = []
         if isinstance(ids, basestring):
             ids = [ids]
-        for id in ids:
-            item = self._getOb(id)
-            if not getSecurityManager().checkPermission(permissions.DeleteObjects, item):
-                raise Unauthorized, (
-                    "Do not have permissions to remove this object")
-        return super(Container, self).manage_delObjects(ids, REQUEST=REQUEST)
+        if not ids:
+            return super(Container, self).manage_delObjects(ids, REQUEST=REQUEST)
+        deleteContentsInContainer(self, ids)
+        if REQUEST is not None:
+            return self.manage_main(self, REQUEST, update_menu=1)
 
     # override PortalFolder's allowedContentTypes to respect IConstrainTypes
     # adapters
@@ -723,7 +926,7 @@ def reindexOnModify(content, event):
     if event.object is not content:
         return
 
-    # NOTE: We are not using event.descriptions because the field names may
-    # not match index names.
-
-    content.reindexObject()
+    # The field names in event.descriptions are only used if the FTI maps
+    # them to index names. Reindexing may be deferred to the end of the
+    # transaction, so that several events cause a single reindex.
+    queueReindex(content, indexesForEvent(content, event))
@@ -3,13 +3,12 @@ from persistent import Persistent
 from zope.interface import implements
 from zope.interface.declarations import Implements
 
-from zope.component import getUtility
 from zope.component.factory import Factory
 
-from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.interfaces import IDexterityFactory
 
 from plone.dexterity.utils import resolveDottedName
+from plone.dexterity.utils import getFTI
 
 class DexterityFactory(Persistent, Factory):
     """A factory for Dexterity content. 
@@ -22,20 +21,17 @@ class DexterityFactory(Persistent, Factory):
 
     @property
     def title(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
+        fti = getFTI(self.portal_type)
         return fti.title
 
     @property
     def description(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
+        fti = getFTI(self.portal_type)
         return fti.description
 
     def __call__(self, *args, **kw):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
-        
-        klass = resolveDottedName(fti.klass)
-        if klass is None or not callable(klass):
-            raise ValueError("Content class %s set for type %s is not valid" % (fti.klass, self.portal_type))
+        fti = getFTI(self.portal_type)
+        klass = self._lookupClass(fti)
         
         try:
             obj = klass(*args, **kw)
@@ -49,10 +45,34 @@ class DexterityFactory(Persistent, Factory):
 
         return obj
 
+    def _lookupClass(self, fti):
+        """Resolve the FTI's content class. The result is cached in a
+        volatile attribute until the FTI's klass changes.
+        """
+        klassName = fti.klass
+        cached = getattr(self, '_v_klass', None)
+        if cached is not None and cached[0] == klassName:
+            return cached[1]
+
+        klass = resolveDottedName(klassName)
+        if klass is None or not callable(klass):
+            raise ValueError("Content class %s set for type %s is not valid" % (klassName, self.portal_type))
+
+        self._v_klass = (klassName, klass)
+        return klass
+
     def getInterfaces(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
-        spec = Implements(fti.lookupSchema())
+        fti = getFTI(self.portal_type)
+        schema = fti.lookupSchema()
+
+        # Cache the specification until the schema changes
+        cached = getattr(self, '_v_spec', None)
+        if cached is not None and cached[0] is schema:
+            return cached[1]
+
+        spec = Implements(schema)
         spec.__name__ = self.portal_type
+        self._v_spec = (schema, spec)
         return spec
 
     def __repr__(self):
@@ -37,6 +37,7 @@ from plone.dexterity.interfaces import IDexterityContainer
 from plone.dexterity.interfaces import DAV_FOLDER_DATA_ID
 
 from plone.dexterity.utils import iterSchemata
+from plone.dexterity.utils import getTypeProfile
 from plone.memoize.instance import memoize
 
 class DAVResourceMixin(object):
@@ -570,15 +571,18 @@ class DefaultReadFile(ReadFileBase):
     @property
     def mimeType(self):
         if not self._haveMessage:
-            foundOne = False
-            for schema in iterSchemata(self.context):
-                for name, field in getFieldsInOrder(schema):
-                    if IPrimaryField.providedBy(field):
-                        if foundOne:
-                            # more than one primary field
-                            return 'message/rfc822'
-                        else:
-                            foundOne = True
+            profile = getTypeProfile(self.context)
+            if profile is not None:
+                primaryFields = profile.primaryFields
+            else:
+                primaryFields = [
+                    field for schema in iterSchemata(self.context)
+                    for name, field in getFieldsInOrder(schema)
+                    if IPrimaryField.providedBy(field)
+                    ]
+            if len(primaryFields) > 1:
+                # more than one primary field
+                return 'message/rfc822'
             # zero or one primary fields
             return 'text/plain'
         if not self._getMessage().is_multipart():
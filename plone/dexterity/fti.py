@@ -17,7 +17,6 @@ from zope.i18nmessageid import Message
 
 from plone.supermodel import loadString, loadFile
 from plone.supermodel.model import Model
-from plone.supermodel.utils import syncSchema
 
 from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.interfaces import IDexterityFTIModificationDescription
@@ -34,6 +33,9 @@ from Products.CMFDynamicViewFTI import fti as base
 import plone.dexterity.schema
 
 from plone.dexterity.schema import SchemaInvalidatedEvent
+from plone.dexterity.schema import syncModelChanges
+from plone.dexterity.schema import MODEL_CACHE
+from plone.dexterity.schema import lookupCachedModel
 
 
 class DexterityFTIModificationDescription(object):
@@ -100,6 +102,22 @@ class DexterityFTI(base.DynamicViewTypeInformation):
           'label': 'Content type schema policy',
           'description': 'Name of the schema policy.'
         },
+        { 'id': 'field_indexes',
+          'type': 'lines',
+          'mode': 'w',
+          'label': 'Field indexes',
+          'description': "Catalog indexes to update when a field is modified, " +
+                         "one line per field, e.g. 'title: Title sortable_title'. " +
+                         "Modifying a field that is not listed reindexes all indexes."
+        },
+        { 'id': 'name_chooser',
+          'type': 'string',
+          'mode': 'w',
+          'label': 'Name chooser',
+          'description': "Name of the name chooser for content added to " +
+                         "containers of this type, e.g. 'dexterity.counter'. " +
+                         "Leave empty to use the default name chooser."
+        },
 
     )
     
@@ -132,6 +150,8 @@ class DexterityFTI(base.DynamicViewTypeInformation):
     model_file = u""
     schema = u""
     schema_policy = u"dexterity"
+    name_chooser = u""
+    field_indexes = ()
     
     def __init__(self, *args, **kwargs):
         super(DexterityFTI, self).__init__(*args, **kwargs)
@@ -247,6 +267,19 @@ class DexterityFTI(base.DynamicViewTypeInformation):
         
         raise ValueError("Neither model source, nor model file, nor schema is specified in FTI %s" % self.getId())
     
+    def _lookupCachedModel(self):
+        """Like lookupModel(), but return the model from MODEL_CACHE if the
+        same source has been parsed before. The model is shared, so it must
+        only be read. This is used when generating and re-syncing schemata;
+        see plone.dexterity.schema.lookupCachedModel().
+        """
+        if self.model_source:
+            return MODEL_CACHE.loadString(self.model_source, policy=self.schema_policy)
+        elif self.model_file:
+            model_file = self._absModelFile()
+            return MODEL_CACHE.loadFile(model_file, policy=self.schema_policy)
+        return self.lookupModel()
+    
     #
     # Base class overrides
     # 
@@ -438,6 +471,10 @@ def ftiModified(object, event):
     if not IDexterityFTI.providedBy(event.object):
         return
     
+    # The FTI may now refer to classes or schemata that could not be
+    # resolved before
+    utils.DOTTED_NAME_RESOLVER.clear()
+    
     fti = event.object
     portal_type = fti.getId()
     
@@ -467,13 +504,17 @@ def ftiModified(object, event):
     # Determine if we need to invalidate the schema at all
     if 'behaviors' in mod or 'schema' in mod or 'model_source' in mod or 'model_file' in mod:
         
+        changes = None
+        
         # Determine if we need to re-sync a dynamic schema
         if (fti.model_source or fti.model_file) and ('model_source' in mod or 'model_file' in mod):
             
-            schemaName = utils.portalTypeToSchemaName(portal_type)
-            schema = getattr(plone.dexterity.schema.generated, schemaName)
-    
-            model = fti.lookupModel()
-            syncSchema(model.schema, schema, overwrite=True)
+            model = lookupCachedModel(fti)
+            changes = syncModelChanges(portal_type, model)
+        
+        # Only pass on the changes if nothing else could have affected the
+        # schemata
+        if 'behaviors' in mod or 'schema' in mod:
+            changes = None
         
-        notify(SchemaInvalidatedEvent(portal_type))
+        notify(SchemaInvalidatedEvent(portal_type, changes))
@@ -0,0 +1,536 @@
+"""Coalesced catalog reindexing.
+
+Modifying an object often fires several IObjectModifiedEvents in one
+transaction, e.g. from the edit form, from WebDAV and from add-on event
+handlers. With
+
+    <product-config plone.dexterity>
+        deferred-indexing on
+    </product-config>
+
+in zope.conf, rather than reindexing the object for each of them,
+reindexOnModify queues the object, and the queue is flushed once, just
+before the transaction commits. Catalog searches made later in the same
+transaction do not see the changes, so this is only suitable for sites
+whose code does not query the catalog for objects it has just modified.
+Without it, objects are reindexed right away.
+
+If the event says which fields were changed, and all of them are listed in
+the field_indexes property of the type's FTI, only the indexes listed for
+those fields are updated. The lines of that property look like this:
+
+    title: Title sortable_title SearchableText
+    subject: Subject SearchableText
+
+A modification that touches any other field reindexes the whole object.
+
+Optionally, indexing can be taken out of the request altogether. With
+
+    <product-config plone.dexterity>
+        async-indexing /Plone
+    </product-config>
+
+in zope.conf, new and modified objects are put into a persistent queue on
+the site instead, and a background thread with its own ZODB connection
+indexes them in batches after the request has committed. The value lists
+the paths of the sites whose queues the thread processes. Objects in other
+sites, and all objects without it, are indexed synchronously, as described
+above.
+"""
+import time
+import logging
+import threading
+
+import transaction
+
+from persistent import Persistent
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from ZODB.POSException import ConflictError
+
+from Acquisition import aq_base
+from Acquisition import aq_inner
+from Acquisition import aq_parent
+from AccessControl.SecurityManagement import getSecurityManager
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import setSecurityManager
+from AccessControl.SpecialUsers import system
+from Testing.makerequest import makerequest
+
+from zope.component.hooks import getSite
+from zope.component.hooks import setSite
+from zope.lifecycleevent.interfaces import IAttributes
+
+from plone.uuid.interfaces import IUUID
+
+from Products.CMFCore.utils import getToolByName
+
+from plone.dexterity.utils import queryFTI
+from plone.dexterity.utils import getProductConfig
+
+log = logging.getLogger(__name__)
+
+# Indexes that are always updated along with a partial reindex, because
+# the modification date changes
+MODIFICATION_INDEXES = ('modified',)
+
+_queue = threading.local()
+
+
+def parseFieldIndexes(lines):
+    """Parse the field_indexes property of an FTI into a dict mapping
+    field names to sets of index names
+    """
+    mapping = {}
+    for line in lines or ():
+        if ':' not in line:
+            continue
+        field, indexes = line.split(':', 1)
+        mapping.setdefault(field.strip(), set()).update(indexes.split())
+    return mapping
+
+
+def indexesForEvent(content, event):
+    """Return the set of indexes that need to be updated for the given
+    modified event, or None if the object must be reindexed in full.
+    """
+    descriptions = getattr(event, 'descriptions', None)
+    if not descriptions:
+        return None
+
+    fti = queryFTI(getattr(content, 'portal_type', None))
+    mapping = parseFieldIndexes(getattr(fti, 'field_indexes', None))
+    if not mapping:
+        return None
+
+    indexes = set(MODIFICATION_INDEXES)
+    for description in descriptions:
+        if not IAttributes.providedBy(description):
+            return None
+        for name in description.attributes:
+            if name not in mapping:
+                return None
+            indexes.update(mapping[name])
+    return indexes
+
+
+def deferredIndexingEnabled():
+    """Return True if deferring reindexing to the end of the transaction
+    has been enabled in zope.conf
+    """
+    return getProductConfig().get('deferred-indexing', '').lower() in ('on', 'true', 'yes', '1')
+
+
+def queueReindex(content, indexes=None):
+    """Queue the object to be reindexed when the current transaction
+    commits. indexes is a collection of index names, or None to reindex
+    all of them. Requests for the same object are merged.
+
+    If asynchronous indexing is enabled, the object is put into the site's
+    persistent indexing queue instead. If neither that nor deferred
+    indexing is enabled, the object is reindexed right away.
+    """
+    if asyncIndexingEnabled() and queueAsyncReindex(content, indexes):
+        # The modification date is updated now, not when the worker runs
+        content.notifyModified()
+        return
+
+    if not deferredIndexingEnabled():
+        reindex(content, indexes)
+        return
+
+    txn = transaction.get()
+    queue = getattr(_queue, 'queue', None)
+    if queue is None or _queue.transaction is not txn:
+        queue = _queue.queue = {}
+        _queue.transaction = txn
+        txn.addBeforeCommitHook(flushReindexQueue)
+
+    key = id(aq_base(content))
+    if key not in queue:
+        queue[key] = [content, indexes is not None and set(indexes) or None]
+        return
+
+    entry = queue[key]
+    entry[0] = content
+    if entry[1] is not None:
+        if indexes is None:
+            entry[1] = None
+        else:
+            entry[1].update(indexes)
+
+
+def flushReindexQueue():
+    """Reindex all objects queued in this thread. This is called before the
+    transaction commits.
+    """
+    queue = getattr(_queue, 'queue', None)
+    _queue.queue = _queue.transaction = None
+    if not queue:
+        return
+
+    catalogIndexes = {}
+    for content, indexes in queue.itervalues():
+        # Skip objects that were removed or moved after they were queued;
+        # moving an object reindexes it anyway
+        parent = aq_parent(aq_inner(content))
+        if parent is None:
+            continue
+        try:
+            current = parent._getOb(content.getId(), None)
+        except AttributeError:
+            current = None
+        if aq_base(current) is not aq_base(content):
+            continue
+
+        reindex(content, indexes, catalogIndexes)
+
+
+def reindex(content, indexes=None, catalogIndexes=None):
+    """Reindex the object. indexes is a collection of index names, or None
+    to reindex all of them. Names the catalog does not have are left out.
+    catalogIndexes is an optional dict used to remember the index names of
+    each catalog across calls.
+    """
+    if indexes is not None:
+        catalog = getToolByName(content, 'portal_catalog', None)
+        if catalog is None:
+            return
+        if catalogIndexes is None:
+            catalogIndexes = {}
+        key = id(aq_base(catalog))
+        if key not in catalogIndexes:
+            catalogIndexes[key] = set(catalog.indexes())
+        indexes = set(indexes) & catalogIndexes[key]
+
+    if indexes:
+        content.notifyModified()
+        content.reindexObject(idxs=sorted(indexes))
+    else:
+        content.reindexObject()
+
+
+# Asynchronous indexing
+
+# Attribute of the site holding its IndexingQueue
+QUEUE_KEY = '_dexterity_indexing_queue'
+
+# Running IndexingWorkers, by site path
+WORKERS = {}
+
+# How many times indexing an entry may fail before it is dropped
+MAX_INDEXING_ATTEMPTS = 3
+
+
+def asyncIndexingSites():
+    """Return the paths of the sites configured for asynchronous indexing
+    """
+    return getProductConfig().get('async-indexing', '').split()
+
+
+def asyncIndexingEnabled():
+    """Return True if asynchronous indexing has been enabled in zope.conf
+    """
+    return bool(asyncIndexingSites())
+
+
+class IndexingQueue(Persistent):
+    """A persistent queue of objects to be indexed, stored on the site.
+
+    Entries are kept in order of arrival and keyed by UID, so that a second
+    request for an object that is still queued is merged with the first.
+    Entries that failed to index are counted, see fail().
+    """
+
+    _failures = None
+
+    def __init__(self):
+        self._queue = OOBTree()
+        self._uids = OOBTree()
+        self._length = Length()
+
+    def __len__(self):
+        return self._length()
+
+    def put(self, uid, path, indexes=None, now=None):
+        """Queue the object with the given UID and physical path. indexes
+        is a collection of index names, or None for all of them.
+        """
+        if indexes is not None:
+            indexes = frozenset(indexes)
+
+        key = self._uids.get(uid)
+        if key is not None:
+            oldPath, oldIndexes = self._queue[key]
+            if oldIndexes is None or indexes is None:
+                indexes = None
+            else:
+                indexes = oldIndexes | indexes
+            self._queue[key] = (path, indexes)
+            return
+
+        if now is None:
+            now = time.time()
+        key = (now, uid)
+        self._queue[key] = (path, indexes)
+        self._uids[uid] = key
+        self._length.change(1)
+
+    def pop(self, count=None):
+        """Remove up to count of the oldest entries from the queue, and
+        return them as a list of (uid, path, indexes) tuples.
+        """
+        keys = self._queue.keys()
+        if count is not None:
+            keys = keys[:count]
+        entries = []
+        for key in list(keys):
+            path, indexes = self._queue.pop(key)
+            del self._uids[key[1]]
+            entries.append((key[1], path, indexes,))
+        self._length.change(-len(entries))
+        return entries
+
+    def fail(self, uid, path, indexes=None, now=None):
+        """Record that indexing a popped entry failed. The entry is queued
+        again, at the end, unless it has now failed MAX_INDEXING_ATTEMPTS
+        times, in which case it is dropped. Returns True if it was queued
+        again.
+        """
+        if self._failures is None:
+            self._failures = OOBTree()
+        failures = self._failures.get(uid, 0) + 1
+        if failures >= MAX_INDEXING_ATTEMPTS:
+            self._failures.pop(uid, None)
+            return False
+        self._failures[uid] = failures
+        self.put(uid, path, indexes, now)
+        return True
+
+    def succeed(self, uid):
+        """Forget the failures recorded for the entry
+        """
+        if self._failures is not None and uid in self._failures:
+            del self._failures[uid]
+
+    def failures(self, uid):
+        """Return how many times indexing the entry has failed so far
+        """
+        if self._failures is None:
+            return 0
+        return self._failures.get(uid, 0)
+
+    def lag(self, now=None):
+        """Return the number of seconds the oldest entry has been waiting
+        """
+        if not self._queue:
+            return 0.0
+        if now is None:
+            now = time.time()
+        return max(0.0, now - self._queue.minKey()[0])
+
+    def stats(self):
+        return {'depth': len(self), 'lag': self.lag()}
+
+
+def getIndexingQueue(site, create=False):
+    """Return the site's indexing queue, optionally creating it
+    """
+    queue = getattr(aq_base(site), QUEUE_KEY, None)
+    if queue is None and create:
+        queue = IndexingQueue()
+        setattr(site, QUEUE_KEY, queue)
+    return queue
+
+
+def queueAsyncReindex(content, indexes=None):
+    """Put the object into the current site's indexing queue. Returns False
+    if that is not possible, e.g. because the object has no UID yet, or
+    because the site is not configured for asynchronous indexing.
+    """
+    site = getSite()
+    uid = IUUID(content, None)
+    if site is None or uid is None:
+        return False
+    getPhysicalPath = getattr(site, 'getPhysicalPath', None)
+    if getPhysicalPath is None or '/'.join(getPhysicalPath()) not in asyncIndexingSites():
+        return False
+
+    getIndexingQueue(site, create=True).put(uid, content.getPhysicalPath(), indexes)
+    return True
+
+
+def processIndexingQueue(site, count=None):
+    """Index up to count objects from the site's indexing queue, in the
+    current transaction. Returns the number of entries processed.
+
+    This is what the worker thread does. Tests can call it directly to
+    process the queue synchronously.
+
+    An entry that fails to index is logged, its changes are rolled back if
+    the site is in a database, and it is queued again or dropped as
+    IndexingQueue.fail() decides, so that it cannot block the queue.
+    ConflictErrors are raised, so that the whole batch is retried.
+    """
+    queue = getIndexingQueue(site)
+    if queue is None:
+        return 0
+
+    entries = queue.pop(count)
+    if not entries:
+        return 0
+
+    catalog = getToolByName(site, 'portal_catalog', None)
+    if catalog is None:
+        return len(entries)
+    catalogIndexes = set(catalog.indexes())
+    jar = getattr(aq_base(site), '_p_jar', None)
+
+    for uid, path, indexes in entries:
+        savepoint = None
+        if jar is not None:
+            savepoint = jar.transaction_manager.get().savepoint(optimistic=True)
+        try:
+            _processEntry(site, catalog, catalogIndexes, uid, path, indexes)
+        except ConflictError:
+            raise
+        except Exception:
+            if savepoint is not None:
+                savepoint.rollback()
+            if queue.fail(uid, path, indexes):
+                log.exception("Indexing %s failed, it will be retried" % '/'.join(path))
+            else:
+                log.exception("Indexing %s failed %d times, giving up" % (
+                              '/'.join(path), MAX_INDEXING_ATTEMPTS))
+        else:
+            queue.succeed(uid)
+
+    return len(entries)
+
+
+def _processEntry(site, catalog, catalogIndexes, uid, path, indexes):
+    content = site.unrestrictedTraverse(path, None)
+    if content is None or IUUID(content, None) != uid:
+        # The object has been moved or removed since it was queued
+        content = None
+        for brain in catalog.unrestrictedSearchResults(UID=uid):
+            content = brain._unrestrictedGetObject()
+            break
+    if content is None:
+        return
+
+    if indexes is not None:
+        indexes = indexes & catalogIndexes
+    catalog.reindexObject(content, idxs=indexes and sorted(indexes) or [])
+
+
+def indexingQueueStatistics(site):
+    """Return the depth and lag of the site's indexing queue, and what the
+    worker for the site has done so far
+    """
+    queue = getIndexingQueue(site)
+    statistics = queue is not None and queue.stats() or {'depth': 0, 'lag': 0.0}
+    worker = None
+    getPhysicalPath = getattr(site, 'getPhysicalPath', None)
+    if getPhysicalPath is not None:
+        worker = WORKERS.get('/'.join(getPhysicalPath()))
+    if worker is not None:
+        statistics.update(worker.stats())
+    return statistics
+
+
+class IndexingWorker(threading.Thread):
+    """Process the indexing queue of a site in a background thread, with
+    its own connection to the database.
+
+    Every interval seconds, batches of batchSize entries are indexed and
+    committed until the queue is empty. A batch that fails with a
+    ConflictError is retried up to retries times; after that its entries
+    stay in the queue for the next round.
+    """
+
+    def __init__(self, db, path, interval=5.0, batchSize=100, retries=3):
+        threading.Thread.__init__(self, name='plone.dexterity indexing %s' % path)
+        self.daemon = True
+        self.db = db
+        self.path = path
+        self.interval = interval
+        self.batchSize = batchSize
+        self.retries = retries
+        self._stopped = threading.Event()
+        self.processed = 0
+        self.conflicts = 0
+        self.lastRun = None
+
+    def stats(self):
+        return {'processed': self.processed,
+                'conflicts': self.conflicts,
+                'lastRun': self.lastRun}
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        while not self._stopped.isSet():
+            try:
+                self.runOnce()
+            except Exception:
+                log.exception("Processing the indexing queue of %s failed" % self.path)
+            self._stopped.wait(self.interval)
+
+    def runOnce(self):
+        """Process the queue until it is empty. Returns the number of
+        entries processed.
+
+        The site is traversed from an application root wrapped in a request,
+        as the system user, so that code which looks up the request or
+        checks permissions while indexing works as it does in a request.
+        """
+        tm = transaction.TransactionManager()
+        connection = self.db.open(transaction_manager=tm)
+        oldSite = getSite()
+        oldSecurityManager = getSecurityManager()
+        newSecurityManager(None, system)
+        processed = 0
+        try:
+            while not self._stopped.isSet():
+                for attempt in range(self.retries + 1):
+                    tm.begin()
+                    app = makerequest(connection.root()['Application'])
+                    site = app.unrestrictedTraverse(self.path)
+                    setSite(site)
+                    try:
+                        count = processIndexingQueue(site, self.batchSize)
+                        tm.commit()
+                        break
+                    except ConflictError:
+                        tm.abort()
+                        self.conflicts += 1
+                else:
+                    log.warning("Giving up on a batch of the indexing queue of %s "
+                                "after %d conflicts" % (self.path, self.retries + 1))
+                    break
+
+                processed += count
+                self.processed += count
+                if count < self.batchSize:
+                    break
+        finally:
+            setSite(oldSite)
+            setSecurityManager(oldSecurityManager)
+            tm.abort()
+            connection.close()
+            self.lastRun = time.time()
+        return processed
+
+
+def startIndexingWorkers(event):
+    """Start a worker for each site configured for asynchronous indexing,
+    once the database has been opened
+    """
+    for path in asyncIndexingSites():
+        if path in WORKERS:
+            continue
+        worker = WORKERS[path] = IndexingWorker(event.database, path)
+        worker.start()
@@ -75,6 +75,24 @@ class IDexterityFTI(ITypeInformation):
                         u"package, e.g. my.package:model.xml"
         )
     
+    field_indexes = zope.schema.List(
+            title=u"Field indexes",
+            description=u"Catalog indexes to update when a field is modified, "
+                        u"one entry per field, e.g. 'title: Title sortable_title'. "
+                        u"Modifying a field that is not listed reindexes the "
+                        u"whole object.",
+            value_type=zope.schema.TextLine(title=u"Field and indexes"),
+            required=False
+        )
+
+    name_chooser = zope.schema.TextLine(
+            title=u"Name chooser",
+            description=u"Name of the INameChooser adapter used to choose "
+                        u"ids for content added to containers of this type. "
+                        u"If not given, the default name chooser is used.",
+            required=False
+        )
+
     hasDynamicSchema = zope.schema.Bool(
             title=u"Whether or not the FTI uses a dynamic schema.",
             readonly=True
@@ -115,6 +133,10 @@ class ISchemaInvalidatedEvent(Interface):
     """
     
     portal_type = zope.schema.TextLine(title=u"FTI name", required=False)
+    
+    changes = Attribute(u"A plone.dexterity.schema.SchemaChanges describing "
+                        u"how the type's schema changed, or None if not known. "
+                        u"If given, caches may invalidate selectively.")
 
 # Content
 
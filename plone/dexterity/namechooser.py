@@ -0,0 +1,115 @@
+"""Name choosers for containers with very many children.
+
+The usual name chooser looks for a free id by trying 'name', 'name-1',
+'name-2', ... in turn. In a large container with many items of the same
+title, that is one BTree lookup per existing item. The name choosers here
+choose a free id in constant time. They are opt-in: set the name_chooser
+property of a container type's FTI to the name of one of them.
+
+If two transactions choose the same id concurrently, adding the second
+object to the container's BTree raises a ConflictError, and the request is
+retried with a fresh id.
+"""
+import re
+import time
+import random
+
+from Acquisition import aq_base
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+
+from zope.component import adapts
+from zope.component import queryUtility
+from zope.container.contained import NameChooser
+
+from plone.dexterity.interfaces import IDexterityContainer
+
+try:
+    from plone.i18n.normalizer.interfaces import IURLNormalizer
+    HAS_NORMALIZER = True
+except ImportError:
+    HAS_NORMALIZER = False
+
+# Attribute of the container holding the counters of CountingNameChooser
+COUNTERS_KEY = '_dexterity_name_counters'
+
+_unsafe = re.compile(r'[^a-z0-9]+')
+
+
+def normalizeName(text):
+    """Turn a title into something that can be used in an id
+    """
+    if HAS_NORMALIZER:
+        normalizer = queryUtility(IURLNormalizer)
+        if normalizer is not None:
+            return normalizer.normalize(text)
+    if isinstance(text, unicode):
+        text = text.encode('ascii', 'ignore')
+    return _unsafe.sub('-', text.lower()).strip('-')
+
+def safeName(name):
+    """Return a name passed in as a str. Unicode names that are not plain
+    ASCII are normalized like titles.
+    """
+    if isinstance(name, unicode):
+        try:
+            return name.encode('ascii')
+        except UnicodeEncodeError:
+            return str(normalizeName(name) or 'item')
+    return name
+
+
+class CountingNameChooser(NameChooser):
+    """Choose names from the title of the object, like 'my-title', then
+    'my-title-1', 'my-title-2', ...
+
+    The container keeps a persistent counter for each base name, so that
+    the next free suffix is found without probing the taken ones.
+    """
+
+    adapts(IDexterityContainer)
+
+    def chooseName(self, name, object):
+        container = self.context
+        base = name and safeName(name) or normalizeName(getattr(aq_base(object), 'title', None) or u"") \
+            or normalizeName(getattr(aq_base(object), 'portal_type', None) or u"") \
+            or 'item'
+        name = base = str(base)
+
+        if name not in container:
+            return name
+
+        counters = getattr(aq_base(container), COUNTERS_KEY, None)
+        if counters is None:
+            counters = OOBTree()
+            setattr(container, COUNTERS_KEY, counters)
+
+        counter = counters.get(base)
+        if counter is None:
+            counter = counters[base] = Length()
+
+        while name in container:
+            counter.change(1)
+            name = "%s-%d" % (base, counter())
+
+        return name
+
+
+class TimeOrderedNameChooser(NameChooser):
+    """Choose unique names that sort in order of creation, made of the
+    current time in microseconds and a random part, e.g. '4d3a1c2b9e0f1-07c2'.
+    A name passed in is used as a prefix.
+    """
+
+    adapts(IDexterityContainer)
+
+    def chooseName(self, name, object):
+        container = self.context
+        if name:
+            name = safeName(name)
+        while True:
+            chosen = "%x-%04x" % (int(time.time() * 1000000), random.randrange(0x10000))
+            if name:
+                chosen = "%s-%s" % (name, chosen)
+            if chosen not in container:
+                return chosen
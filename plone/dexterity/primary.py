@@ -1,11 +1,8 @@
 from plone.dexterity.interfaces import IDexterityContent
-from plone.dexterity.interfaces import IDexterityFTI
-from plone.rfc822.interfaces import IPrimaryField
+from plone.dexterity.schema import SCHEMA_CACHE
 from plone.rfc822.interfaces import IPrimaryFieldInfo
 from zope.component import adapts
-from zope.component import getUtility
 from zope.interface import implements
-from zope.schema import getFieldsInOrder
 
 
 class PrimaryFieldInfo(object):
@@ -14,14 +11,16 @@ class PrimaryFieldInfo(object):
 
     def __init__(self, context):
         self.context = context
-        fti = getUtility(IDexterityFTI, name=context.portal_type)
-        self.schema = fti.lookupSchema()
+        profile = SCHEMA_CACHE.profile(context.portal_type)
+        # Only the main schema is looked at, as the value is read from the
+        # content object itself
         primary = [
-            (name, field) for name, field in getFieldsInOrder(self.schema)
-            if IPrimaryField.providedBy(field)
+            (name, field) for name, field in profile and profile.primaryFields or ()
+            if profile.schema.get(name) is field
             ]
         if not primary:
             raise TypeError('Could not adapt', context, IPrimaryFieldInfo)
+        self.schema = profile.schema
         self.fieldname, self.field = primary[0]
     
     @property
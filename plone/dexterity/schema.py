@@ -1,19 +1,45 @@
 import new
+import os
+import copy
+import time
+import cPickle
+import datetime
 import functools
+import hashlib
+import logging
 
 from threading import RLock
+from collections import OrderedDict
+from Acquisition import aq_base
+from BTrees.Length import Length
+from DateTime import DateTime
 from plone.synchronize import synchronized
 
 from zope.interface import implements, alsoProvides
+from zope.interface import directlyProvides, directlyProvidedBy
 from zope.interface.interface import InterfaceClass
 
 from zope.component import adapter
-from zope.component import queryUtility, getAllUtilitiesRegisteredFor
+from zope.component import queryUtility
+
+from zope.schema import getFieldsInOrder
+from zope.schema.interfaces import IField
 
 from plone.behavior.interfaces import IBehavior
 
+from Products.CMFCore.interfaces import ISiteRoot
+
+from plone.autoform.interfaces import IFormFieldProvider
+from plone.autoform.interfaces import READ_PERMISSIONS_KEY
+from plone.autoform.interfaces import WRITE_PERMISSIONS_KEY
+
+from plone.rfc822.interfaces import IPrimaryField
+
+from plone.supermodel import loadString, loadFile
 from plone.supermodel.parser import ISchemaPolicy
 from plone.supermodel.utils import syncSchema
+from plone.supermodel.utils import sortedFields
+from plone.supermodel.utils import mergedTaggedValueDict
 
 from plone.alterego.interfaces import IDynamicObjectFactory
 
@@ -25,37 +51,174 @@ from plone.dexterity.interfaces import ISchemaInvalidatedEvent
 from plone.dexterity import utils
 from plone.alterego import dynamic
 
+log = logging.getLogger(__name__)
+
 # Dynamic modules
 generated = dynamic.create('plone.dexterity.schema.generated')
 transient = new.module("transient")
 
 def invalidate_cache(fti):
-    fti._p_activate()
-    fti.__dict__.pop('_v_schema_get', None)
-    fti.__dict__.pop('_v_schema_subtypes', None)
+    """BBB: The cache is no longer stored in volatile attributes on the FTI,
+    so this is the same as calling SCHEMA_CACHE.invalidate(fti.getId())
+    """
+    SCHEMA_CACHE.invalidate(fti.getId())
+
+
+def _persistentKey(obj):
+    """Return a key that identifies an object (e.g. an FTI) across ZODB
+    connections.
+
+    Each thread sees its own copy of a persistent object, but the copies
+    share an oid. Objects that have not been persisted (e.g. in tests) are
+    keyed by identity instead.
+    """
+    oid = getattr(obj, '_p_oid', None)
+    if oid is None:
+        return id(obj)
+    return (obj._p_jar.db().database_name, oid)
+
+
+def _isValid(entry, fti, mtime):
+    if entry is None or entry[0] != mtime:
+        return False
+    return entry[1] is None or entry[1] is fti
 
 
 def volatile(func):
+    """Cache the return value of a SchemaCache method per FTI.
+
+    Cache hits are served from an immutable snapshot dict without taking
+    the cache lock. Only a miss will acquire the lock, compute the value and
+    publish a new snapshot.
+
+    The snapshot is shared by all connections, and entries are keyed by the
+    FTI's committed modification time. An FTI with uncommitted changes is
+    therefore neither looked up in nor added to the snapshot: its values
+    are computed on each call until the change is committed or aborted.
+    """
+    name = func.__name__
+
     @functools.wraps(func)
     def decorator(self, portal_type):
-        fti = queryUtility(IDexterityFTI, name=portal_type)
-        if fti is not None and self.cache_enabled:
-            key = '_v_schema_%s' % func.__name__
-            cache = getattr(fti, key, None)
-            if cache is not None:
-                mtime, value = cache
-                if fti._p_mtime == mtime:
-                    return value
+        fti = utils.queryFTI(portal_type)
+        if fti is None:
+            return func(self, fti)
+        if not self.cache_enabled:
+            with self.lock:
+                return func(self, fti)
+        if fti._p_changed:
+            return func(self, fti)
+
+        key = (name, portal_type, _persistentKey(fti))
+        mtime = fti._p_mtime
+        stats = self._getStats(name)
+
+        # Lock-free fast path. We rely on the snapshot never being mutated
+        # once it has been published.
+        entry = self._snapshot.get(key)
+        if _isValid(entry, fti, mtime):
+            stats['hits'] += 1
+            return entry[2]
+
+        start = time.time()
+        with self.lock:
+            stats['lockWaitTime'] += time.time() - start
+
+            # Someone else may have filled the cache whilst we were waiting
+            entry = self._snapshot.get(key)
+            if _isValid(entry, fti, mtime):
+                stats['hits'] += 1
+                return entry[2]
 
-        value = func(self, fti)
+            stats['misses'] += 1
+            if entry is not None:
+                # The FTI has been modified since the value was cached
+                stats['staleMisses'] += 1
 
-        if fti is not None and value is not None and self.cache_enabled:
-            setattr(fti, key, (fti._p_mtime, value))
+            start = time.time()
+            value = func(self, fti)
+            stats['computeTime'] += time.time() - start
+            if value is not None:
+                # Non-persistent FTIs are keyed by id(), so keep a reference
+                # to make sure we never confuse them with a later object
+                # that happens to reuse the same id.
+                owner = fti if getattr(fti, '_p_oid', None) is None else None
+                snapshot = self._snapshot.copy()
+                snapshot[key] = (mtime, owner, value)
+                self._snapshot = snapshot
 
         return value
     return decorator
 
 
+# Types of field defaults that can be handed out without copying them
+IMMUTABLE_TYPES = (type(None), bool, int, long, float, str, unicode,
+                   frozenset, DateTime, datetime.date, datetime.time,
+                   datetime.timedelta)
+
+
+def isImmutable(value):
+    if isinstance(value, tuple):
+        for item in value:
+            if not isImmutable(item):
+                return False
+        return True
+    return isinstance(value, IMMUTABLE_TYPES)
+
+
+class TypeProfile(object):
+    """Information about a portal type that is derived from its schemata.
+
+    Profiles are built by SCHEMA_CACHE.profile() and shared between threads,
+    so they must be treated as read-only.
+
+    schema is the type's main schema. behaviorSchemata are the form field
+    schemata of the registered behaviors enabled in the FTI, as iterSchemata()
+    finds them through DexterityBehaviorAssignable, and subtypes the marker
+    interfaces of those behaviors. schemata is the main schema followed by
+    the behavior schemata.
+
+    fields is the list of fields of all schemata, in order. fieldsByName maps
+    a field name to the first field with that name, and fieldNames lists
+    those names in order. primaryFields is a list
+    of (name, field) tuples for all fields marked as IPrimaryField.
+
+    readPermissions and writePermissions map field names in the main schema
+    to permission ids, as set with plone.autoform's directives.
+    """
+
+    def __init__(self, portal_type, schema, behaviorSchemata=(), subtypes=()):
+        self.portal_type = portal_type
+        self.schema = schema
+        self.behaviorSchemata = tuple(behaviorSchemata)
+        self.subtypes = tuple(subtypes)
+        self.schemata = (schema,) + self.behaviorSchemata
+
+        fields = []
+        fieldsByName = {}
+        fieldNames = []
+        primaryFields = []
+        for schemata in self.schemata:
+            for name, field in getFieldsInOrder(schemata):
+                fields.append(field)
+                if name not in fieldsByName:
+                    fieldsByName[name] = field
+                    fieldNames.append(name)
+                if IPrimaryField.providedBy(field):
+                    primaryFields.append((name, field))
+
+        self.fields = tuple(fields)
+        self.fieldsByName = fieldsByName
+        self.fieldNames = tuple(fieldNames)
+        self.primaryFields = tuple(primaryFields)
+
+        self.readPermissions = mergedTaggedValueDict(schema, READ_PERMISSIONS_KEY)
+        self.writePermissions = mergedTaggedValueDict(schema, WRITE_PERMISSIONS_KEY)
+
+    def __repr__(self):
+        return '<%s for %s>' % (self.__class__.__name__, self.portal_type)
+
+
 class SchemaCache(object):
     """Simple schema cache. 
     
@@ -77,14 +240,41 @@ class SchemaCache(object):
         >>> my_schema = SCHEMA_CACHE.get(portal_type)
         
     The cache uses the FTI's modification time as its invariant.
+
+    The cached values are kept in a copy-on-write snapshot dict that is
+    shared by all threads. Reads never take the lock; it is only used to
+    serialise misses, invalidation and clearing, each of which publishes a
+    new snapshot by swapping the dict reference atomically.
     """
     
     lock = RLock()
 
     def __init__(self, cache_enabled=True):
         self.cache_enabled = cache_enabled
+        self._snapshot = {}
+        self._stats = {}
+
+    def _getStats(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats.setdefault(name, dict(
+                hits=0, misses=0, staleMisses=0, lockWaitTime=0.0, computeTime=0.0))
+        return stats
+
+    def stats(self):
+        """Return a dict with the statistics for each cached method: the
+        number of hits and misses, how many misses were caused by the FTI
+        being modified, and the time spent waiting for the cache lock and
+        computing values. Hits are counted without locking, so the numbers
+        are approximate.
+        """
+        stats = dict([(name, dict(values)) for name, values in self._stats.items()])
+        stats['size'] = len(self._snapshot)
+        return stats
+
+    def resetStats(self):
+        self._stats = {}
 
-    @synchronized(lock)
     @volatile
     def get(self, fti):
         if fti is None:
@@ -94,7 +284,6 @@ class SchemaCache(object):
         except (AttributeError, ValueError):
             pass
 
-    @synchronized(lock)
     @volatile
     def subtypes(self, fti):
         if fti is None:
@@ -106,33 +295,618 @@ class SchemaCache(object):
                 subtypes.append(behavior.marker)
         return tuple(subtypes)
 
+    @volatile
+    def behaviorRegistrations(self, fti):
+        """Return the registrations of the behaviors enabled for the given
+        portal_type, as a tuple.
+        """
+        if fti is None:
+            return ()
+        registrations = []
+        for behavior_name in fti.behaviors:
+            behavior = queryUtility(IBehavior, name=behavior_name)
+            if behavior is not None:
+                registrations.append(behavior)
+        return tuple(registrations)
+
+    @volatile
+    def behaviorInterfaces(self, fti):
+        """Return a frozenset of all interfaces provided by the behaviors
+        enabled for the given portal_type, including their bases.
+        """
+        if fti is None:
+            return frozenset()
+        interfaces = set()
+        for behavior in self.behaviorRegistrations(fti.getId()):
+            interfaces.update(behavior.interface._implied)
+        return frozenset(interfaces)
+
+    @volatile
+    def behaviorSchemata(self, fti):
+        """Return the form field schemata of the behaviors enabled for the
+        given portal_type, as a tuple. Behaviors without a registration
+        are resolved as dotted names.
+        """
+        if fti is None:
+            return ()
+        schemata = []
+        for behavior_name in fti.behaviors:
+            behavior_interface = None
+            behavior_instance = queryUtility(IBehavior, name=behavior_name)
+            if not behavior_instance:
+                try:
+                    behavior_interface = utils.resolveDottedName(behavior_name)
+                except (ValueError, ImportError):
+                    log.warning("Error resolving behaviour %s", behavior_name)
+                    continue
+            else:
+                behavior_interface = behavior_instance.interface
+
+            if behavior_interface is not None:
+                behavior_schema = IFormFieldProvider(behavior_interface, None)
+                if behavior_schema is not None:
+                    schemata.append(behavior_schema)
+        return tuple(schemata)
+
+    @volatile
+    def registeredBehaviorSchemata(self, fti):
+        """Return the form field schemata of the registered behaviors
+        enabled for the given portal_type, as a tuple. These are the
+        schemata of the behaviors DexterityBehaviorAssignable enumerates;
+        unlike behaviorSchemata(), behaviors named by dotted name only are
+        left out.
+        """
+        if fti is None:
+            return ()
+        schemata = []
+        for behavior in self.behaviorRegistrations(fti.getId()):
+            behavior_schema = IFormFieldProvider(behavior.interface, None)
+            if behavior_schema is not None:
+                schemata.append(behavior_schema)
+        return tuple(schemata)
+
+    @volatile
+    def profile(self, fti):
+        """Return the TypeProfile for the given portal_type, or None if the
+        type's schema cannot be found.
+        """
+        if fti is None:
+            return None
+        portal_type = fti.getId()
+        schema = self.get(portal_type)
+        if schema is None:
+            return None
+        behaviorSchemata = self.registeredBehaviorSchemata(portal_type)
+        return TypeProfile(portal_type, schema, behaviorSchemata,
+                           self.subtypes(portal_type))
+
+    @volatile
+    def defaults(self, fti):
+        """Return a dict mapping the names of the fields in the schema and
+        subtypes of the given portal_type to a tuple (copy, value).
+
+        If copy is False, value is the field's default, which is immutable
+        and can be used as-is. Otherwise, value is the field, and its
+        default must be copied (or computed by its defaultFactory) each
+        time it is needed.
+
+        Like get(), this returns None if the schema cannot be found.
+        """
+        if fti is None:
+            return None
+        portal_type = fti.getId()
+        schema = self.get(portal_type)
+        if schema is None:
+            return None
+
+        defaults = {}
+        for schema in (schema,) + self.subtypes(portal_type):
+            for name in schema:
+                field = schema[name]
+                if name in defaults or not IField.providedBy(field):
+                    continue
+                if getattr(field, 'defaultFactory', None) is None and \
+                        isImmutable(field.default):
+                    defaults[name] = (False, field.default)
+                else:
+                    defaults[name] = (True, field)
+        return defaults
+
     @synchronized(lock)
     def clear(self):
-        for fti in getAllUtilitiesRegisteredFor(IDexterityFTI):
-            invalidate_cache(fti)
-
+        self._snapshot = {}
 
     @synchronized(lock)
     def invalidate(self, portal_type):
-        fti = queryUtility(IDexterityFTI, name=portal_type)
-        if fti is not None:
-            invalidate_cache(fti)
+        self._snapshot = dict(
+            (key, value) for key, value in self._snapshot.items()
+            if key[1] != portal_type
+            )
 
 
 SCHEMA_CACHE = SchemaCache()
 
+def _sourceKey(model_source, policy):
+    if isinstance(model_source, unicode):
+        model_source = model_source.encode('utf-8')
+    return ('source', hashlib.sha1(model_source).hexdigest(), policy)
+
+def _fileKey(model_file, policy):
+    info = os.stat(model_file)
+    return ('file', model_file, info.st_mtime, info.st_size, policy)
+
+def _modelKey(fti):
+    """Return a key that changes whenever the FTI's model changes, or None
+    if the FTI has no model source or file.
+    """
+    if fti.model_source:
+        return _sourceKey(fti.model_source, fti.schema_policy)
+    elif fti.model_file:
+        try:
+            return _fileKey(fti._absModelFile(), fti.schema_policy)
+        except (ValueError, OSError):
+            return None
+    return None
+
+class ModelCache(object):
+    """Cache of parsed models.
+
+    Parsing a model's XML is expensive, and the model is needed every time
+    a dynamic schema is loaded or re-synced. Models loaded
+    from a string are keyed by a hash of the source, and models loaded from
+    a file by the file's path, modification time and size. The schema policy
+    is part of the key, since it determines the schemata that are created.
+
+    The same model is returned for the same source, so it must only be
+    read. The cache is only used, through lookupCachedModel(), to generate
+    and re-sync schemata, which deep-copies the fields and tagged values,
+    so that generated schemata never share them with the cached model or
+    with each other. DexterityFTI.lookupModel()
+    parses the model afresh each time, so callers are free to modify what
+    it returns.
+    """
+
+    lock = RLock()
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def loadString(self, model_source, policy=u""):
+        return self._lookup(_sourceKey(model_source, policy),
+                            loadString, model_source, policy=policy)
+
+    def loadFile(self, model_file, policy=u""):
+        try:
+            key = _fileKey(model_file, policy)
+        except OSError:
+            return loadFile(model_file, reload=True, policy=policy)
+        return self._lookup(key, loadFile, model_file, reload=True, policy=policy)
+
+    def _lookup(self, key, loader, *args, **kwargs):
+        model = self._models.get(key)
+        if model is not None:
+            self.hits += 1
+            return model
+
+        model = loader(*args, **kwargs)
+
+        with self.lock:
+            self.misses += 1
+            self._models[key] = model
+            while len(self._models) > self.maxsize:
+                self._models.popitem(last=False)
+        return model
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._models))
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+
+    @synchronized(lock)
+    def clear(self):
+        self._models.clear()
+        self.resetStats()
+
+MODEL_CACHE = ModelCache()
+
+def lookupCachedModel(fti):
+    """Return the FTI's model, from MODEL_CACHE if possible. The model may
+    be shared, so it must not be modified.
+    """
+    # Look the method up on the class, so that FTIs other than DexterityFTI
+    # (and mocks of it in tests) fall back to lookupModel()
+    lookup = getattr(type(fti), '_lookupCachedModel', None)
+    if lookup is None:
+        return fti.lookupModel()
+    return lookup(fti)
+
+class SchemaSnapshot(object):
+    """On-disk snapshot of the dynamic schemata.
+
+    Generating a dynamic schema means parsing its model, which is slow when
+    a process is restarted with many through-the-web types. When a snapshot
+    file is configured in zope.conf, the fields, bases and tagged values of
+    each schema generated by SchemaModuleFactory are pickled to it, and
+    read back from it in later processes:
+
+        <product-config plone.dexterity>
+            schema-snapshot /path/to/var/dexterity-schemata.pickle
+        </product-config>
+
+    Entries are keyed by schema name, which contains the site path and the
+    portal_type, and are only used if the model source (or the model file's
+    path, modification time and size) and schema policy still match.
+    Schemata that cannot be pickled are simply parsed each time.
+    """
+
+    lock = RLock()
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._entries = None
+        self._entriesFilename = None
+
+    def getFilename(self):
+        if self.filename is not None:
+            return self.filename
+        return utils.getProductConfig().get('schema-snapshot')
+
+    def _load(self, filename):
+        if self._entries is None or self._entriesFilename != filename:
+            entries = {}
+            if os.path.exists(filename):
+                try:
+                    with open(filename, 'rb') as f:
+                        entries = cPickle.load(f)
+                except Exception, e:
+                    log.warning("Ignoring schema snapshot %s: %s" % (filename, e))
+            self._entries = entries
+            self._entriesFilename = filename
+        return self._entries
+
+    @synchronized(lock)
+    def get(self, name, key):
+        """Return an interface with the snapshot of the named schema, or None
+        if there is no snapshot for the given model key.
+        """
+        filename = self.getFilename()
+        if not filename:
+            return None
+
+        entry = self._load(filename).get(name)
+        if entry is None or entry[0] != key:
+            return None
+
+        try:
+            bases, fields, tags = cPickle.loads(entry[1])
+        except Exception, e:
+            log.warning("Ignoring schema snapshot for %s: %s" % (name, e))
+            return None
+
+        source = InterfaceClass('__snapshot__' + name, bases, dict(fields),
+                                __module__=transient.__name__)
+        for tag, value in tags.items():
+            source.setTaggedValue(tag, value)
+        return source
+
+    @synchronized(lock)
+    def set(self, name, key, source):
+        """Save a snapshot of the given source schema under the given name,
+        for the given model key.
+        """
+        filename = self.getFilename()
+        if not filename:
+            return
+
+        fields = []
+        for fieldName, field in getFieldsInOrder(source):
+            clone = field.__class__.__new__(field.__class__)
+            clone.__dict__.update(field.__dict__)
+            clone.interface = None
+            fields.append((fieldName, clone,))
+        tags = dict([(tag, source.getTaggedValue(tag))
+                     for tag in source.getTaggedValueTags()])
+
+        try:
+            data = cPickle.dumps((source.__bases__, fields, tags), 2)
+        except Exception, e:
+            log.debug("Unable to save schema snapshot for %s: %s" % (name, e))
+            return
+
+        entries = self._load(filename)
+        entries[name] = (key, data)
+
+        # Write to a temporary file and rename it, so that other processes
+        # never see a partially written snapshot
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                cPickle.dump(entries, f, 2)
+            os.rename(tmp, filename)
+        except (IOError, OSError), e:
+            log.warning("Unable to write schema snapshot %s: %s" % (filename, e))
+
+    @synchronized(lock)
+    def clear(self):
+        self._entries = None
+        self._entriesFilename = None
+
+SCHEMA_SNAPSHOT = SchemaSnapshot()
+
 class SchemaInvalidatedEvent(object):
     implements(ISchemaInvalidatedEvent)
     
-    def __init__(self, portal_type):
+    def __init__(self, portal_type, changes=None):
         self.portal_type = portal_type
+        self.changes = changes
 
 @adapter(ISchemaInvalidatedEvent)
 def invalidate_schema(event):
+    # If the model was saved without changing any schema, other processes
+    # need not re-sync either
+    changes = getattr(event, 'changes', None)
+    if changes is not None and not changes:
+        return
+    
     if event.portal_type:
         SCHEMA_CACHE.invalidate(event.portal_type)
     else:
         SCHEMA_CACHE.clear()
+    bumpSchemaGeneration()
+
+# Incremental schema sync
+
+# Field attributes that are only used for display
+LABEL_ATTRIBUTES = ('title', 'description', '__doc__',)
+
+class SchemaChanges(object):
+    """The differences between two versions of a schema, as a set of field
+    names for each kind of change, and the set of changed tagged values.
+    """
+
+    def __init__(self):
+        self.added = set()
+        self.removed = set()
+        self.changed = set()
+        self.relabelled = set()
+        self.taggedValues = set()
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed or
+                    self.relabelled or self.taggedValues)
+
+    def update(self, other):
+        """Add the changes in other, e.g. to another schema of the same
+        model, to these
+        """
+        self.added.update(other.added)
+        self.removed.update(other.removed)
+        self.changed.update(other.changed)
+        self.relabelled.update(other.relabelled)
+        self.taggedValues.update(other.taggedValues)
+
+    def __repr__(self):
+        return '<%s added=%s removed=%s changed=%s relabelled=%s taggedValues=%s>' % (
+            self.__class__.__name__, sorted(self.added), sorted(self.removed),
+            sorted(self.changed), sorted(self.relabelled), sorted(self.taggedValues))
+
+def _fieldState(field):
+    state = field.__dict__.copy()
+    for name in ('interface', 'order', '__provides__',):
+        state.pop(name, None)
+    return field.__class__, tuple(directlyProvidedBy(field)), state
+
+def diffSchema(source, dest):
+    """Return a SchemaChanges describing what syncSchemaChanges(source, dest)
+    would change in dest.
+    """
+    changes = SchemaChanges()
+
+    for name, field in sortedFields(dest):
+        if name not in source:
+            changes.removed.add(name)
+
+    for name, field in sortedFields(source):
+        if name not in dest or dest[name].interface is not dest:
+            changes.added.add(name)
+            continue
+
+        sourceClass, sourceProvides, sourceState = _fieldState(field)
+        destClass, destProvides, destState = _fieldState(dest[name])
+        if sourceClass is not destClass or sourceProvides != destProvides:
+            changes.changed.add(name)
+        elif sourceState != destState:
+            for attribute in LABEL_ATTRIBUTES:
+                sourceState.pop(attribute, None)
+                destState.pop(attribute, None)
+            if sourceState == destState:
+                changes.relabelled.add(name)
+            else:
+                changes.changed.add(name)
+
+    destTags = set(dest.getTaggedValueTags())
+    for tag in source.getTaggedValueTags():
+        if tag not in destTags or source.getTaggedValue(tag) != dest.getTaggedValue(tag):
+            changes.taggedValues.add(tag)
+
+    return changes
+
+def _cloneField(field, dest, name):
+    # The source is usually a model shared through MODEL_CACHE, so the clone
+    # gets its own copies of the field's attributes, e.g. its value_type,
+    # vocabulary or a mutable default
+    state = field.__dict__.copy()
+    for attribute in ('interface', '__provides__',):
+        state.pop(attribute, None)
+    clone = field.__class__.__new__(field.__class__)
+    clone.__dict__.update(copy.deepcopy(state))
+    clone.interface = dest
+    clone.__name__ = name
+    directlyProvides(clone, *directlyProvidedBy(field))
+    return clone
+
+def syncSchemaChanges(source, dest):
+    """Like syncSchema(source, dest, overwrite=True), but only replaces the
+    fields and tagged values that have actually changed. Fields whose title
+    or description changed are updated in place, so references to them stay
+    valid. Added and changed fields and tagged values are deep copies, so
+    changing dest in place never changes source. Returns the SchemaChanges
+    that were applied.
+    """
+    changes = diffSchema(source, dest)
+    attrs = dest._InterfaceClass__attrs
+    v_attrs = getattr(dest, '_v_attrs', None)
+
+    for name in changes.removed:
+        del attrs[name]
+        if v_attrs is not None:
+            v_attrs.pop(name, None)
+
+    for name, field in sortedFields(source):
+        if name in changes.added or name in changes.changed:
+            clone = _cloneField(field, dest, name)
+            attrs[name] = clone
+            if v_attrs is not None:
+                v_attrs[name] = clone
+        else:
+            existing = dest[name]
+            if name in changes.relabelled:
+                for attribute in LABEL_ATTRIBUTES:
+                    if attribute in field.__dict__:
+                        setattr(existing, attribute, field.__dict__[attribute])
+            # Keep the fields in the same order as in the source
+            existing.order = field.order
+
+    for tag in changes.taggedValues:
+        dest.setTaggedValue(tag, copy.deepcopy(source.getTaggedValue(tag)))
+
+    return changes
+
+def syncModelChanges(portal_type, model, prefix=None):
+    """Apply syncSchemaChanges() to each schema of the model, main and
+    named, that has been generated for the portal_type in this process.
+    Returns the SchemaChanges of all of them together, or None if they are
+    not known because a schema of the model has not been loaded yet, or a
+    loaded schema is no longer in the model.
+    """
+    if prefix is None:
+        prefix = utils.getSitePrefix()
+    loaded = _loadedSchemata(prefix).get(portal_type, set())
+    if loaded != set(model.schemata.keys()):
+        known = False
+    else:
+        known = True
+
+    changes = SchemaChanges()
+    for schemaName, schemata in model.schemata.items():
+        name = utils.portalTypeToSchemaName(portal_type, schemaName, prefix=prefix)
+        schema = generated.__dict__.get(name)
+        if schema is not None:
+            changes.update(syncSchemaChanges(schemata, schema))
+    if not known:
+        return None
+    return changes
+
+# Schema generation counter
+#
+# The schema cache and the generated schemata live in memory, so each ZEO
+# client has its own copy. Whenever a schema is invalidated, we increment a
+# persistent counter on the site root. Every process compares the counter
+# with the generation it last synchronised at the start of each request, and
+# re-syncs its generated schemata if it has changed. The first time a
+# process sees a site, it only records the generation: any schemata it has
+# loaded so far were generated from the current models.
+
+SCHEMA_GENERATION_KEY = '_dexterity_schema_generation'
+
+_syncedGenerations = {}
+_syncedGenerationsLock = RLock()
+
+def getSchemaGeneration(site):
+    """Return the current schema generation for the given site
+    """
+    counter = getattr(aq_base(site), SCHEMA_GENERATION_KEY, None)
+    if counter is None:
+        return 0
+    return counter()
+
+def bumpSchemaGeneration(site=None):
+    """Increment the schema generation for the given site, or the current
+    site if none is given. The counter resolves conflicts, so concurrent
+    schema changes on different clients will not cause ConflictErrors.
+    """
+    if site is None:
+        site = queryUtility(ISiteRoot)
+        if site is None:
+            return
+    counter = getattr(aq_base(site), SCHEMA_GENERATION_KEY, None)
+    if counter is None:
+        counter = Length()
+        setattr(site, SCHEMA_GENERATION_KEY, counter)
+    counter.change(1)
+
+def _loadedSchemata(prefix):
+    """Return a dict mapping the portal types of the site with the given
+    prefix to the set of the names of their schemata that have been
+    generated in this process. The main schema's name is the empty string.
+    """
+    loaded = {}
+    for name, schema in generated.__dict__.items():
+        if not isinstance(schema, InterfaceClass):
+            continue
+        try:
+            schemaPrefix, portal_type, schemaName = utils.splitSchemaName(name)
+        except ValueError:
+            continue
+        if schemaPrefix == prefix:
+            loaded.setdefault(portal_type, set()).add(schemaName)
+    return loaded
+
+def syncSchemaGeneration(site, event=None):
+    """Re-sync the generated schemata for the given site if the schema
+    generation has changed since this process last looked at it.
+
+    This is registered as a subscriber for the site's IBeforeTraverseEvent,
+    so it is called at the start of each request.
+    """
+    key = _persistentKey(aq_base(site))
+    generation = getSchemaGeneration(site)
+    synced = _syncedGenerations.get(key)
+    if synced == generation:
+        return
+
+    with _syncedGenerationsLock:
+        synced = _syncedGenerations.get(key)
+        if synced == generation:
+            return
+        if synced is None:
+            _syncedGenerations[key] = generation
+            return
+
+        prefix = utils.getSitePrefix(site)
+        loaded = _loadedSchemata(prefix)
+        for fti in site.getSiteManager().getAllUtilitiesRegisteredFor(IDexterityFTI):
+            if not (fti.model_source or fti.model_file):
+                continue
+            # Schemata that have not been loaded yet will be created from
+            # the current model by SchemaModuleFactory
+            portal_type = fti.getId()
+            if portal_type not in loaded:
+                continue
+            try:
+                model = lookupCachedModel(fti)
+            except Exception, e:
+                log.error("Unable to re-sync schema for %s: %s" % (portal_type, e))
+                continue
+            syncModelChanges(portal_type, model, prefix)
+
+        SCHEMA_CACHE.clear()
+        _syncedGenerations[key] = generation
 
 # Dynamic module factory
 
@@ -144,6 +918,23 @@ class SchemaModuleFactory(object):
     
     lock = RLock()
     _transient_SCHEMA_CACHE = {}
+    _stats = dict(calls=0, transient=0, generated=0, snapshotHits=0, time=0.0)
+    
+    @classmethod
+    def stats(cls):
+        """Return a dict with the number of times the factory was called,
+        how many of those created a transient schema, how many generated a
+        schema from an FTI (and how many of those were read from the
+        snapshot), and the total time spent.
+        """
+        return dict(cls._stats)
+    
+    @classmethod
+    @synchronized(lock)
+    def resetStats(cls):
+        for key in cls._stats:
+            cls._stats[key] = 0
+        cls._stats['time'] = 0.0
     
     @synchronized(lock)
     def __call__(self, name, module):
@@ -168,6 +959,14 @@ class SchemaModuleFactory(object):
         except ValueError:
             return None
         
+        start = time.time()
+        self._stats['calls'] += 1
+        try:
+            return self._create(name, module, schemaName, portal_type)
+        finally:
+            self._stats['time'] += time.time() - start
+    
+    def _create(self, name, module, schemaName, portal_type):
         if name in self._transient_SCHEMA_CACHE:
             schema = self._transient_SCHEMA_CACHE[name]
         else:
@@ -182,12 +981,33 @@ class SchemaModuleFactory(object):
             if is_default_schema:
                 alsoProvides(schema, IContentType)
         
-        fti = queryUtility(IDexterityFTI, name=portal_type)
+        fti = utils.queryFTI(portal_type)
         if fti is None and name not in self._transient_SCHEMA_CACHE:
+            self._stats['transient'] += 1
             self._transient_SCHEMA_CACHE[name] = schema
         elif fti is not None:
-            model = fti.lookupModel()            
-            syncSchema(model.schemata[schemaName], schema, sync_bases=True)
+            self._stats['generated'] += 1
+            source = None
+            key = None
+            if SCHEMA_SNAPSHOT.getFilename():
+                key = _modelKey(fti)
+                if key is not None:
+                    source = SCHEMA_SNAPSHOT.get(name, key)
+                    if source is not None:
+                        self._stats['snapshotHits'] += 1
+
+            if source is None:
+                model = lookupCachedModel(fti)
+                source = model.schemata[schemaName]
+                if key is not None:
+                    SCHEMA_SNAPSHOT.set(name, key, source)
+
+            # The source is shared with MODEL_CACHE, and with the schemata
+            # of other sites using the same model, so the generated schema
+            # gets its own copies of the fields and tagged values. syncSchema
+            # then only adds the bases.
+            syncSchemaChanges(source, schema)
+            syncSchema(source, schema, sync_bases=True)
 
             # Save this schema in the module - this factory will not be
             # called again for this name
@@ -199,6 +1019,25 @@ class SchemaModuleFactory(object):
 
         return schema
 
+def getCacheStatistics():
+    """Return the statistics of SCHEMA_CACHE, MODEL_CACHE, the
+    SchemaModuleFactory and the dotted name resolver as a dict
+    """
+    return {
+        'schemaCache': SCHEMA_CACHE.stats(),
+        'modelCache': MODEL_CACHE.stats(),
+        'schemaModuleFactory': SchemaModuleFactory.stats(),
+        'dottedNames': utils.DOTTED_NAME_RESOLVER.stats(),
+        }
+
+def resetCacheStatistics():
+    """Reset the statistics returned by getCacheStatistics()
+    """
+    SCHEMA_CACHE.resetStats()
+    MODEL_CACHE.resetStats()
+    SchemaModuleFactory.resetStats()
+    utils.DOTTED_NAME_RESOLVER.resetStats()
+
 class DexteritySchemaPolicy(object):
     """Determines how and where imported dynamic interfaces are created.
     Note that these schemata are never used directly. Rather, they are merged
@@ -0,0 +1,190 @@
+"""Optional request scoped memoization of permission checks.
+
+Rendering a listing checks the read permission of every protected field of
+every item, and most of those checks give the same answer: items in the
+same folder usually have the same permission settings and grant the current
+user the same local roles. checkPermission() remembers the outcome of each
+check for the rest of the request, keyed by
+
+  * the permission,
+  * the user, their groups and their global roles, and
+  * the role map of the object: for the object and each of its containers,
+    the local roles granted to the user or their groups, whether local
+    roles are blocked, and how the permission is set. Containers are also
+    keyed by identity, and the object by its class, portal_type and
+    directly provided interfaces.
+
+Because the key is made from the role settings themselves rather than from
+the identity of the objects holding them, granting a local role, changing a
+workflow state or changing a permission setting during the request gives a
+new key, and the old result is not used any more.
+
+Local roles that are not stored in __ac_local_roles__ are not part of the
+key. In particular, roles computed by borg.localrole's ILocalRoleProvider
+adapters, e.g. for workspaces or sharing by group, would be ignored, and a
+result memoized for one object could be wrongly reused for another. The
+memo is therefore opt-in. Enable it with
+
+    <product-config plone.dexterity>
+        permission-memo on
+    </product-config>
+
+in zope.conf only if the site uses no local role providers other than the
+default one, which reads __ac_local_roles__. Code that changes group
+memberships during a request should call clearPermissionMemo().
+
+Checks made from within restricted code are not memoized, because the
+executable's proxy roles and owner affect the result.
+"""
+from Acquisition import aq_base
+from Acquisition import aq_chain
+from Acquisition import aq_inner
+from AccessControl import getSecurityManager
+from AccessControl.Permission import pname
+
+from zope.annotation.interfaces import IAnnotations
+
+from plone.dexterity.utils import getProductConfig
+
+try:
+    from zope.globalrequest import getRequest
+except ImportError:
+    getRequest = None
+
+# Key of the memo in the request annotations
+MEMO_KEY = 'plone.dexterity.security.permissions'
+
+_marker = object()
+_empty = {}
+
+
+def _getSetting(base, name):
+    # Read a security setting from the instance or its class. This avoids
+    # DexterityContent.__getattr__, which would look the name up in the
+    # schema. The object must not be a ghost.
+    value = getattr(base, '__dict__', _empty).get(name, _marker)
+    if value is _marker:
+        value = getattr(base.__class__, name, None)
+    return value
+
+
+def _getRequest(context):
+    if getRequest is not None:
+        return getRequest()
+    # Look for the request from the top of the acquisition chain down, which
+    # finds the request container of the application straight away and
+    # avoids DexterityContent.__getattr__. Classes set REQUEST to the
+    # Acquired marker, so only instances are looked at.
+    for obj in reversed(aq_chain(context)):
+        request = getattr(aq_base(obj), '__dict__', _empty).get('REQUEST')
+        if request is not None:
+            return request
+    return None
+
+
+def _getMemo(request, create=False):
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return None
+    memo = annotations.get(MEMO_KEY)
+    if memo is None and create:
+        memo = annotations[MEMO_KEY] = {}
+    return memo
+
+
+# Attribute names of permissions, by permission title
+_permissionAttributes = {}
+
+
+def _normalizeRoles(roles):
+    # A list of roles means the permission is also acquired, a tuple means
+    # it is not
+    if roles is None or isinstance(roles, basestring):
+        return roles
+    return (isinstance(roles, list), tuple(roles),)
+
+
+def roleMapKey(context, permission, principals):
+    """Return a hashable key describing everything that decides whether the
+    given principals have the permission on context, apart from their
+    global roles.
+    """
+    attribute = _permissionAttributes.get(permission)
+    if attribute is None:
+        attribute = _permissionAttributes[permission] = pname(permission)
+
+    key = []
+    for obj in aq_chain(aq_inner(context), True):
+        base = aq_base(obj)
+        # This also activates ghosts
+        localRoles = getattr(base, '__ac_local_roles__', None)
+        if callable(localRoles):
+            localRoles = localRoles()
+        if localRoles:
+            localRoles = tuple([tuple(localRoles.get(principal, ()))
+                                for principal in principals])
+        else:
+            localRoles = None
+        if key:
+            identity = id(base)
+        else:
+            identity = (base.__class__,
+                        _getSetting(base, 'portal_type'),
+                        _getSetting(base, '__provides__'),)
+        key.append((identity,
+                    localRoles,
+                    _getSetting(base, '__ac_local_roles_block__'),
+                    _normalizeRoles(_getSetting(base, attribute)),))
+    return tuple(key)
+
+
+def permissionMemoEnabled():
+    """Return True if the permission memo has been enabled in zope.conf
+    """
+    return getProductConfig().get('permission-memo', '').lower() in ('on', 'true', 'yes', '1')
+
+
+def checkPermission(permission, context):
+    """Check whether the current user has the permission with the given
+    title on context, like getSecurityManager().checkPermission(). If the
+    permission memo is enabled, remember the result for the rest of the
+    request.
+    """
+    securityManager = getSecurityManager()
+    if not permissionMemoEnabled():
+        return securityManager.checkPermission(permission, context)
+
+    request = _getRequest(context)
+    if request is None or securityManager.calledByExecutable():
+        return securityManager.checkPermission(permission, context)
+
+    memo = _getMemo(request, create=True)
+    if memo is None:
+        return securityManager.checkPermission(permission, context)
+
+    user = securityManager.getUser()
+    principals = (user.getId(),)
+    getGroups = getattr(user, 'getGroups', None)
+    if getGroups is not None:
+        principals += tuple(getGroups() or ())
+
+    key = (permission, principals, tuple(user.getRoles()),
+           roleMapKey(context, permission, principals),)
+    try:
+        return memo[key]
+    except KeyError:
+        result = memo[key] = securityManager.checkPermission(permission, context)
+        return result
+
+
+def clearPermissionMemo(request=None):
+    """Forget the permission checks memoized for the request, or for the
+    current request if none is given
+    """
+    if request is None and getRequest is not None:
+        request = getRequest()
+    if request is None:
+        return
+    memo = _getMemo(request)
+    if memo is not None:
+        memo.clear()
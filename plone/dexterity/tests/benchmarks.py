@@ -0,0 +1,602 @@
+"""Micro-benchmarks for Dexterity's hot paths.
+
+These are not part of the test suite. Run them with an interpreter that has
+the package and its dependencies on the path, e.g.:
+
+    $ bin/zopepy -m plone.dexterity.tests.benchmarks [name ...]
+
+If no names are given, all benchmarks are run.
+"""
+import sys
+import threading
+import time
+
+from persistent import Persistent
+
+from zope.interface import Interface
+from zope.component import provideUtility
+
+import zope.component.testing
+import zope.schema
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def report(name, count, elapsed, unit='calls'):
+    rate = elapsed and count / elapsed or 0
+    print "%-50s %10d %s in %7.3fs (%12.0f/s)" % (
+        name, count, unit, elapsed, rate)
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+class IBenchmarkSchema(Interface):
+
+    foo = zope.schema.TextLine(title=u"foo", default=u"foo_default")
+    bar = zope.schema.List(title=u"bar", value_type=zope.schema.TextLine())
+
+
+def setUpType(portal_type='benchmark_type', klass='plone.dexterity.content.Item'):
+    """Register a non-persistent FTI with a concrete schema
+    """
+    from plone.dexterity.fti import DexterityFTI
+    from plone.dexterity.interfaces import IDexterityFTI
+    from plone.dexterity.schema import SCHEMA_CACHE
+
+    fti = DexterityFTI(portal_type)
+    fti.klass = klass
+    fti.schema = IBenchmarkSchema.__module__ + '.IBenchmarkSchema'
+    provideUtility(fti, IDexterityFTI, name=portal_type)
+    SCHEMA_CACHE.clear()
+    return fti
+
+
+def makeItem(portal_type='benchmark_type'):
+    from plone.dexterity.content import Item
+    item = Item(id='item')
+    item.portal_type = portal_type
+    return item
+
+
+@benchmark
+def schema_cache_contention(threads=8, iterations=20000):
+    """Many threads calculating __providedBy__ for content at the same time
+    """
+    setUpType()
+
+    def worker():
+        item = makeItem()
+        for i in xrange(iterations):
+            # Drop the per-instance cache so that we always go through
+            # SCHEMA_CACHE.get() and SCHEMA_CACHE.subtypes()
+            item.__dict__.pop('_v__providedBy__', None)
+            item.__providedBy__
+
+    for count in (1, threads):
+        workers = [threading.Thread(target=worker) for i in range(count)]
+
+        def run():
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+
+        elapsed = timed(run)
+        report("FTIAwareSpecification.__get__ (%d threads)" % count,
+               count * iterations, elapsed)
+
+
+class IBenchmarkAdapter(Interface):
+    pass
+
+
+@benchmark
+def spec_interning(count=5000):
+    """Memory used by content specifications, and the adapter registry's
+    lookup cache hit rate when adapting many instances of the same type
+    """
+    import gc
+    from zope.component import getGlobalSiteManager
+    from zope.component import provideAdapter
+    from zope.component import queryAdapter
+    from plone.dexterity import content
+
+    setUpType()
+    provideAdapter(lambda context: context,
+                   adapts=(IBenchmarkSchema,), provides=IBenchmarkAdapter)
+
+    lookup = getGlobalSiteManager().adapters._v_lookup
+    uncached_lookup = lookup._uncached_lookup
+    misses = []
+
+    def counting_lookup(*args):
+        misses.append(1)
+        return uncached_lookup(*args)
+    lookup._uncached_lookup = counting_lookup
+
+    try:
+        for shared in (False, True):
+            del misses[:]
+            lookup.changed(lookup)
+            gc.collect()
+            before = len(gc.get_objects())
+
+            items = []
+            for i in xrange(count):
+                if not shared:
+                    # Simulate one specification per instance
+                    content._specCache.clear()
+                item = makeItem()
+                queryAdapter(item, IBenchmarkAdapter)
+                items.append(item)
+
+            gc.collect()
+            objects = len(gc.get_objects()) - before
+            specs = len(set(id(item._v__providedBy__[-1]) for item in items))
+            label = shared and "interned" or "unshared"
+            print "%-10s %6d instances, %6d specifications, " \
+                  "%8d new objects, lookup cache hit rate %5.1f%%" % (
+                      label, count, specs, objects,
+                      100.0 * (count - len(misses)) / count)
+            del items
+    finally:
+        del lookup._uncached_lookup
+
+
+@benchmark
+def default_attribute_reads(count=20000):
+    """Reading unset schema attributes, which returns the field default
+    """
+    from copy import deepcopy
+    from plone.dexterity.content import Item
+    from plone.dexterity.schema import SCHEMA_CACHE
+
+    setUpType()
+
+    class DeepcopyItem(Item):
+        # What __getattr__ used to do for every read
+
+        def __getattr__(self, name):
+            if name.startswith('__'):
+                raise AttributeError(name)
+            schema = SCHEMA_CACHE.get(self.portal_type)
+            if schema is not None:
+                field = schema.get(name, None)
+                if field is not None:
+                    return deepcopy(field.default)
+            for schema in SCHEMA_CACHE.subtypes(self.portal_type):
+                field = schema.get(name, None)
+                if field is not None:
+                    return deepcopy(field.default)
+            raise AttributeError(name)
+
+    def read(items, name):
+        for item in items:
+            getattr(item, name)
+
+    for name in ('foo', 'bar'):
+        for klass in (DeepcopyItem, Item):
+            items = [klass(id='item') for i in xrange(count)]
+            for item in items:
+                item.portal_type = 'benchmark_type'
+            report("%s: default for %s" % (klass.__name__, name), count,
+                   timed(read, items, name), 'reads')
+
+
+@benchmark
+def dynamic_lookup_schema(count=50000):
+    """DexterityFTI.lookupSchema() for a type with a dynamic schema, and
+    splitting schema names as SchemaModuleFactory does
+    """
+    import transaction
+    from ZODB.DB import DB
+    from ZODB.MappingStorage import MappingStorage
+    from zope.component import getUtility
+    from zope.interface.interface import InterfaceClass
+    from Products.CMFCore.interfaces import ISiteRoot
+    from plone.dexterity import utils
+    from plone.dexterity.fti import DexterityFTI
+    from plone.dexterity.schema import generated
+    from plone.dexterity.tests.test_schema_cache import SchemaGenerationSite
+
+    db = DB(MappingStorage())
+    conn = db.open()
+    site = SchemaGenerationSite('site')
+    conn.root()['site'] = site
+    transaction.commit()
+    provideUtility(site, ISiteRoot)
+
+    fti = DexterityFTI('benchmark_type')
+    fti.schema = None
+    name = utils.portalTypeToSchemaName(fti.getId())
+    setattr(generated, name, InterfaceClass(name, (), __module__=generated.__name__))
+
+    def unmemoized():
+        # What lookupSchema() used to do
+        for i in xrange(count):
+            prefix = '/'.join(getUtility(ISiteRoot).getPhysicalPath())[1:]
+            getattr(generated, utils.SchemaNameEncoder().join(prefix, fti.getId(), u""))
+
+    def memoized():
+        for i in xrange(count):
+            fti.lookupSchema()
+
+    def unmemoizedSplit():
+        for i in xrange(count):
+            utils.SchemaNameEncoder().split(name)
+
+    def memoizedSplit():
+        for i in xrange(count):
+            utils.splitSchemaName(name)
+
+    try:
+        report("lookupSchema (unmemoized)", count, timed(unmemoized))
+        report("lookupSchema (memoized)", count, timed(memoized))
+        report("splitSchemaName (unmemoized)", count, timed(unmemoizedSplit))
+        report("splitSchemaName (memoized)", count, timed(memoizedSplit))
+    finally:
+        delattr(generated, name)
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+class BenchmarkCatalog(Persistent):
+    """A stand-in for portal_catalog, stored in the container
+    """
+
+    def indexObject(self, obj):
+        obj.getPhysicalPath()
+
+    def unindexObject(self, obj):
+        obj.getPhysicalPath()
+
+    def uncatalog_object(self, path):
+        pass
+
+
+@benchmark
+def bulk_creation(count=20000):
+    """createContentsInContainer() against createContentInContainer() in a
+    loop, adding to a BTree container with a catalog
+    """
+    import transaction
+    from ZODB.DB import DB
+    from ZODB.MappingStorage import MappingStorage
+    from AccessControl.SecurityManagement import newSecurityManager
+    from AccessControl.SecurityManagement import noSecurityManager
+    from AccessControl.SpecialUsers import system
+    from zope.component import provideAdapter
+    from zope.component import provideHandler
+    from zope.component.event import objectEventNotify
+    from zope.component.interfaces import IFactory
+    from zope.container.interfaces import INameChooser
+    from zope.lifecycleevent.interfaces import IObjectAddedEvent
+    from zope.security.interfaces import IPermission
+    from zope.security.permission import Permission
+    from plone.folder.interfaces import IOrdering
+    from plone.folder.unordered import UnorderedOrdering
+    from plone.dexterity.content import Container
+    from plone.dexterity.factory import DexterityFactory
+    from plone.dexterity.interfaces import IDexterityContent
+    from plone.dexterity import utils
+
+    setUpType()
+    provideUtility(DexterityFactory('benchmark_type'), IFactory, name='benchmark_type')
+    provideUtility(Permission('cmf.AddPortalContent', u"Add portal content"),
+                   IPermission, name='cmf.AddPortalContent')
+    provideAdapter(UnorderedOrdering, (Interface,), IOrdering)
+    provideHandler(objectEventNotify)
+    provideHandler(lambda ob, event: ob.indexObject(),
+                   (IDexterityContent, IObjectAddedEvent,))
+
+    class NameChooser(object):
+
+        def __init__(self, context):
+            self.context = context
+
+        def chooseName(self, name, object):
+            name = str(object.title)
+            idx = 1
+            while name in self.context:
+                name = "%s-%d" % (object.title, idx)
+                idx += 1
+            return name
+    provideAdapter(NameChooser, (Interface,), INameChooser)
+
+    def items():
+        for i in xrange(count):
+            yield 'benchmark_type', {'title': u"Item %d" % i}
+
+    def loop(container):
+        for portal_type, kw in items():
+            utils.createContentInContainer(container, portal_type, **kw)
+
+    def bulk(container):
+        utils.createContentsInContainer(container, items())
+
+    db = DB(MappingStorage())
+    conn = db.open()
+    newSecurityManager(None, system)
+    try:
+        for name, func in (('createContentInContainer', loop),
+                           ('createContentsInContainer', bulk),):
+            container = Container(name)
+            conn.root()[name] = container
+            container.portal_catalog = BenchmarkCatalog()
+            transaction.commit()
+            report(name, count, timed(func, container), 'objects')
+            transaction.commit()
+    finally:
+        noSecurityManager()
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+@benchmark
+def bulk_deletion(count=5000):
+    """Deleting all children of an ordered container one by one, as
+    manage_delObjects used to, against deleteContentsInContainer()
+    """
+    import transaction
+    from ZODB.DB import DB
+    from ZODB.MappingStorage import MappingStorage
+    from AccessControl.SecurityManagement import getSecurityManager
+    from AccessControl.SecurityManagement import newSecurityManager
+    from AccessControl.SecurityManagement import noSecurityManager
+    from AccessControl.SpecialUsers import system
+    from zope.annotation.attribute import AttributeAnnotations
+    from zope.annotation.interfaces import IAnnotations
+    from zope.component import provideAdapter
+    from zope.component import provideHandler
+    from zope.component.event import objectEventNotify
+    from OFS.interfaces import IObjectWillBeRemovedEvent
+    from Products.CMFCore.permissions import DeleteObjects
+    from plone.folder.default import DefaultOrdering
+    from plone.folder.interfaces import IOrdering
+    from plone.dexterity.content import Container
+    from plone.dexterity.interfaces import IDexterityContent
+    from plone.dexterity import utils
+
+    setUpType()
+    provideAdapter(DefaultOrdering, (Interface,), IOrdering)
+    provideAdapter(AttributeAnnotations, (Interface,), IAnnotations)
+    provideHandler(objectEventNotify)
+    provideHandler(lambda ob, event: ob.unindexObject(),
+                   (IDexterityContent, IObjectWillBeRemovedEvent,))
+
+    def loop(container):
+        ids = container.objectIds()
+        for id in ids:
+            getSecurityManager().checkPermission(DeleteObjects, container._getOb(id))
+        for id in ids:
+            container._delObject(id)
+
+    def bulk(container):
+        utils.deleteContentsInContainer(container, container.objectIds())
+
+    db = DB(MappingStorage())
+    conn = db.open()
+    newSecurityManager(None, system)
+    try:
+        for name, func in (('one by one', loop),
+                           ('deleteContentsInContainer', bulk),):
+            container = Container('container')
+            conn.root()[name] = container
+            container.portal_catalog = BenchmarkCatalog()
+            for i in xrange(count):
+                id = 'item-%d' % i
+                container._setObject(id, makeItem(), suppress_events=True)
+            transaction.commit()
+            report(name, count, timed(func, container), 'objects')
+            transaction.commit()
+    finally:
+        noSecurityManager()
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+@benchmark
+def permission_checks(items=300, fields=20):
+    """Checking a read permission for each field of each item in a listing,
+    with and without the request scoped memo
+    """
+    from AccessControl.SecurityManagement import getSecurityManager
+    from AccessControl.SecurityManagement import newSecurityManager
+    from AccessControl.SecurityManagement import noSecurityManager
+    from AccessControl.users import SimpleUser
+    from App.config import getConfiguration
+    from zope.annotation.attribute import AttributeAnnotations
+    from zope.annotation.interfaces import IAnnotations
+    from zope.component import provideAdapter
+    from zope.publisher.browser import TestRequest
+    from plone.folder.interfaces import IOrdering
+    from plone.folder.unordered import UnorderedOrdering
+    from Products.CMFCore.permissions import ModifyPortalContent
+    from plone.dexterity.content import Container
+    from plone.dexterity.security import checkPermission
+
+    setUpType()
+    provideAdapter(UnorderedOrdering, (Interface,), IOrdering)
+    provideAdapter(AttributeAnnotations, (Interface,), IAnnotations)
+
+    container = Container('container')
+    container.manage_permission(ModifyPortalContent, ('Owner',))
+    for i in xrange(items):
+        id = 'item-%d' % i
+        container._setOb(id, makeItem())
+        # Each item is owned by someone else
+        container._getOb(id).manage_setLocalRoles('owner-%d' % i, ['Owner'])
+    contents = container.objectValues()
+
+    def unmemoized():
+        for item in contents:
+            for field in xrange(fields):
+                getSecurityManager().checkPermission(ModifyPortalContent, item)
+
+    def memoized():
+        container.REQUEST = TestRequest()
+        for item in contents:
+            for field in xrange(fields):
+                checkPermission(ModifyPortalContent, item)
+
+    newSecurityManager(None, SimpleUser('bob', '', (), ()))
+    getConfiguration().product_config = {'plone.dexterity': {'permission-memo': 'on'}}
+    try:
+        report("checkPermission (unmemoized)", items * fields, timed(unmemoized))
+        report("checkPermission (memoized)", items * fields, timed(memoized))
+    finally:
+        getConfiguration().product_config = None
+        noSecurityManager()
+
+
+@benchmark
+def serialization(count=20000):
+    """obj.asDictionary() in a loop against asDictionaries(), for objects
+    of two types with a behavior and field read permissions
+    """
+    from AccessControl.SecurityManagement import newSecurityManager
+    from AccessControl.SecurityManagement import noSecurityManager
+    from AccessControl.users import SimpleUser
+    from zope.component import provideAdapter
+    from zope.interface import alsoProvides
+    from zope.security.interfaces import IPermission
+    from zope.security.permission import Permission
+    from plone.autoform.interfaces import IFormFieldProvider
+    from plone.autoform.interfaces import READ_PERMISSIONS_KEY
+    from plone.behavior.interfaces import IBehavior
+    from plone.behavior.registration import BehaviorRegistration
+    from plone.dexterity.content import asDictionaries
+
+    class ISerializationSchema(IBenchmarkSchema):
+        baz = zope.schema.TextLine(title=u"baz")
+    ISerializationSchema.setTaggedValue(READ_PERMISSIONS_KEY, dict(baz='benchmark.View'))
+
+    class ISerializationBehavior(Interface):
+        qux = zope.schema.TextLine(title=u"qux", default=u"qux")
+        quux = zope.schema.TextLine(title=u"quux", default=u"quux")
+    alsoProvides(ISerializationBehavior, IFormFieldProvider)
+
+    class BehaviorAdapter(object):
+        def __init__(self, context):
+            self.context = context
+        qux = u"qux"
+        quux = u"quux"
+
+    provideUtility(Permission('benchmark.View', u"View"), IPermission, name='benchmark.View')
+    provideUtility(BehaviorRegistration(u"Behavior", "", ISerializationBehavior, None, None),
+                   IBehavior, name='benchmark.behavior')
+    provideAdapter(BehaviorAdapter, (Interface,), ISerializationBehavior)
+
+    for portal_type in ('benchmark_type', 'other_type',):
+        fti = setUpType(portal_type)
+        fti.lookupSchema = lambda: ISerializationSchema
+        fti.behaviors = ('benchmark.behavior',)
+
+    objects = []
+    for i in xrange(count):
+        item = makeItem(i % 2 and 'benchmark_type' or 'other_type')
+        item.foo = u"foo %d" % i
+        item.manage_setLocalRoles('owner-%d' % i, ['Owner'])
+        objects.append(item)
+
+    def loop():
+        for item in objects:
+            item.asDictionary(checkConstraints=True)
+
+    def batch():
+        for dictionary in asDictionaries(objects, checkConstraints=True):
+            pass
+
+    newSecurityManager(None, SimpleUser('bob', '', ('Manager',), ()))
+    try:
+        report("asDictionary() loop", count, timed(loop), 'objects')
+        report("asDictionaries()", count, timed(batch), 'objects')
+    finally:
+        noSecurityManager()
+
+
+@benchmark
+def factory_throughput(count=20000):
+    """Objects created per second by DexterityFactory, for Items and
+    Containers, with and without keyword arguments
+    """
+    from plone.dexterity.factory import DexterityFactory
+
+    def create(factory, kw, cached):
+        for i in xrange(count):
+            if not cached:
+                # What the factory used to do for every call
+                factory.__dict__.pop('_v_klass', None)
+            factory(**kw)
+
+    for klass in ('plone.dexterity.content.Item', 'plone.dexterity.content.Container'):
+        setUpType(klass=klass)
+        factory = DexterityFactory('benchmark_type')
+        for kw in ({}, {'title': u"Title", 'foo': u"foo", 'bar': [u"bar"]},):
+            for cached in (False, True):
+                label = "%s%s (%s)" % (klass.split('.')[-1], kw and ", kwargs" or "",
+                                       cached and "cached" or "uncached")
+                report(label, count, timed(create, factory, kw, cached), 'objects')
+
+
+@benchmark
+def dublin_core_metadata(count=5000, passes=3):
+    """Catalog metadata extraction, i.e. calling the Dublin Core accessors
+    of each object for each metadata column, with and without the memo of
+    formatted values. The catalog and listings call the accessors of the
+    same object several times, so each object is extracted passes times.
+    """
+    from plone.dexterity.content import Item
+
+    columns = ('Title', 'Description', 'Date', 'CreationDate',
+               'EffectiveDate', 'ExpirationDate', 'ModificationDate',)
+
+    objects = []
+    for i in xrange(count):
+        item = Item(id='item-%d' % i, title=u"Title %d \xe9" % i,
+                    description=u"Description %d" % i,
+                    effective_date='2010/08/20', expiration_date='2030/08/20')
+        objects.append(item)
+
+    def extract(memoized):
+        for item in objects:
+            for i in xrange(passes):
+                record = []
+                for name in columns:
+                    if not memoized:
+                        # Format every value again, as before
+                        item.__dict__.pop('_v_dublinCore', None)
+                    record.append(getattr(item, name)())
+
+    report("metadata extraction (unmemoized)", count * passes, timed(extract, False), 'records')
+    for item in objects:
+        item.__dict__.pop('_v_dublinCore', None)
+    report("metadata extraction (memoized)", count * passes, timed(extract, True), 'records')
+
+
+def main(argv):
+    names = argv[1:]
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        zope.component.testing.setUp()
+        try:
+            func()
+        finally:
+            zope.component.testing.tearDown()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
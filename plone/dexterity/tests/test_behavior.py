@@ -68,6 +68,28 @@ class TestBehavior(MockTestCase):
         assignable = DexterityBehaviorAssignable(context_dummy)
         
         self.assertEquals([behavior_dummy], list(assignable.enumerateBehaviors()))
+
+    def test_behaviors_cached(self):
+        
+        # Context mock
+        context_dummy = self.create_dummy(portal_type=u"testtype")
+        
+        # Behavior mock
+        behavior_dummy = self.create_dummy(interface = IFour)
+        self.mock_utility(behavior_dummy, IBehavior, name=IFour.__identifier__)
+        
+        # FTI mock
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.behaviors).result([IFour.__identifier__]).count(1)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+        
+        self.replay()
+        
+        for i in range(3):
+            assignable = DexterityBehaviorAssignable(context_dummy)
+            self.assertEquals(True, assignable.supports(IThree))
+            self.assertEquals(False, assignable.supports(IOne))
+            self.assertEquals([behavior_dummy], list(assignable.enumerateBehaviors()))
     
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
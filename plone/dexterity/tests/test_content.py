@@ -16,12 +16,19 @@ from plone.dexterity.schema import SCHEMA_CACHE
 from plone.dexterity.content import Item, Container
 
 from plone.behavior.interfaces import IBehavior
+from plone.behavior.interfaces import IBehaviorAssignable
 from plone.behavior.registration import BehaviorRegistration
 
+from plone.autoform.interfaces import IFormFieldProvider
+
 from plone.folder.default import DefaultOrdering
 from zope.annotation.attribute import AttributeAnnotations
 
 
+class IUnregisteredBehavior(Interface):
+    unregistered = zope.schema.TextLine(title=u"unregistered")
+alsoProvides(IUnregisteredBehavior, IFormFieldProvider)
+
 class TestContent(MockTestCase):
     
     def setUp(self):
@@ -376,6 +383,46 @@ class TestContent(MockTestCase):
         self.assertEquals(True, ISubtype2.providedBy(item))
         self.assertEquals(True, ISchema.providedBy(item))
     
+    def test_provided_by_shared_between_instances(self):
+
+        class FauxDataManager(object):
+            def setstate(self, obj): pass
+            def oldstate(self, obj, tid): pass
+            def register(self, obj): pass
+
+        # Dummy instances
+        item1 = Item(id=u'id1')
+        item1.portal_type = 'testtype'
+        item1._p_jar = FauxDataManager()
+
+        item2 = Item(id=u'id2')
+        item2.portal_type = 'testtype'
+        item2._p_jar = FauxDataManager()
+
+        # Dummy schema
+        class ISchema(Interface):
+            foo = zope.schema.TextLine(title=u"foo", default=u"foo_default")
+
+        class IMarker(Interface):
+            pass
+
+        # FTI mock
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ISchema).count(1)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        # Instances of the same type share one specification
+        self.failUnless(item1.__providedBy__ is item2.__providedBy__)
+
+        # ... unless one of them provides something else directly
+        alsoProvides(item2, IMarker)
+        self.failIf(item1.__providedBy__ is item2.__providedBy__)
+        self.assertEquals(True, IMarker.providedBy(item2))
+        self.assertEquals(True, ISchema.providedBy(item2))
+        self.assertEquals(False, IMarker.providedBy(item1))
+
     def test_getattr_consults_schema_item(self):
         
         content = Item()
@@ -550,6 +597,33 @@ class TestContent(MockTestCase):
         self.assertEqual(i.Date(), i.EffectiveDate())
         self.assertEqual(i.Identifier(), i.absolute_url())
 
+    def test_dublincore_memo(self):
+        from DateTime.DateTime import DateTime
+
+        i = Item(effective_date="08/20/2010")
+        self.assertEqual('2010-08-20 00:00:00', i.EffectiveDate())
+        self.assertEqual('2010-08-20 09:00:00', i.EffectiveDate('GMT+9'))
+
+        # Formatted values are reused
+        memo = i._v_dublinCore[1]
+        self.assertEqual(2, len(memo))
+        memo[('EffectiveDate', 'GMT+9')] = (i.effective_date, 'Cached')
+        self.assertEqual('Cached', i.EffectiveDate('GMT+9'))
+
+        # Writes through the mutators or to the attributes are seen
+        i.setEffectiveDate(DateTime('2011/01/01 12:00 GMT'))
+        self.assertEqual('2011-01-01 21:00:00', i.EffectiveDate('GMT+9'))
+        self.assertEqual(i.Date('GMT+9'), i.EffectiveDate('GMT+9'))
+        i.effective_date = DateTime('2012/01/01 12:00 GMT')
+        self.assertEqual('2012-01-01 21:00:00', i.EffectiveDate('GMT+9'))
+        i.setModificationDate(DateTime('2012/01/01 12:00 GMT'))
+        self.assertEqual('2012-01-01 12:00:00', i.ModificationDate('GMT'))
+
+        # The memo is discarded when the object is committed
+        i._p_serial = '\0' * 7 + '\1'
+        self.assertEqual('2012-01-01 21:00:00', i.EffectiveDate('GMT+9'))
+        self.assertEqual(1, len(i._v_dublinCore[1]))
+
     def test_item_notifyModified(self):
         i = Item()
 
@@ -749,6 +823,201 @@ class TestContent(MockTestCase):
         self.assertEquals(bar.listfield, [1,2])
         self.assertEquals(baz.listfield, [1,2])
         
+    def test_field_default_immutable_not_copied(self):
+        from datetime import datetime
+        from DateTime import DateTime
+
+        content = Item()
+        content.id = u"id"
+        content.portal_type = u"testtype"
+
+        now = DateTime()
+        today = datetime.now()
+        counter = []
+
+        def factory():
+            counter.append(1)
+            return len(counter)
+
+        class ISchema(Interface):
+            text = zope.schema.TextLine(title=u"text", default=u"foo")
+            date = zope.schema.Field(title=u"date", default=now)
+            datetime = zope.schema.Datetime(title=u"datetime", default=today)
+            tags = zope.schema.Tuple(title=u"tags", default=(u"a", u"b"))
+            nested = zope.schema.Tuple(title=u"nested", default=([],))
+            count = zope.schema.Int(title=u"count", defaultFactory=factory)
+
+        # FTI mock
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ISchema).count(1)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        # Immutable defaults are handed out as they are
+        self.failUnless(content.text is ISchema['text'].default)
+        self.failUnless(content.date is now)
+        self.failUnless(content.datetime is today)
+        self.failUnless(content.tags is ISchema['tags'].default)
+
+        # Anything else is still copied
+        self.assertEquals(([],), content.nested)
+        self.failIf(content.nested is ISchema['nested'].default)
+
+        # And default factories are called each time
+        self.assertEquals(1, content.count)
+        self.assertEquals(2, content.count)
+
+    def test_field_access(self):
+        from plone.autoform.interfaces import IFormFieldProvider
+
+        class ISchema(Interface):
+            foo = zope.schema.TextLine(title=u"foo")
+            bar = zope.schema.TextLine(title=u"bar")
+
+        class IBehaviorSchema(Interface):
+            baz = zope.schema.TextLine(title=u"baz")
+            qux = zope.schema.TextLine(title=u"qux")
+        alsoProvides(IBehaviorSchema, IFormFieldProvider)
+
+        adapted = []
+        class BehaviorAdapter(object):
+            def __init__(self, context):
+                adapted.append(context)
+            @property
+            def baz(self):
+                return u"Baz"
+            @property
+            def qux(self):
+                return u"Qux"
+
+        behavior = BehaviorRegistration(u"Behavior", "", IBehaviorSchema, None, None)
+        self.mock_utility(behavior, IBehavior, name="behavior")
+        self.mock_adapter(BehaviorAdapter, IBehaviorSchema, (Interface,))
+
+        fti = DexterityFTI(u"testtype")
+        fti.behaviors = ('behavior',)
+        fti_mock = self.mocker.proxy(fti)
+        self.expect(fti_mock.lookupSchema()).result(ISchema).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        item = Item('item')
+        item.portal_type = u"testtype"
+        item.foo = u"Foo"
+        item.bar = u"Bar"
+
+        self.failUnless(item.getField('baz') is IBehaviorSchema['baz'])
+        self.assertEquals(None, item.getField('other'))
+
+        # Field names are found without adapting the behaviors
+        self.assertEquals(['foo', 'bar', 'baz', 'qux'], item.getFieldNames())
+        self.assertEquals([], adapted)
+
+        # Each behavior is adapted once
+        self.assertEquals({'foo': u"Foo", 'bar': u"Bar", 'baz': u"Baz", 'qux': u"Qux"},
+                          item.asDictionary())
+        self.assertEquals(1, len(adapted))
+
+        # Values can be limited to a subset of fields
+        del adapted[:]
+        self.assertEquals({'foo': u"Foo"}, item.asDictionary(fields=['foo']))
+        self.assertEquals([], adapted)
+        self.assertEquals({'bar': u"Bar", 'qux': u"Qux"},
+                          item.asDictionary(fields=('bar', 'qux', 'other',)))
+        self.assertEquals(1, len(adapted))
+
+        # A custom IBehaviorAssignable takes precedence over the FTI
+        class NoBehaviorAssignable(object):
+            def __init__(self, context):
+                self.context = context
+            def enumerateBehaviors(self):
+                return iter(())
+        self.mock_adapter(NoBehaviorAssignable, IBehaviorAssignable, (Item,))
+        self.assertEquals(['foo', 'bar'], item.getFieldNames())
+        self.assertEquals(None, item.getField('baz'))
+
+    def test_field_access_unregistered_behavior(self):
+        class ISchema(Interface):
+            foo = zope.schema.TextLine(title=u"foo")
+
+        # Behaviors named by dotted name only are not enumerated by the
+        # behavior assignable, so their fields are left out
+        fti = DexterityFTI(u"testtype")
+        fti.behaviors = (IUnregisteredBehavior.__identifier__,)
+        fti_mock = self.mocker.proxy(fti)
+        self.expect(fti_mock.lookupSchema()).result(ISchema).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        item = Item('item')
+        item.portal_type = u"testtype"
+        item.foo = u"Foo"
+
+        self.assertEquals(['foo'], item.getFieldNames())
+        self.assertEquals(None, item.getField('unregistered'))
+        self.assertEquals({'foo': u"Foo"}, item.asDictionary())
+
+    def test_asDictionaries(self):
+        from zope.security.interfaces import IPermission
+        from zope.security.permission import Permission
+        from plone.autoform.interfaces import READ_PERMISSIONS_KEY
+        from plone.dexterity.content import asDictionaries
+
+        class ISchema(Interface):
+            foo = zope.schema.TextLine(title=u"foo")
+            bar = zope.schema.TextLine(title=u"bar")
+            secret = zope.schema.TextLine(title=u"secret")
+        ISchema.setTaggedValue(READ_PERMISSIONS_KEY,
+                               dict(foo='foo.View', secret='missing.Permission'))
+
+        class IOther(Interface):
+            baz = zope.schema.TextLine(title=u"baz")
+
+        self.mock_utility(Permission(u'foo.View', u"View foo"), IPermission, u'foo.View')
+        for portal_type, schema in ((u"one", ISchema,), (u"two", IOther,),):
+            fti_mock = self.mocker.proxy(DexterityFTI(portal_type))
+            self.expect(fti_mock.lookupSchema()).result(schema).count(0, None)
+            self.mock_utility(fti_mock, IDexterityFTI, name=portal_type)
+
+        def create(id, portal_type, **kw):
+            item = Item(id)
+            item.portal_type = portal_type
+            for name, value in kw.items():
+                setattr(item, name, value)
+            return item
+        a = create('a', u"one", foo=u"a-foo", bar=u"a-bar", secret=u"a-secret")
+        b = create('b', u"two", baz=u"b-baz")
+        c = create('c', u"one", foo=u"c-foo", bar=u"c-bar", secret=u"c-secret")
+
+        # Each permission is checked once per object
+        checkPermission_mock = self.mocker.replace('plone.dexterity.security.checkPermission')
+        self.expect(checkPermission_mock(u"View foo", a)).result(False)
+        self.expect(checkPermission_mock("View", a)).result(True)
+        self.expect(checkPermission_mock("View", b)).result(True)
+        self.expect(checkPermission_mock(u"View foo", c)).result(True)
+        self.expect(checkPermission_mock("View", c)).result(True)
+
+        self.replay()
+
+        # Without constraints, the results are the same as asDictionary()'s
+        objects = [a, b, c]
+        self.assertEquals([obj.asDictionary() for obj in objects],
+                          list(asDictionaries(objects)))
+        self.assertEquals([{'bar': u"a-bar"}, {}, {'bar': u"c-bar"}],
+                          list(asDictionaries(objects, fields=['bar'])))
+
+        # Objects are consumed lazily
+        dictionaries = asDictionaries(iter(objects), checkConstraints=True)
+        self.assertEquals({'bar': u"a-bar"}, dictionaries.next())
+        self.assertEquals([{'baz': u"b-baz"}, {'foo': u"c-foo", 'bar': u"c-bar"}],
+                          list(dictionaries))
+
+        # Fields with a read permission that does not exist are not visible
+        self.assertFalse(a.canViewField(ISchema['secret']))
+
     def test_container_manage_delObjects(self):
         # OFS does not check the delete permission for each object being
         # deleted. We want to.
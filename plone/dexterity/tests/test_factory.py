@@ -176,5 +176,46 @@ class TestFactory(MockTestCase):
         factory = DexterityFactory(portal_type=u"testtype")
         self.assertEquals(obj_mock, factory(u"id", title=u"title"))
 
+    def test_class_cached_until_klass_changes(self):
+
+        # Objects returned by classes
+        obj_mock = self.mocker.mock()
+        self.expect(obj_mock.portal_type).result(u"testtype").count(3)
+
+        # Classes set by factory
+        klass_mock = self.mocker.mock()
+        self.expect(klass_mock()).result(obj_mock).count(2)
+        other_klass_mock = self.mocker.mock()
+        self.expect(other_klass_mock()).result(obj_mock)
+
+        # Resolver, called once per class
+        resolver_mock = self.mocker.replace("plone.dexterity.utils.resolveDottedName")
+        self.expect(resolver_mock("my.mocked.ContentTypeClass")).result(klass_mock)
+        self.expect(resolver_mock("my.mocked.OtherContentTypeClass")).result(other_klass_mock)
+
+        # FTI
+        fti = DexterityFTI(u"testtype")
+        fti.klass = "my.mocked.ContentTypeClass"
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        factory = DexterityFactory(portal_type=u"testtype")
+        self.assertEquals(obj_mock, factory())
+        self.assertEquals(obj_mock, factory())
+
+        fti.klass = "my.mocked.OtherContentTypeClass"
+        self.assertEquals(obj_mock, factory())
+
+    def test_get_interfaces_cached(self):
+        fti_mock = self.mocker.mock(DexterityFTI)
+        self.expect(fti_mock.lookupSchema()).result(IDummy).count(2)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        factory = DexterityFactory(portal_type=u"testtype")
+        self.failUnless(factory.getInterfaces() is factory.getInterfaces())
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
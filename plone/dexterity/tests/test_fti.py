@@ -6,6 +6,8 @@ import os.path
 
 from zope.interface import Interface
 from zope.component import queryUtility
+from zope.component import provideHandler
+from zope.interface.interface import InterfaceClass
 
 from zope.security.interfaces import IPermission
 
@@ -25,6 +27,7 @@ from zope.container.contained import ObjectAddedEvent
 from zope.container.contained import ObjectRemovedEvent
 
 from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.interfaces import ISchemaInvalidatedEvent
 
 from plone.dexterity.fti import DexterityFTI, DexterityFTIModificationDescription
 from plone.dexterity.fti import ftiAdded, ftiRemoved, ftiRenamed, ftiModified
@@ -32,11 +35,14 @@ from plone.dexterity.fti import ftiAdded, ftiRemoved, ftiRenamed, ftiModified
 from plone.dexterity.factory import DexterityFactory
 
 from plone.dexterity.schema import DexteritySchemaPolicy
+from plone.dexterity.schema import MODEL_CACHE
+from plone.dexterity.schema import lookupCachedModel
 
 from plone.dexterity import utils
 from plone.dexterity.tests.schemata import ITestSchema
 
 from plone.supermodel.model import Model
+from plone.supermodel.utils import syncSchema
 
 from Products.CMFCore.interfaces import ISiteRoot
 
@@ -54,6 +60,9 @@ class ITestInterface(Interface):
 
 class TestFTI(MockTestCase):
 
+    def setUp(self):
+        MODEL_CACHE.clear()
+
     def test_factory_name_is_fti_id(self):
         fti = DexterityFTI(u"testtype")
         self.assertEquals(u"testtype", fti.getId())
@@ -117,6 +126,78 @@ class TestFTI(MockTestCase):
         model = fti.lookupModel()
         self.assertIs(model_dummy, model)
     
+    def test_lookupModel_from_string_cached(self):
+        fti = DexterityFTI(u"testtype")
+        fti.schema = None
+        fti.model_source = "<model />"
+        fti.model_file = None
+
+        model_dummy = Model()
+        other_model_dummy = Model()
+
+        fresh_model_dummy = Model()
+
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        self.expect(loadString_mock("<model />", policy=u"dexterity")).result(model_dummy)
+        self.expect(loadString_mock("<model />", policy=u"dexterity")).result(fresh_model_dummy)
+        self.expect(loadString_mock("<model />", policy=u"other")).result(other_model_dummy)
+        self.expect(loadString_mock("<model></model>", policy=u"dexterity")).result(other_model_dummy)
+
+        self.replay()
+
+        self.assertIs(model_dummy, lookupCachedModel(fti))
+        self.assertIs(model_dummy, lookupCachedModel(fti))
+        self.assertEquals(1, MODEL_CACHE.hits)
+        self.assertEquals(1, MODEL_CACHE.misses)
+
+        # lookupModel() does not hand out the shared model
+        self.assertIs(fresh_model_dummy, fti.lookupModel())
+        self.assertEquals(1, MODEL_CACHE.misses)
+
+        # The policy is part of the key
+        fti.schema_policy = u"other"
+        self.assertIs(other_model_dummy, lookupCachedModel(fti))
+
+        # A new source is parsed again
+        fti.schema_policy = u"dexterity"
+        fti.model_source = "<model></model>"
+        self.assertIs(other_model_dummy, lookupCachedModel(fti))
+        self.assertEquals(1, MODEL_CACHE.hits)
+        self.assertEquals(3, MODEL_CACHE.misses)
+
+    def test_lookupModel_from_file_cached(self):
+        import plone.dexterity.tests
+        abs_file = os.path.join(os.path.split(plone.dexterity.tests.__file__)[0], "test.xml")
+
+        fti = DexterityFTI(u"testtype")
+        fti.schema = None
+        fti.model_source = None
+        fti.model_file = abs_file
+
+        model_dummy = Model()
+        new_model_dummy = Model()
+
+        stat = os.stat(abs_file)
+
+        loadFile_mock = self.mocker.replace("plone.supermodel.loadFile")
+        self.expect(loadFile_mock(abs_file, reload=True, policy=u"dexterity")).result(model_dummy)
+        self.expect(loadFile_mock(abs_file, reload=True, policy=u"dexterity")).result(new_model_dummy)
+
+        self.replay()
+
+        self.assertIs(model_dummy, lookupCachedModel(fti))
+        self.assertIs(model_dummy, lookupCachedModel(fti))
+
+        # The file is read again if it is modified
+        try:
+            os.utime(abs_file, (stat.st_atime, stat.st_mtime + 10))
+            self.assertIs(new_model_dummy, lookupCachedModel(fti))
+        finally:
+            os.utime(abs_file, (stat.st_atime, stat.st_mtime))
+
+        self.assertEquals(1, MODEL_CACHE.hits)
+        self.assertEquals(2, MODEL_CACHE.misses)
+
     def test_lookupModel_from_file_with_package(self):
         
         fti = DexterityFTI(u"testtype")
@@ -640,6 +721,46 @@ class TestFTIEvents(MockTestCase):
         self.failUnless('title' in IBlank)
         self.failUnless(IBlank['title'].title == u"title")
         
+    def test_schema_changes_passed_on_modify_model_source(self):
+        portal_type = u"testtype"
+        fti = self.mocker.proxy(DexterityFTI(portal_type))
+        
+        class IOld(Interface):
+            title = zope.schema.TextLine(title=u"title")
+            body = zope.schema.Text(title=u"body")
+        
+        class INew(Interface):
+            title = zope.schema.TextLine(title=u"Title")
+            body = zope.schema.Text(title=u"body")
+        
+        model_dummy = Model({u"": INew})
+        
+        self.expect(fti.lookupModel()).result(model_dummy)
+        
+        site_dummy = self.create_dummy(getPhysicalPath = lambda: ('', 'siteid'))
+        self.mock_utility(site_dummy, ISiteRoot)
+        
+        events = []
+        provideHandler(events.append, (ISchemaInvalidatedEvent,))
+        
+        self.replay()
+        
+        schemaName = utils.portalTypeToSchemaName(fti.getId())
+        schema = InterfaceClass(schemaName, (Interface,))
+        syncSchema(IOld, schema)
+        title = schema['title']
+        setattr(plone.dexterity.schema.generated, schemaName, schema)
+        
+        ftiModified(fti, ObjectModifiedEvent(fti, DexterityFTIModificationDescription('model_source', '')))
+        
+        self.assertEquals(1, len(events))
+        self.assertEquals(set(['title']), events[0].changes.relabelled)
+        self.assertEquals(set(), events[0].changes.changed)
+        self.failUnless(schema['title'] is title)
+        self.assertEquals(u"Title", title.title)
+        
+        delattr(plone.dexterity.schema.generated, schemaName)
+    
     def test_concrete_schema_not_refreshed_on_modify_schema(self):
         portal_type = u"testtype"
         fti = self.mocker.proxy(DexterityFTI(portal_type))
@@ -0,0 +1,308 @@
+import os
+import shutil
+import tempfile
+import unittest
+from plone.mocktestcase import MockTestCase
+
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from OFS.Application import Application
+from App.config import getConfiguration
+from AccessControl.SecurityManagement import getSecurityManager
+
+from zope.component import getGlobalSiteManager
+from zope.component.hooks import setHooks
+from zope.component.hooks import setSite
+
+from persistent import Persistent
+
+from zope.interface import Interface
+from zope.lifecycleevent import Attributes
+from zope.lifecycleevent import ObjectModifiedEvent
+
+from plone.folder.interfaces import IOrdering
+from plone.folder.unordered import UnorderedOrdering
+from plone.uuid.interfaces import IUUID
+from plone.uuid.interfaces import IAttributeUUID
+from plone.uuid.interfaces import ATTRIBUTE_NAME
+from plone.uuid.adapter import attributeUUID
+
+from plone.dexterity.interfaces import IDexterityFTI
+
+from plone.dexterity.fti import DexterityFTI
+from plone.dexterity.content import Container
+from plone.dexterity.content import Item
+from plone.dexterity.content import reindexOnModify
+from plone.dexterity.indexing import parseFieldIndexes
+from plone.dexterity.indexing import getIndexingQueue
+from plone.dexterity.indexing import indexingQueueStatistics
+from plone.dexterity.indexing import processIndexingQueue
+from plone.dexterity.indexing import IndexingQueue
+from plone.dexterity.indexing import IndexingWorker
+
+from plone.dexterity.tests.test_schema_cache import SchemaGenerationSite
+
+class IDummy(Interface):
+    pass
+
+class Catalog(object):
+
+    def __init__(self):
+        self.reindexed = []
+
+    def indexes(self):
+        return ['Title', 'SearchableText', 'Subject', 'modified']
+
+    def reindexObject(self, obj, idxs=[]):
+        self.reindexed.append((obj.getId(), idxs))
+
+    def unrestrictedSearchResults(self, UID):
+        return []
+
+class PersistentCatalog(Catalog, Persistent):
+
+    users = ()
+
+    def reindexObject(self, obj, idxs=[]):
+        self.reindexed = self.reindexed + [(obj.getId(), idxs)]
+        self.users = self.users + ((getSecurityManager().getUser().getUserName(),
+                                    getattr(obj, 'REQUEST', None) is not None),)
+
+class FailingCatalog(PersistentCatalog):
+
+    def reindexObject(self, obj, idxs=[]):
+        if obj.getId() == 'one':
+            self.reindexed = self.reindexed + [('failed', idxs)]
+            raise ValueError(obj.getId())
+        PersistentCatalog.reindexObject(self, obj, idxs)
+
+class TestIndexing(MockTestCase):
+
+    def setUp(self):
+        transaction.abort()
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+
+        self.fti = DexterityFTI(u"testtype")
+        self.fti.schema = 'zope.interface.Interface'
+        self.fti.field_indexes = ('title: Title SearchableText sortable_title',
+                                  'subject: Subject',)
+        self.mock_utility(self.fti, IDexterityFTI, name=u"testtype")
+
+        self.catalog = Catalog()
+        self.container = Container('container')
+        self.container.portal_catalog = self.catalog
+        self.container._setOb('item', Item('item'))
+        self.item = self.container['item']
+        self.item.portal_type = u"testtype"
+        getConfiguration().product_config = {'plone.dexterity': {'deferred-indexing': 'on'}}
+
+    def tearDown(self):
+        super(TestIndexing, self).tearDown()
+        getConfiguration().product_config = None
+        transaction.abort()
+
+    def modified(self, *attributes):
+        descriptions = attributes and (Attributes(IDummy, *attributes),) or ()
+        reindexOnModify(self.item, ObjectModifiedEvent(self.item, *descriptions))
+
+    def test_parseFieldIndexes(self):
+        self.assertEquals({'title': set(['Title', 'SearchableText']), 'subject': set(['Subject'])},
+                          parseFieldIndexes(['title: Title', 'subject:Subject', 'bogus',
+                                             'title: SearchableText']))
+
+    def test_reindex_coalesced(self):
+        self.modified()
+        self.modified()
+        self.assertEquals([], self.catalog.reindexed)
+
+        transaction.commit()
+        self.assertEquals([('item', [])], self.catalog.reindexed)
+
+    def test_reindex_mapped_fields(self):
+        self.modified('title')
+        self.modified('subject')
+        transaction.commit()
+
+        # Unknown indexes are left out
+        self.assertEquals([('item', ['SearchableText', 'Subject', 'Title', 'modified'])],
+                          self.catalog.reindexed)
+
+    def test_reindex_unmapped_field(self):
+        self.modified('title')
+        self.modified('description')
+        transaction.commit()
+        self.assertEquals([('item', [])], self.catalog.reindexed)
+
+    def test_removed_objects_skipped(self):
+        self.modified()
+        self.container._delOb('item')
+        transaction.commit()
+        self.assertEquals([], self.catalog.reindexed)
+
+    def test_reindex_immediately_by_default(self):
+        getConfiguration().product_config = None
+        self.modified('title')
+        self.assertEquals([('item', ['SearchableText', 'Title', 'modified'])],
+                          self.catalog.reindexed)
+        self.modified()
+        self.assertEquals(('item', []), self.catalog.reindexed[-1])
+
+    def test_abort_discards_queue(self):
+        self.modified()
+        transaction.abort()
+        transaction.commit()
+        self.assertEquals([], self.catalog.reindexed)
+
+class TestIndexingQueue(unittest.TestCase):
+
+    def test_put_and_pop(self):
+        queue = IndexingQueue()
+        queue.put('uid1', ('', 'site', 'one'), now=10.0)
+        queue.put('uid2', ('', 'site', 'two'), ['Title'], now=11.0)
+        queue.put('uid3', ('', 'site', 'three'), ['Title'], now=12.0)
+
+        # Requests for queued objects are merged
+        queue.put('uid2', ('', 'site', 'two'), ['Subject'], now=13.0)
+        queue.put('uid3', ('', 'site', 'three'), now=13.0)
+
+        self.assertEquals(3, len(queue))
+        self.assertEquals(5.0, queue.lag(now=15.0))
+
+        self.assertEquals([('uid1', ('', 'site', 'one'), None),
+                           ('uid2', ('', 'site', 'two'), frozenset(['Title', 'Subject'])),],
+                          queue.pop(2))
+        self.assertEquals(1, len(queue))
+        self.assertEquals(3.0, queue.lag(now=15.0))
+
+        self.assertEquals([('uid3', ('', 'site', 'three'), None)], queue.pop())
+        self.assertEquals(0, len(queue))
+        self.assertEquals(0.0, queue.lag())
+
+class TestAsyncIndexing(MockTestCase):
+
+    def setUp(self):
+        setHooks()
+        transaction.abort()
+        getConfiguration().product_config = {'plone.dexterity': {'async-indexing': '/site'}}
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+        self.mock_adapter(attributeUUID, IUUID, (IAttributeUUID,))
+
+        self.fti = DexterityFTI(u"testtype")
+        self.fti.schema = 'zope.interface.Interface'
+        self.fti.field_indexes = ('title: Title',)
+        self.mock_utility(self.fti, IDexterityFTI, name=u"testtype")
+
+    def tearDown(self):
+        super(TestAsyncIndexing, self).tearDown()
+        setSite(None)
+        transaction.abort()
+        getConfiguration().product_config = None
+
+    def makeSite(self):
+        site = SchemaGenerationSite('site')
+        site.getSiteManager().__bases__ = (getGlobalSiteManager(),)
+        site.portal_catalog = PersistentCatalog()
+        for id in ('one', 'two',):
+            item = Item(id)
+            item.portal_type = u"testtype"
+            setattr(item, ATTRIBUTE_NAME, 'uid-' + id)
+            site._setObject(id, item)
+        return site
+
+    def test_queue_and_process(self):
+        app = Application()
+        app._setObject('site', self.makeSite())
+        site = app.site
+        setSite(site)
+        catalog = site.portal_catalog
+
+        one = site.one
+        reindexOnModify(one, ObjectModifiedEvent(one, Attributes(IDummy, 'title')))
+        site.two.indexObject()
+        transaction.commit()
+
+        # Nothing is indexed in the request
+        self.assertEquals([], catalog.reindexed)
+        self.assertEquals(2, indexingQueueStatistics(site)['depth'])
+
+        self.assertEquals(2, processIndexingQueue(site))
+        self.assertEquals([('one', ['Title', 'modified']), ('two', [])], catalog.reindexed)
+        self.assertEquals(0, len(getIndexingQueue(site)))
+
+        # Sites that are not configured are indexed synchronously
+        getConfiguration().product_config = {'plone.dexterity': {'async-indexing': '/other'}}
+        del catalog.reindexed[:]
+        reindexOnModify(one, ObjectModifiedEvent(one, Attributes(IDummy, 'title')))
+        self.assertEquals([('one', ['Title', 'modified'])], catalog.reindexed)
+        self.assertEquals(0, len(getIndexingQueue(site)))
+
+    def test_worker(self):
+        tempdir = tempfile.mkdtemp()
+        db = DB(FileStorage(os.path.join(tempdir, 'Data.fs')))
+        try:
+            connection = db.open()
+            app = connection.root()['Application'] = Application()
+            app._setObject('site', self.makeSite())
+            site = app.site
+            setSite(site)
+            for id in ('one', 'two',):
+                site[id].indexObject()
+            transaction.commit()
+            setSite(None)
+
+            worker = IndexingWorker(db, '/site', batchSize=1)
+            self.assertEquals(2, worker.runOnce())
+            self.assertEquals(2, worker.stats()['processed'])
+
+            connection.sync()
+            self.assertEquals([('one', []), ('two', [])], site.portal_catalog.reindexed)
+
+            # Indexing is done as the system user, with a request
+            self.assertEquals(((u"System Processes", True),) * 2, site.portal_catalog.users)
+            self.assertEquals('Anonymous User', getSecurityManager().getUser().getUserName())
+            self.assertEquals(0, len(getIndexingQueue(site)))
+            connection.close()
+        finally:
+            db.close()
+            shutil.rmtree(tempdir)
+
+    def test_failing_entry(self):
+        tempdir = tempfile.mkdtemp()
+        db = DB(FileStorage(os.path.join(tempdir, 'Data.fs')))
+        try:
+            connection = db.open()
+            app = connection.root()['Application'] = Application()
+            app._setObject('site', self.makeSite())
+            site = app.site
+            site.portal_catalog = FailingCatalog()
+            setSite(site)
+            for id in ('one', 'two',):
+                site[id].indexObject()
+            transaction.commit()
+            setSite(None)
+
+            # The failing entry is queued again after the others, and its
+            # changes are rolled back
+            worker = IndexingWorker(db, '/site')
+            self.assertEquals(2, worker.runOnce())
+            connection.sync()
+            self.assertEquals([('two', [])], site.portal_catalog.reindexed)
+            queue = getIndexingQueue(site)
+            self.assertEquals(1, len(queue))
+            self.assertEquals(1, queue.failures('uid-one'))
+
+            # After MAX_INDEXING_ATTEMPTS it is dropped
+            self.assertEquals(1, worker.runOnce())
+            self.assertEquals(1, worker.runOnce())
+            connection.sync()
+            self.assertEquals(0, len(queue))
+            self.assertEquals(0, queue.failures('uid-one'))
+            self.assertEquals([('two', [])], site.portal_catalog.reindexed)
+            connection.close()
+        finally:
+            db.close()
+            shutil.rmtree(tempdir)
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+from plone.mocktestcase import MockTestCase
+
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+
+from zope.interface import Interface
+from zope.container.interfaces import INameChooser
+
+from plone.folder.interfaces import IOrdering
+from plone.folder.unordered import UnorderedOrdering
+
+from plone.dexterity.interfaces import IDexterityContainer
+from plone.dexterity.interfaces import IDexterityFTI
+
+from plone.dexterity.fti import DexterityFTI
+from plone.dexterity.content import Container
+from plone.dexterity.content import Item
+from plone.dexterity.namechooser import CountingNameChooser
+from plone.dexterity.namechooser import TimeOrderedNameChooser
+from plone.dexterity.utils import getNameChooser
+
+class TestNameChooser(MockTestCase):
+
+    def setUp(self):
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+
+    def test_counting(self):
+        container = Container('container')
+        chooser = CountingNameChooser(container)
+
+        names = []
+        for i in range(3):
+            name = chooser.chooseName(None, Item(title=u"My Title"))
+            container._setOb(name, Item(name))
+            names.append(name)
+        self.assertEquals(['my-title', 'my-title-1', 'my-title-2'], names)
+
+        # Ids that are taken otherwise are skipped
+        container._setOb('my-title-3', Item('my-title-3'))
+        self.assertEquals('my-title-4', chooser.chooseName(None, Item(title=u"My Title")))
+
+        # A name passed in is used as the base name
+        self.assertEquals('other', chooser.chooseName('other', Item(title=u"My Title")))
+        self.assertEquals('my-title-5', chooser.chooseName('my-title', Item()))
+
+        # Unicode names are made safe
+        self.assertEquals('other', chooser.chooseName(u"other", Item()))
+        self.assertEquals('caf', chooser.chooseName(u"caf\xe9", Item()))
+
+        # Without a title, the portal_type is used
+        item = Item()
+        item.portal_type = 'News Item'
+        self.assertEquals('news-item', chooser.chooseName(None, item))
+
+    def test_time_ordered(self):
+        container = Container('container')
+        chooser = TimeOrderedNameChooser(container)
+
+        first = chooser.chooseName(None, Item())
+        second = chooser.chooseName(None, Item())
+        self.assertNotEquals(first, second)
+        self.failUnless(chooser.chooseName('news', Item()).startswith('news-'))
+        self.failUnless(isinstance(chooser.chooseName(u"caf\xe9", Item()), str))
+
+    def test_getNameChooser(self):
+        class DefaultNameChooser(object):
+            def __init__(self, context):
+                pass
+        self.mock_adapter(DefaultNameChooser, INameChooser, (Interface,))
+        self.mock_adapter(CountingNameChooser, INameChooser, (IDexterityContainer,),
+                          name=u"dexterity.counter")
+
+        fti = DexterityFTI(u"folder")
+        self.mock_utility(fti, IDexterityFTI, name=u"folder")
+
+        self.replay()
+
+        container = Container('container')
+        container.portal_type = u"folder"
+        self.failUnless(isinstance(getNameChooser(container), DefaultNameChooser))
+
+        fti.name_chooser = u"dexterity.counter"
+        self.failUnless(isinstance(getNameChooser(container), CountingNameChooser))
+
+class TestNameChooserConflicts(MockTestCase):
+
+    def setUp(self):
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+        self.tempdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage(os.path.join(self.tempdir, 'Data.fs')))
+
+    def tearDown(self):
+        super(TestNameChooserConflicts, self).tearDown()
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_concurrent_adds(self):
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = self.db.open(transaction_manager=tm1)
+        conn2 = self.db.open(transaction_manager=tm2)
+
+        container = Container('container')
+        conn1.root()['container'] = container
+        for i in range(2):
+            name = CountingNameChooser(container).chooseName('item', Item())
+            container._setOb(name, Item(name))
+        tm1.commit()
+        tm2.begin()
+
+        container1 = conn1.root()['container']
+        container2 = conn2.root()['container']
+
+        # Both transactions pick the same id
+        name1 = CountingNameChooser(container1).chooseName('item', Item())
+        name2 = CountingNameChooser(container2).chooseName('item', Item())
+        self.assertEquals('item-2', name1)
+        self.assertEquals('item-2', name2)
+
+        container1._setOb(name1, Item(name1))
+        tm1.commit()
+        container2._setOb(name2, Item(name2))
+        self.assertRaises(ConflictError, tm2.commit)
+
+        # The retry gets a fresh id
+        tm2.abort()
+        container2 = conn2.root()['container']
+        name2 = CountingNameChooser(container2).chooseName('item', Item())
+        self.assertEquals('item-3', name2)
+        container2._setOb(name2, Item(name2))
+        tm2.commit()
+
+        conn1.sync()
+        self.assertEquals(['item', 'item-1', 'item-2', 'item-3'],
+                          sorted(conn1.root()['container'].objectIds()))
+
+        conn1.close()
+        conn2.close()
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -18,7 +18,7 @@ class PrimaryFieldInfoTestCase(MockTestCase):
             body = schema.Text()
         alsoProvides(ITest['body'], IPrimaryField)
 
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITest).count(0, None)
         self.expect(fti_mock.behaviors).result([]).count(0, None)
         self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")        
@@ -33,6 +33,32 @@ class PrimaryFieldInfoTestCase(MockTestCase):
         assert info.field == ITest['body']
         assert info.value == 'body text'
 
+    def test_primary_field_info_ignores_behaviors(self):
+        from plone.autoform.interfaces import IFormFieldProvider
+        from plone.behavior.interfaces import IBehavior
+        from plone.behavior.registration import BehaviorRegistration
+        from plone.dexterity.schema import SCHEMA_CACHE
+
+        class ITest(Interface):
+            title = schema.TextLine()
+        class IBehaviorSchema(Interface):
+            stuff = schema.Text()
+        alsoProvides(IBehaviorSchema['stuff'], IPrimaryField)
+        alsoProvides(IBehaviorSchema, IFormFieldProvider)
+
+        self.mock_utility(BehaviorRegistration(u"Stuff", "", IBehaviorSchema, None, None),
+                          IBehavior, name=u"stuff")
+        SCHEMA_CACHE.clear()
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ITest).count(0, None)
+        self.expect(fti_mock.behaviors).result([u"stuff"]).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+        self.replay()
+
+        item = Item('item')
+        item.portal_type = 'testtype'
+        self.assertRaises(TypeError, PrimaryFieldInfo, item)
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 from plone.mocktestcase import MockTestCase
 
@@ -139,5 +142,209 @@ class TestSchemaModuleFactory(MockTestCase):
         # Now we get the fields from the FTI's model
         self.assertEquals(('dummy',), tuple(zope.schema.getFieldNames(klass)))
 
+    def test_schema_snapshot(self):
+        tempdir = tempfile.mkdtemp()
+        schema.SCHEMA_SNAPSHOT.filename = os.path.join(tempdir, 'schemata.pickle')
+
+        class IDummy(Interface):
+            dummy = zope.schema.TextLine(title=u"Dummy", default=u"foo")
+        IDummy.setTaggedValue('dummy.tag', {'dummy': 'value'})
+        mock_model = Model({u"": IDummy})
+
+        fti = DexterityFTI(u"testtype")
+        fti.model_source = "<model />"
+        fti_mock = self.mocker.proxy(fti)
+        self.expect(fti_mock.lookupModel()).result(mock_model).count(2)
+        self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
+
+        self.mocker.replay()
+
+        schemaName = utils.portalTypeToSchemaName('testtype', prefix='site')
+
+        try:
+            # The first schema is generated from the model and saved
+            klass = schema.SchemaModuleFactory()(schemaName, schema.generated)
+            self.assertEquals(('dummy',), tuple(zope.schema.getFieldNames(klass)))
+            self.failUnless(os.path.exists(schema.SCHEMA_SNAPSHOT.filename))
+            delattr(schema.generated, schemaName)
+
+            # A new process loads it from the snapshot instead
+            schema.SCHEMA_SNAPSHOT.clear()
+            klass = schema.SchemaModuleFactory()(schemaName, schema.generated)
+            self.failUnless(klass.isOrExtends(IDexteritySchema))
+            self.assertEquals(('dummy',), tuple(zope.schema.getFieldNames(klass)))
+            self.failUnless(klass['dummy'].interface is klass)
+            self.assertEquals(u"foo", klass['dummy'].default)
+            self.assertEquals({'dummy': 'value'}, klass.getTaggedValue('dummy.tag'))
+            delattr(schema.generated, schemaName)
+
+            # The snapshot is ignored if the model changes
+            fti.model_source = "<model></model>"
+            klass = schema.SchemaModuleFactory()(schemaName, schema.generated)
+            self.assertEquals(('dummy',), tuple(zope.schema.getFieldNames(klass)))
+            delattr(schema.generated, schemaName)
+        finally:
+            schema.SCHEMA_SNAPSHOT.filename = None
+            schema.SCHEMA_SNAPSHOT.clear()
+            shutil.rmtree(tempdir)
+
+    def test_generated_schemata_do_not_share_cached_model(self):
+        from plone.supermodel.interfaces import FIELDSETS_KEY
+        from plone.supermodel.model import Fieldset
+
+        class IModel(Interface):
+            tags = zope.schema.List(title=u"Tags", value_type=zope.schema.TextLine())
+        IModel.setTaggedValue(FIELDSETS_KEY, [Fieldset('extra', fields=['tags'])])
+
+        fti = DexterityFTI(u"cachedtype")
+        fti.model_source = "<model />"
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        self.expect(loadString_mock("<model />", policy=u"dexterity")).result(Model({u"": IModel}))
+        self.mock_utility(fti, IDexterityFTI, u'cachedtype')
+        self.mocker.replay()
+
+        names = [utils.portalTypeToSchemaName('cachedtype', prefix=prefix)
+                 for prefix in ('site1', 'site2',)]
+        try:
+            one, two = [schema.SchemaModuleFactory()(name, schema.generated)
+                        for name in names]
+            self.failUnless(schema.lookupCachedModel(fti).schema is IModel)
+            self.failUnless(one.isOrExtends(IDexteritySchema))
+
+            # Each site's schema has its own fields and tagged values
+            self.failIf(one['tags'].value_type is IModel['tags'].value_type)
+            one.getTaggedValue(FIELDSETS_KEY)[0].fields.append('other')
+            self.assertEquals(['tags'], IModel.getTaggedValue(FIELDSETS_KEY)[0].fields)
+            self.assertEquals(['tags'], two.getTaggedValue(FIELDSETS_KEY)[0].fields)
+        finally:
+            for name in names:
+                schema.generated.__dict__.pop(name, None)
+            schema.MODEL_CACHE.clear()
+
+class TestSyncSchemaChanges(unittest.TestCase):
+
+    def makeSchema(self, **fields):
+        return InterfaceClass('ISource', (Interface,), fields)
+
+    def makeDest(self, source):
+        dest = InterfaceClass('IDest', (Interface,))
+        schema.syncSchema(source, dest, overwrite=True)
+        return dest
+
+    def test_no_changes(self):
+        source = self.makeSchema(
+            one=zope.schema.TextLine(title=u"One"),
+            two=zope.schema.Int(title=u"Two"))
+        dest = self.makeDest(source)
+        one = dest['one']
+
+        new = self.makeSchema(
+            one=zope.schema.TextLine(title=u"One"),
+            two=zope.schema.Int(title=u"Two"))
+        changes = schema.syncSchemaChanges(new, dest)
+
+        self.failIf(changes)
+        self.failUnless(dest['one'] is one)
+
+    def test_relabelled_fields_updated_in_place(self):
+        source = self.makeSchema(
+            one=zope.schema.TextLine(title=u"One"),
+            two=zope.schema.Int(title=u"Two"))
+        dest = self.makeDest(source)
+        one = dest['one']
+
+        new = self.makeSchema(
+            one=zope.schema.TextLine(title=u"First", description=u"The first"),
+            two=zope.schema.Int(title=u"Two"))
+        changes = schema.syncSchemaChanges(new, dest)
+
+        self.assertEquals(set(['one']), changes.relabelled)
+        self.assertEquals(set(), changes.changed)
+        self.failUnless(dest['one'] is one)
+        self.assertEquals(u"First", one.title)
+        self.assertEquals(u"The first", one.description)
+        self.failUnless(one.interface is dest)
+
+    def test_added_removed_and_changed_fields(self):
+        source = self.makeSchema(
+            one=zope.schema.TextLine(title=u"One"),
+            two=zope.schema.Int(title=u"Two"),
+            three=zope.schema.Int(title=u"Three"))
+        dest = self.makeDest(source)
+        one = dest['one']
+        two = dest['two']
+
+        new = self.makeSchema(
+            zero=zope.schema.Bool(title=u"Zero"),
+            one=zope.schema.TextLine(title=u"One"),
+            two=zope.schema.Int(title=u"Two", min=1))
+        new.setTaggedValue('tag', 'value')
+        changes = schema.syncSchemaChanges(new, dest)
+
+        self.assertEquals(set(['zero']), changes.added)
+        self.assertEquals(set(['three']), changes.removed)
+        self.assertEquals(set(['two']), changes.changed)
+        self.assertEquals(set(), changes.relabelled)
+        self.assertEquals(set(['tag']), changes.taggedValues)
+
+        self.assertEquals(['zero', 'one', 'two'],
+                          [name for name, field in zope.schema.getFieldsInOrder(dest)])
+        self.failUnless(dest['one'] is one)
+        self.failIf(dest['two'] is two)
+        self.assertEquals(1, dest['two'].min)
+        self.failUnless(dest['zero'].interface is dest)
+        self.assertEquals('value', dest.getTaggedValue('tag'))
+
+    def test_added_fields_and_tagged_values_copied(self):
+        source = self.makeSchema()
+        dest = self.makeDest(source)
+
+        new = self.makeSchema(
+            tags=zope.schema.List(title=u"Tags", default=[u"a"],
+                                  value_type=zope.schema.TextLine(title=u"Tag")))
+        new.setTaggedValue('tag', {'key': ['value']})
+        schema.syncSchemaChanges(new, dest)
+
+        # Changing dest in place leaves the source alone
+        dest['tags'].default.append(u"b")
+        dest['tags'].value_type.title = u"Other"
+        dest.getTaggedValue('tag')['key'].append('other')
+        self.assertEquals([u"a"], new['tags'].default)
+        self.assertEquals(u"Tag", new['tags'].value_type.title)
+        self.assertEquals({'key': ['value']}, new.getTaggedValue('tag'))
+        self.failUnless(dest['tags'].interface is dest)
+
+    def test_sync_model_changes_includes_named_schemata(self):
+        main = self.makeSchema(one=zope.schema.TextLine(title=u"One"))
+        named = self.makeSchema(two=zope.schema.Int(title=u"Two"))
+        names = [utils.portalTypeToSchemaName(u"synctype", schemaName, prefix='site')
+                 for schemaName in (u"", u"named")]
+        setattr(schema.generated, names[0], self.makeDest(main))
+        setattr(schema.generated, names[1], self.makeDest(named))
+        try:
+            newNamed = self.makeSchema(two=zope.schema.Int(title=u"Two", min=1))
+            model = Model({u"": main, u"named": newNamed})
+            changes = schema.syncModelChanges(u"synctype", model, 'site')
+            self.assertEquals(set(['two']), changes.changed)
+            self.assertEquals(1, getattr(schema.generated, names[1])['two'].min)
+
+            # A schema that is not loaded yet makes the changes unknown
+            delattr(schema.generated, names[1])
+            self.assertEquals(None, schema.syncModelChanges(u"synctype", model, 'site'))
+        finally:
+            for name in names:
+                schema.generated.__dict__.pop(name, None)
+
+    def test_invalidate_schema_for_label_changes(self):
+        schema.SCHEMA_CACHE._snapshot = {('get', u"testtype", 1): None}
+
+        changes = schema.SchemaChanges()
+        schema.invalidate_schema(schema.SchemaInvalidatedEvent(u"testtype", changes))
+        self.assertEquals(1, len(schema.SCHEMA_CACHE._snapshot))
+
+        changes.relabelled.add('one')
+        schema.invalidate_schema(schema.SchemaInvalidatedEvent(u"testtype", changes))
+        self.assertEquals(0, len(schema.SCHEMA_CACHE._snapshot))
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
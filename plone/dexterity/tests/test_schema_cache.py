@@ -1,12 +1,47 @@
+import os
+import shutil
+import tempfile
 import unittest
 from plone.mocktestcase import MockTestCase
 
+import transaction
+from persistent.TimeStamp import TimeStamp
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from OFS.Folder import Folder
+
+from zope.interface import implements
 from zope.interface import Interface
+from zope.interface import alsoProvides
+from zope.interface.interface import InterfaceClass
+from zope.component import provideUtility
+from zope.component.persistentregistry import PersistentComponents
+
+import zope.schema
+
+from plone.autoform.interfaces import IFormFieldProvider
+from plone.autoform.interfaces import READ_PERMISSIONS_KEY
+from plone.behavior.interfaces import IBehavior
+from plone.behavior.registration import BehaviorRegistration
+from plone.rfc822.interfaces import IPrimaryField
+from plone.supermodel.fields import TextHandler
+from plone.supermodel.fields import TextLineHandler
+from plone.supermodel.utils import syncSchema
+
+from Products.CMFCore.interfaces import ISiteRoot
 
 from plone.dexterity.interfaces import IDexterityFTI
 
 from plone.dexterity.fti import DexterityFTI
 from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.schema import DexteritySchemaPolicy
+from plone.dexterity.schema import bumpSchemaGeneration
+from plone.dexterity.schema import getSchemaGeneration
+from plone.dexterity.schema import syncSchemaGeneration
+from plone.dexterity.utils import portalTypeToSchemaName
+
+import plone.dexterity.schema
+import plone.dexterity.schema.generated
 
 class TestSchemaCache(MockTestCase):
     
@@ -74,6 +109,40 @@ class TestSchemaCache(MockTestCase):
         self.failUnless(schema1 is ISchema1)
         self.failUnless(schema2 is ISchema2)
     
+    def test_uncommitted_changes_not_cached(self):
+        from ZODB.MappingStorage import MappingStorage
+
+        class IMarker(Interface):
+            pass
+        provideUtility(BehaviorRegistration(u"Marker", "", IMarker, IMarker, None),
+                       IBehavior, name=u"marker")
+
+        db = DB(MappingStorage())
+        connection = db.open()
+        try:
+            fti = DexterityFTI(u"testtype")
+            connection.root()['fti'] = fti
+            transaction.commit()
+            self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+            self.replay()
+
+            self.assertEquals((), SCHEMA_CACHE.subtypes(u"testtype"))
+
+            # The thread making the change sees it straight away, as
+            # ftiModified invalidates the cache
+            fti.behaviors = (u"marker",)
+            SCHEMA_CACHE.invalidate(u"testtype")
+            self.assertEquals((IMarker,), SCHEMA_CACHE.subtypes(u"testtype"))
+
+            # but it is not published to other connections, and is
+            # forgotten if the transaction aborts
+            transaction.abort()
+            self.assertEquals((), SCHEMA_CACHE.subtypes(u"testtype"))
+        finally:
+            transaction.abort()
+            connection.close()
+            db.close()
+
     def test_none_not_cached(self):
 
         class ISchema1(Interface):
@@ -135,5 +204,271 @@ class TestSchemaCache(MockTestCase):
         self.failUnless(schema1 is None)
         self.failUnless(schema2 is schema3 is ISchema1)
 
+    def test_hit_does_not_take_lock(self):
+        import threading
+
+        class ISchema1(Interface):
+            pass
+
+        # FTI mock
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ISchema1).count(1)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        schema1 = SCHEMA_CACHE.get(u"testtype")
+
+        # A cache hit in another thread should not block whilst we hold
+        # the lock
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(SCHEMA_CACHE.get(u"testtype")))
+
+        SCHEMA_CACHE.lock.acquire()
+        try:
+            thread.start()
+            thread.join(5)
+            self.failIf(thread.isAlive())
+        finally:
+            SCHEMA_CACHE.lock.release()
+            thread.join()
+
+        self.failUnless(schema1 is result[0] is ISchema1)
+
+    def test_profile(self):
+
+        class ISchema(Interface):
+            title = zope.schema.TextLine(title=u"title")
+            body = zope.schema.Text(title=u"body")
+        alsoProvides(ISchema['body'], IPrimaryField)
+        ISchema.setTaggedValue(READ_PERMISSIONS_KEY, dict(body='cmf.ModifyPortalContent'))
+
+        class IBehaviorSchema(Interface):
+            title = zope.schema.TextLine(title=u"other title")
+            tags = zope.schema.List(title=u"tags")
+        alsoProvides(IBehaviorSchema, IFormFieldProvider)
+
+        class IMarker(Interface):
+            pass
+
+        behavior = BehaviorRegistration(
+            u"Behavior", "", IBehaviorSchema, IMarker, None)
+        self.mock_utility(behavior, IBehavior, name=u"behavior")
+
+        # FTI mock
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ISchema).count(2)
+        self.expect(fti_mock.behaviors).result([u"behavior"]).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        profile = SCHEMA_CACHE.profile(u"testtype")
+
+        self.failUnless(profile is SCHEMA_CACHE.profile(u"testtype"))
+        self.failUnless(profile.schema is ISchema)
+        self.assertEquals((ISchema, IBehaviorSchema), profile.schemata)
+        self.assertEquals((IMarker,), profile.subtypes)
+        self.assertEquals(
+            [ISchema['title'], ISchema['body'],
+             IBehaviorSchema['title'], IBehaviorSchema['tags']],
+            list(profile.fields))
+        self.failUnless(profile.fieldsByName['title'] is ISchema['title'])
+        self.failUnless(profile.fieldsByName['tags'] is IBehaviorSchema['tags'])
+        self.assertEquals((('body', ISchema['body']),), profile.primaryFields)
+        self.assertEquals({'body': 'cmf.ModifyPortalContent'},
+                          profile.readPermissions)
+        self.assertEquals({}, profile.writePermissions)
+
+        SCHEMA_CACHE.invalidate(u"testtype")
+        self.failIf(profile is SCHEMA_CACHE.profile(u"testtype"))
+
+    def test_profile_unknown_type(self):
+        self.replay()
+        self.failUnless(SCHEMA_CACHE.profile(u"othertype") is None)
+
+    def test_stats(self):
+
+        class ISchema(Interface):
+            pass
+
+        fti = DexterityFTI(u"testtype")
+        fti_mock = self.mocker.proxy(fti)
+        self.expect(fti_mock.lookupSchema()).result(ISchema).count(2)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        SCHEMA_CACHE.resetStats()
+
+        SCHEMA_CACHE.get(u"testtype")
+        SCHEMA_CACHE.get(u"testtype")
+        SCHEMA_CACHE.get(u"testtype")
+
+        # The FTI is modified
+        fti._p_serial = TimeStamp(2012, 1, 1, 0, 0, 0).raw()
+        SCHEMA_CACHE.get(u"testtype")
+
+        stats = SCHEMA_CACHE.stats()['get']
+        self.assertEquals(2, stats['hits'])
+        self.assertEquals(2, stats['misses'])
+        self.assertEquals(1, stats['staleMisses'])
+        self.failUnless(stats['computeTime'] >= 0.0)
+        self.failUnless(stats['lockWaitTime'] >= 0.0)
+        self.assertEquals(1, SCHEMA_CACHE.stats()['size'])
+
+        SCHEMA_CACHE.resetStats()
+        self.failIf('get' in SCHEMA_CACHE.stats())
+
+MODEL_V1 = """\
+<model xmlns="http://namespaces.plone.org/supermodel/schema">
+    <schema>
+        <field type="zope.schema.TextLine" name="title">
+            <title>Title</title>
+        </field>
+    </schema>
+</model>
+"""
+
+MODEL_V2 = """\
+<model xmlns="http://namespaces.plone.org/supermodel/schema">
+    <schema>
+        <field type="zope.schema.TextLine" name="title">
+            <title>Title</title>
+        </field>
+        <field type="zope.schema.Text" name="body">
+            <title>Body</title>
+        </field>
+    </schema>
+</model>
+"""
+
+class SchemaGenerationSite(Folder):
+    implements(ISiteRoot)
+
+    def __init__(self, id):
+        Folder.__init__(self, id)
+        self._components = PersistentComponents()
+
+    def getSiteManager(self):
+        return self._components
+
+    def getPhysicalPath(self):
+        return ('', self.getId(),)
+
+class TestSchemaGeneration(MockTestCase):
+
+    def setUp(self):
+        SCHEMA_CACHE.clear()
+        provideUtility(DexteritySchemaPolicy(), name=u"dexterity")
+        provideUtility(TextHandler, name=u"zope.schema.Text")
+        provideUtility(TextLineHandler, name=u"zope.schema.TextLine")
+        self.tempdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage(os.path.join(self.tempdir, 'Data.fs')))
+
+    def tearDown(self):
+        super(TestSchemaGeneration, self).tearDown()
+        plone.dexterity.schema._syncedGenerations.clear()
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_generation_syncs_other_clients(self):
+        # Two connections with their own transaction managers stand in for
+        # two ZEO clients sharing a storage
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = self.db.open(transaction_manager=tm1)
+        conn2 = self.db.open(transaction_manager=tm2)
+
+        site1 = SchemaGenerationSite('site')
+        fti1 = DexterityFTI(u"testtype")
+        fti1.model_source = MODEL_V1
+        site1.getSiteManager().registerUtility(fti1, IDexterityFTI, name=u"testtype")
+        conn1.root()['site'] = site1
+        tm1.commit()
+
+        tm2.begin()
+        site2 = conn2.root()['site']
+        self.assertEquals(0, getSchemaGeneration(site2))
+
+        # The generated schema, as loaded by SchemaModuleFactory
+        schemaName = portalTypeToSchemaName(u"testtype", prefix='site')
+        schema = InterfaceClass(schemaName, (),
+                                __module__='plone.dexterity.schema.generated')
+        fti2 = site2.getSiteManager().getUtility(IDexterityFTI, name=u"testtype")
+        syncSchema(fti2.lookupModel().schema, schema)
+        setattr(plone.dexterity.schema.generated, schemaName, schema)
+
+        try:
+            self.assertEquals(['title'], schema.names())
+
+            # Nothing to do before the first schema change
+            syncSchemaGeneration(site2)
+            self.assertEquals(['title'], schema.names())
+
+            # Change the model on the first client
+            fti1.model_source = MODEL_V2
+            bumpSchemaGeneration(site1)
+            tm1.commit()
+            self.assertEquals(1, getSchemaGeneration(site1))
+
+            # The second client picks up the change at the start of its next
+            # transaction
+            syncSchemaGeneration(site2)
+            self.assertEquals(['title'], schema.names())
+
+            tm2.begin()
+            self.assertEquals(1, getSchemaGeneration(site2))
+            syncSchemaGeneration(site2)
+            self.assertEquals(['body', 'title'], sorted(schema.names()))
+
+            # Schema changes made concurrently on both clients do not
+            # conflict
+            tm1.begin()
+            bumpSchemaGeneration(site1)
+            bumpSchemaGeneration(site2)
+            tm1.commit()
+            tm2.commit()
+
+            tm1.begin()
+            self.assertEquals(3, getSchemaGeneration(site1))
+        finally:
+            delattr(plone.dexterity.schema.generated, schemaName)
+            tm1.abort()
+            tm2.abort()
+            conn1.close()
+            conn2.close()
+
+    def test_sync_skips_schemata_not_yet_loaded(self):
+        test = self
+        class FTI(DexterityFTI):
+            def _lookupCachedModel(self):
+                test.fail("The model should not have been looked up")
+            def lookupModel(self):
+                test.fail("The model should not have been looked up")
+
+        site = SchemaGenerationSite('site')
+        fti = FTI(u"testtype")
+        fti.model_source = MODEL_V1
+        site.getSiteManager().registerUtility(fti, IDexterityFTI, name=u"testtype")
+        bumpSchemaGeneration(site)
+
+        # A new process only records the generation the first time it sees
+        # the site, even if it has loaded schemata already
+        schemaName = portalTypeToSchemaName(u"testtype", prefix='site')
+        schema = InterfaceClass(schemaName, (),
+                                __module__='plone.dexterity.schema.generated')
+        setattr(plone.dexterity.schema.generated, schemaName, schema)
+        try:
+            syncSchemaGeneration(site)
+        finally:
+            delattr(plone.dexterity.schema.generated, schemaName)
+
+        # Models are only looked up for types with loaded schemata
+        bumpSchemaGeneration(site)
+        syncSchemaGeneration(site)
+        self.failIf(schemaName in plone.dexterity.schema.generated.__dict__)
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -4,6 +4,8 @@ from plone.mocktestcase import MockTestCase
 from zope.interface import Interface
 import zope.schema
 
+from App.config import getConfiguration
+
 from zope.security.interfaces import IPermission
 from zope.security.permission import Permission
 
@@ -33,7 +35,7 @@ class TestAttributeProtection(MockTestCase):
         ITestSchema.setTaggedValue(READ_PERMISSIONS_KEY, dict(test='zope2.View', foo='foo.View'))
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
@@ -74,7 +76,7 @@ class TestAttributeProtection(MockTestCase):
         ITestSchema.setTaggedValue(READ_PERMISSIONS_KEY, dict(test='zope2.View', foo='foo.View'))
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
@@ -117,7 +119,7 @@ class TestAttributeProtection(MockTestCase):
             pass
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
@@ -156,7 +158,7 @@ class TestAttributeProtection(MockTestCase):
             test = zope.schema.TextLine(title=u"Test")
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
@@ -186,7 +188,7 @@ class TestAttributeProtection(MockTestCase):
         ITestSchema.setTaggedValue(READ_PERMISSIONS_KEY, dict(foo='foo.View'))
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
         self.expect(fti_mock.lookupSchema()).result(ITestSchema)
@@ -219,7 +221,7 @@ class TestAttributeProtection(MockTestCase):
     def test_no_schema(self):
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(None).count(3) # not cached this time
 
         self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
@@ -239,7 +241,7 @@ class TestAttributeProtection(MockTestCase):
     def test_schema_exception(self):
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         
         self.expect(fti_mock.lookupSchema()).count(3).throw(AttributeError)
 
@@ -260,7 +262,7 @@ class TestAttributeProtection(MockTestCase):
     def test_empty_name(self):
         
         # Mock FTI
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).count(0)
         self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
 
@@ -272,5 +274,86 @@ class TestAttributeProtection(MockTestCase):
         
         self.assertTrue(item.__allow_access_to_unprotected_subobjects__('', u"foo"))
 
+class TestPermissionMemo(MockTestCase):
+
+    def setUp(self):
+        from AccessControl.SecurityManagement import newSecurityManager
+        from AccessControl.users import SimpleUser
+
+        self.checks = checks = []
+
+        class User(SimpleUser):
+            def allowed(self, object, object_roles=None):
+                checks.append(object.getId())
+                return SimpleUser.allowed(self, object, object_roles)
+
+        newSecurityManager(None, User('bob', '', (), ()))
+        getConfiguration().product_config = {'plone.dexterity': {'permission-memo': 'on'}}
+
+    def tearDown(self):
+        from AccessControl.SecurityManagement import noSecurityManager
+        noSecurityManager()
+        getConfiguration().product_config = None
+        super(TestPermissionMemo, self).tearDown()
+
+    def test_memoized_per_role_map(self):
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAnnotations
+        from zope.publisher.browser import TestRequest
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+        from Products.CMFCore.permissions import ModifyPortalContent
+        from plone.dexterity.security import checkPermission
+        from plone.dexterity.security import clearPermissionMemo
+
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+        self.mock_adapter(AttributeAnnotations, IAnnotations, (Interface,))
+        self.replay()
+
+        request = TestRequest()
+        container = Container('container')
+        container.REQUEST = request
+        container.manage_permission(ModifyPortalContent, ('Owner',))
+        for id in ('a', 'b', 'c',):
+            container._setOb(id, Item(id))
+        container['c'].manage_setLocalRoles('bob', ['Owner'])
+
+        def check(*ids):
+            return [bool(checkPermission(ModifyPortalContent, container[id])) for id in ids]
+
+        # Items granting the user the same roles share a result
+        self.assertEquals([False, False, True, False, True], check('a', 'b', 'c', 'a', 'c'))
+        self.assertEquals(['a', 'c'], self.checks)
+
+        # Changing local roles or permission settings gives a new key. Now
+        # 'a' grants the same roles as 'c' and shares its result.
+        del self.checks[:]
+        container['a'].manage_setLocalRoles('bob', ['Owner'])
+        self.assertEquals([True, False], check('a', 'b'))
+        self.assertEquals([], self.checks)
+        container.manage_permission(ModifyPortalContent, ('Manager',))
+        self.assertEquals([False, False], check('a', 'c'))
+        self.assertEquals(['a'], self.checks)
+
+        # The memo can be cleared
+        del self.checks[:]
+        check('a')
+        clearPermissionMemo(request)
+        check('a')
+        self.assertEquals(['a'], self.checks)
+
+        # Without a request, nothing is memoized
+        del self.checks[:]
+        item = Item('d')
+        self.assertFalse(checkPermission(ModifyPortalContent, item))
+        self.assertFalse(checkPermission(ModifyPortalContent, item))
+        self.assertEquals(['d', 'd'], self.checks)
+
+        # Nor unless it is enabled
+        del self.checks[:]
+        getConfiguration().product_config = None
+        check('b', 'b')
+        self.assertEquals(['b', 'b'], self.checks)
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -16,6 +16,7 @@ class TestUtils(MockTestCase):
 
     def test_portalTypeToSchemaName_looks_up_portal_for_prefix(self):
         portal_mock = self.mocker.mock()
+        self.expect(portal_mock._p_oid).result(None)
         self.expect(portal_mock.getPhysicalPath()).result(('', 'foo', 'portalid'))
         self.mock_utility(portal_mock, ISiteRoot)
         
@@ -24,6 +25,46 @@ class TestUtils(MockTestCase):
         self.assertEquals('foo_4_portalid_0_type',
             utils.portalTypeToSchemaName('type'))
 
+    def test_site_prefix_cached(self):
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+        from plone.dexterity.tests.test_schema_cache import SchemaGenerationSite
+
+        db = DB(MappingStorage())
+        conn = db.open()
+        try:
+            site = SchemaGenerationSite('site')
+            conn.root()['site'] = site
+            transaction.commit()
+
+            self.assertEquals('site', utils.getSitePrefix(site))
+
+            site.getPhysicalPath = lambda: ('', 'other')
+            self.assertEquals('site', utils.getSitePrefix(site))
+
+            # The cache is cleared when a site is moved
+            utils.sitePrefixChanged(site, None)
+            self.assertEquals('other', utils.getSitePrefix(site))
+        finally:
+            transaction.abort()
+            conn.close()
+            db.close()
+            utils._sitePrefixes.clear()
+
+    def test_schema_names_memoized(self):
+        name = utils.portalTypeToSchemaName('type one.two', 'schema', 'prefix')
+        self.assertEquals('prefix_0_type_1_one_2_two_0_schema', name)
+        self.failUnless(name is utils.portalTypeToSchemaName('type one.two', 'schema', 'prefix'))
+
+        parts = utils.splitSchemaName(name)
+        self.assertEquals(('prefix', 'type one.two', 'schema',), parts)
+        self.failUnless(parts is utils.splitSchemaName(name))
+
+        # Names that are not valid are not remembered
+        self.assertRaises(ValueError, utils.splitSchemaName, '__file__')
+        self.failIf('__file__' in utils._schemaNameParts)
+
     def test_schemaNameToPortalType(self):
         self.assertEquals('type',
             utils.schemaNameToPortalType('prefix_0_type_0_schema'))
@@ -54,13 +95,15 @@ class TestUtils(MockTestCase):
         class IBehaviorSchema(Interface):
             pass
 
-        behavior_mock = self.mocker.mock()
-        fti_mock = self.mocker.mock()
-        provider_mock = self.mocker.mock()
+        from plone.dexterity.fti import DexterityFTI
 
         portal_type = 'prefix_0_type_0_schema'
         behavior_name = 'behavior_0'
 
+        behavior_mock = self.mocker.mock()
+        fti_mock = self.mocker.proxy(DexterityFTI(portal_type))
+        provider_mock = self.mocker.mock()
+
         fti_mock.behaviors
         self.mocker.result((behavior_name, ))
 
@@ -84,6 +127,290 @@ class TestUtils(MockTestCase):
         schemata = schematas[0]
         self.assertTrue(schemata is IBehaviorSchema)
 
+    def test_getAdditionalSchemata_context(self):
+        from plone.dexterity.interfaces import IDexterityFTI
+        from plone.behavior.interfaces import IBehavior
+        from plone.behavior.interfaces import IBehaviorAssignable
+        from plone.behavior.registration import BehaviorRegistration
+        from plone.autoform.interfaces import IFormFieldProvider
+        from plone.dexterity.behavior import DexterityBehaviorAssignable
+        from plone.dexterity.content import Item
+        from plone.dexterity.fti import DexterityFTI
+
+        from zope.interface import Interface
+        from zope.interface import providedBy
+
+        class IBehaviorInterface(Interface):
+            pass
+
+        class IBehaviorSchema(Interface):
+            pass
+
+        fti = DexterityFTI(u"testtype")
+        fti.behaviors = ('behavior',)
+        provider_mock = self.mocker.mock()
+
+        # The form field schemata of the FTI's behaviors are looked up once
+        provider_mock(IBehaviorInterface)
+        self.mocker.result(IBehaviorSchema)
+
+        behavior = BehaviorRegistration(u"Behavior", "", IBehaviorInterface, None, None)
+        self.mock_utility(behavior, IBehavior, 'behavior')
+        self.mock_utility(fti, IDexterityFTI, u"testtype")
+        self.mock_adapter(DexterityBehaviorAssignable, IBehaviorAssignable, (Interface,))
+        self.mock_adapter(provider_mock, IFormFieldProvider,
+                          (providedBy(IBehaviorInterface), ))
+
+        self.replay()
+
+        item = Item('item')
+        item.portal_type = u"testtype"
+        self.assertEqual([IBehaviorSchema], list(utils.getAdditionalSchemata(context=item)))
+        self.assertEqual([IBehaviorSchema], list(utils.getAdditionalSchemata(context=item)))
+
+    def test_resolveDottedName(self):
+        resolver = utils.DottedNameResolver()
+        self.failUnless(resolver.resolve('plone.dexterity.utils') is utils)
+        self.failUnless(resolver.resolve('plone.dexterity.utils') is utils)
+        self.assertEquals(1, resolver.hits)
+        self.assertEquals(1, resolver.misses)
+
+    def test_resolveDottedName_failures_cached(self):
+        resolver = utils.DottedNameResolver()
+        self.assertRaises(ImportError, resolver.resolve, 'plone.dexterity.missing')
+        self.assertRaises(ImportError, resolver.resolve, 'plone.dexterity.missing')
+        self.assertEquals(1, resolver.misses)
+        self.assertEquals(1, resolver.failureHits)
+
+        # Failures are retried once they expire
+        resolver.ttl = 0
+        resolver.clear()
+        self.assertRaises(ImportError, resolver.resolve, 'plone.dexterity.missing')
+        self.assertRaises(ImportError, resolver.resolve, 'plone.dexterity.missing')
+        self.assertEquals(2, resolver.misses)
+        self.assertEquals(0, resolver.failureHits)
+
+    def test_resolveDottedName_failures_bounded(self):
+        resolver = utils.DottedNameResolver(maxFailures=2)
+        for name in ('one', 'two', 'three'):
+            self.assertRaises(ImportError, resolver.resolve, 'plone.dexterity.missing_' + name)
+        self.assertEquals(2, resolver.stats()['failures'])
+        self.assertRaises(ImportError, resolver.resolve, 'plone.dexterity.missing_one')
+        self.assertEquals(4, resolver.misses)
+
+    def test_queryFTI_cached(self):
+        from zope.component import getGlobalSiteManager
+        from zope.component import provideUtility
+        from zope.component.interfaces import ComponentLookupError
+        from plone.dexterity.fti import DexterityFTI
+        from plone.dexterity.interfaces import IDexterityFTI
+
+        self.assertEquals(None, utils.queryFTI(u"testtype"))
+        self.assertEquals(1, utils.queryFTI(u"testtype", 1))
+        self.assertRaises(ComponentLookupError, utils.getFTI, u"testtype")
+
+        # Registering the FTI invalidates the cache
+        fti = DexterityFTI(u"testtype")
+        provideUtility(fti, IDexterityFTI, name=u"testtype")
+        self.failUnless(utils.queryFTI(u"testtype") is fti)
+        self.failUnless(utils.getFTI(u"testtype") is fti)
+
+        registry = getGlobalSiteManager().utilities
+        self.assertEquals({u"testtype": fti}, registry._v_dexterity_ftis[1])
+
+        # So does unregistering it
+        getGlobalSiteManager().unregisterUtility(fti, IDexterityFTI, name=u"testtype")
+        self.assertEquals(None, utils.queryFTI(u"testtype"))
+
+    def test_createContentsInContainer(self):
+        from zope.component import provideHandler
+        from zope.component.event import objectEventNotify
+        from zope.component.interfaces import IFactory
+        from zope.container.interfaces import INameChooser
+        from zope.interface import implements
+        from zope.interface import Interface
+        from zope.lifecycleevent.interfaces import IObjectAddedEvent
+        from plone.dexterity.content import Container
+        from plone.dexterity.factory import DexterityFactory
+        from plone.dexterity.fti import DexterityFTI
+        from plone.dexterity.interfaces import IDexterityContent
+        from plone.dexterity.interfaces import IDexterityFTI
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+
+        log = []
+
+        class Catalog(object):
+            def indexObject(self, obj):
+                log.append(('index', obj.getId()))
+
+        container = Container('container')
+        container.portal_catalog = Catalog()
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+
+        # The constraints are checked once per type
+        for portal_type in (u"one", u"two",):
+            fti = DexterityFTI(portal_type)
+            fti.schema = 'zope.interface.Interface'
+            fti_mock = self.mocker.proxy(fti)
+            self.expect(fti_mock.isConstructionAllowed(container)).result(True)
+            self.mock_utility(fti_mock, IDexterityFTI, name=portal_type)
+            self.mock_utility(DexterityFactory(portal_type), IFactory, name=portal_type)
+
+        # The name chooser is adapted once
+        class NameChooser(object):
+            implements(INameChooser)
+            def __init__(self, context):
+                log.append(('chooser', None))
+            def chooseName(self, name, object):
+                return object.title.encode('ascii')
+        self.mock_adapter(NameChooser, INameChooser, (Interface,))
+
+        def added(obj, event):
+            log.append(('added', obj.getId()))
+            obj.indexObject()
+        provideHandler(added, (IDexterityContent, IObjectAddedEvent,))
+        provideHandler(objectEventNotify)
+
+        self.replay()
+
+        items = ((u"one", {'title': u"a"}),
+                 (u"two", {'title': u"b"}),
+                 (u"one", {'title': u"c"}),)
+        names = utils.createContentsInContainer(container, iter(items), batchSize=2)
+
+        self.assertEquals(['a', 'b', 'c'], names)
+        self.assertEquals(u"two", container['b'].portal_type)
+        self.assertEquals(u"c", container['c'].title)
+
+        # Indexing is deferred to the end of each batch
+        self.assertEquals([('chooser', None),
+                           ('added', 'a'), ('added', 'b'),
+                           ('index', 'a'), ('index', 'b'),
+                           ('added', 'c'),
+                           ('index', 'c'),], log)
+
+        # Outside of a bulk operation, objects are indexed right away
+        del log[:]
+        container['a'].indexObject()
+        self.assertEquals([('index', 'a')], log)
+
+        # Objects added before an error are still indexed
+        from zope.component.interfaces import ComponentLookupError
+        del log[:]
+        items = ((u"one", {'title': u"d"}),
+                 (u"three", {'title': u"e"}),)
+        self.assertRaises(ComponentLookupError, utils.createContentsInContainer,
+                          container, iter(items), checkConstraints=False)
+        self.assertEquals([('chooser', None), ('added', 'd'), ('index', 'd')], log)
+
+    def test_deleteContentsInContainer(self):
+        from zExceptions import Unauthorized
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAnnotations
+        from zope.component import provideHandler
+        from zope.component.event import objectEventNotify
+        from zope.container.interfaces import IContainerModifiedEvent
+        from zope.interface import Interface
+        from zope.lifecycleevent.interfaces import IObjectRemovedEvent
+        from OFS.interfaces import IObjectWillBeRemovedEvent
+        from Products.CMFCore.permissions import DeleteObjects
+        from plone.dexterity.content import Container
+        from plone.dexterity.content import Item
+        from plone.dexterity.interfaces import IDexterityContent
+        from plone.folder.default import DefaultOrdering
+        from plone.folder.interfaces import IOrdering
+
+        log = []
+
+        class Catalog(object):
+            def uncatalog_object(self, path):
+                log.append(('unindex', path))
+            def unindexObject(self, obj):
+                log.append(('unindex', obj.getId()))
+
+        self.mock_adapter(DefaultOrdering, IOrdering, (Interface,))
+        self.mock_adapter(AttributeAnnotations, IAnnotations, (Interface,))
+
+        def willBeRemoved(obj, event):
+            log.append(('willBeRemoved', obj.getId(), obj.getId() in event.oldParent))
+            if obj.getId() == 'g':
+                raise ValueError(obj.getId())
+            obj.unindexObject()
+        provideHandler(willBeRemoved, (IDexterityContent, IObjectWillBeRemovedEvent,))
+        def removed(obj, event):
+            log.append(('removed', obj.getId(), obj.getId() in event.oldParent))
+        provideHandler(removed, (IDexterityContent, IObjectRemovedEvent,))
+        def modified(obj, event):
+            log.append(('modified', obj.getId()))
+        provideHandler(modified, (IDexterityContent, IContainerModifiedEvent,))
+        provideHandler(objectEventNotify)
+
+        self.replay()
+
+        container = Container('container')
+        container.portal_catalog = Catalog()
+        for id in ('a', 'b', 'c', 'd', 'e',):
+            container._setObject(id, Item(id), suppress_events=True)
+
+        # The permission is checked on the container, and on objects that
+        # have it set locally
+        container.manage_permission(DeleteObjects, ('Anonymous',))
+        container['e'].manage_permission(DeleteObjects, ('Manager',))
+        self.assertRaises(Unauthorized, utils.deleteContentsInContainer,
+                          container, ['a', 'e'])
+        self.assertEquals(['a', 'b', 'c', 'd', 'e'], container.objectIds())
+
+        utils.deleteContentsInContainer(container, ['a', 'b', 'c'], batchSize=2)
+
+        # Events are fired and unindexing is done per batch
+        self.assertEquals([('willBeRemoved', 'a', True), ('willBeRemoved', 'b', True),
+                           ('removed', 'a', False), ('removed', 'b', False),
+                           ('unindex', 'container/a'), ('unindex', 'container/b'),
+                           ('willBeRemoved', 'c', True),
+                           ('removed', 'c', False),
+                           ('unindex', 'container/c'),
+                           ('modified', 'container'),], log)
+
+        # The ordering is kept up to date
+        self.assertEquals(['d', 'e'], container.objectIds())
+        self.assertEquals(1, container.getObjectPosition('e'))
+
+        # Trusted code can skip the permission check
+        utils.deleteContentsInContainer(container, ['e'], checkPermission=False)
+        self.assertEquals(['d'], container.objectIds())
+
+        # Outside of a bulk operation, objects are unindexed right away
+        del log[:]
+        container['d'].unindexObject()
+        self.assertEquals([('unindex', 'd')], log)
+
+        # Objects unindexed before an error are still unindexed
+        del log[:]
+        for id in ('f', 'g',):
+            container._setObject(id, Item(id), suppress_events=True)
+        self.assertRaises(ValueError, utils.deleteContentsInContainer,
+                          container, ['f', 'g'], checkPermission=False)
+        self.assertEquals([('willBeRemoved', 'f', True), ('willBeRemoved', 'g', True),
+                           ('unindex', 'container/f'),], log)
+
+
+    def test_deleteContentsInContainer_object_manager(self):
+        from OFS.Folder import Folder
+        from plone.dexterity.content import Item
+
+        container = Folder('container')
+        for id in ('a', 'b', 'c',):
+            container._setObject(id, Item(id), suppress_events=True)
+        a = container._getOb('a')
+
+        utils.deleteContentsInContainer(container, ['a', 'b'], checkPermission=False)
+
+        # _objects is kept up to date, and the objects are told they were
+        # deleted, as by ObjectManager._delObject()
+        self.assertEquals(['c'], container.objectIds())
+        self.assertEquals(None, container._getOb('a', None))
+        self.assertEquals(1, a._v__object_deleted__)
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -1,5 +1,7 @@
+import json
 import unittest
 import mocker
+import zope.schema
 from plone.mocktestcase import MockTestCase
 
 from zope.interface import implements, Interface, alsoProvides
@@ -24,9 +26,12 @@ from plone.dexterity.browser.add import DefaultAddForm
 from plone.dexterity.browser.add import DefaultAddView
 from plone.dexterity.browser.edit import DefaultEditForm
 from plone.dexterity.browser.view import DefaultView
+from plone.dexterity.browser.statistics import CacheStatisticsView
+from plone.dexterity.browser.export import ExportView
 
 from plone.dexterity.content import Item, Container
 from plone.dexterity.fti import DexterityFTI
+from plone.dexterity.schema import SCHEMA_CACHE
 
 from zope.publisher.browser import TestRequest as TestRequestBase
 from zope.container.interfaces import INameChooser
@@ -45,6 +50,9 @@ class TestRequest(TestRequestBase):
 class ISchema(Interface):
     pass
 
+class IExportSchema(Interface):
+    foo = zope.schema.TextLine(title=u"foo")
+
 class IBehaviorOne(Interface):
     pass
 alsoProvides(IBehaviorOne, IFormFieldProvider)
@@ -271,6 +279,8 @@ class TestAddView(MockTestCase):
         # When we register our own IBehaviorAssignable we can
         # influence what goes into the additionalSchemata:
         provideAdapter(NoBehaviorAssignable)
+        # The behaviors were changed, which invalidates the schema cache
+        SCHEMA_CACHE.invalidate(u"testtype")
         self.assertEquals([], list(view.additionalSchemata,))
 
     def test_fires_add_begun_event(self):
@@ -523,6 +533,90 @@ class TestDefaultView(MockTestCase):
         provideAdapter(NoBehaviorAssignable)
         self.assertEquals([], list(view.additionalSchemata,))
 
+    def test_cache_statistics(self):
+        SCHEMA_CACHE._getStats('get')['hits'] = 3
+
+        request = TestRequest()
+        view = CacheStatisticsView(object(), request)
+        statistics = json.loads(view())
+        self.assertEquals(3, statistics['schemaCache']['get']['hits'])
+        self.assertEquals('application/json', request.response.getHeader('Content-Type'))
+        self.failUnless('schemaModuleFactory' in statistics)
+        self.failUnless('modelCache' in statistics)
+
+        # Statistics are only reset on POST
+        request = TestRequest(form={'reset': '1'})
+        CacheStatisticsView(object(), request)()
+        self.assertEquals(3, SCHEMA_CACHE.stats()['get']['hits'])
+
+        request = TestRequest(form={'reset': '1'}, REQUEST_METHOD='POST')
+        statistics = json.loads(CacheStatisticsView(object(), request)())
+        self.assertEquals(3, statistics['schemaCache']['get']['hits'])
+        self.failIf('get' in SCHEMA_CACHE.stats())
+
+class TestExportView(MockTestCase):
+
+    def test_export(self):
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+        self.mock_adapter(UnorderedOrdering, IOrdering, (Interface,))
+
+        for portal_type in (u"item", u"folder",):
+            fti = DexterityFTI(portal_type)
+            fti.schema = IExportSchema.__identifier__
+            self.mock_utility(fti, IDexterityFTI, name=portal_type)
+
+        checkPermission_mock = self.mocker.replace('plone.dexterity.security.checkPermission')
+        self.expect(checkPermission_mock(mocker.ANY, mocker.ANY)).result(True).count(0, None)
+
+        def create(factory, id, portal_type):
+            obj = factory(id)
+            obj.portal_type = portal_type
+            obj.foo = u"foo-" + id
+            return obj
+
+        root = create(Container, 'root', u"folder")
+        root._setOb('c', create(Item, 'c', u"item"))
+        root._setOb('a', create(Item, 'a', u"item"))
+        folder = create(Container, 'b', u"folder")
+        folder._setOb('x', create(Item, 'x', u"item"))
+        folder._setOb('y', create(Item, 'y', u"item"))
+        root._setOb('b', folder)
+
+        self.replay()
+
+        def export(**form):
+            from StringIO import StringIO
+            from Testing.makerequest import makerequest
+            stdout = StringIO()
+            request = makerequest(root, stdout=stdout).REQUEST
+            request.form.update(form)
+            view = ExportView(root, request)
+            view.batchSize = 2
+            self.assertEquals('', view())
+
+            # The headers are sent with the first chunk, and the lines are
+            # written as they are exported
+            headers, data = stdout.getvalue().split('\r\n\r\n', 1)
+            self.failUnless('Content-Type: application/x-ndjson' in headers)
+            self.failUnless('Content-Disposition: attachment; filename="root.jsonl"' in headers)
+            return [json.loads(line) for line in data.splitlines()]
+
+        lines = export()
+        self.assertEquals(['a', 'b', 'c'], [line['key'] for line in lines])
+        self.assertEquals({'key': 'a', 'id': 'a', 'portal_type': u"item", 'uid': None,
+                           'fields': {'foo': u"foo-a"}}, lines[0])
+
+        lines = export(recursive='1')
+        self.assertEquals(['a', 'b', 'b/x', 'b/y', 'c'], [line['key'] for line in lines])
+
+        # An interrupted export can be resumed
+        self.assertEquals(['b/y', 'c'],
+                          [line['key'] for line in export(recursive='1', after='b/x')])
+        self.assertEquals(['b/x', 'b/y', 'c'],
+                          [line['key'] for line in export(recursive='1', after='b')])
+        self.assertEquals(['c'], [line['key'] for line in export(after='b')])
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
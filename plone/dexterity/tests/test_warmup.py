@@ -0,0 +1,95 @@
+import unittest
+from plone.mocktestcase import MockTestCase
+
+from App.config import getConfiguration
+
+from zope.component import getGlobalSiteManager
+from zope.component import provideUtility
+from zope.component.hooks import setHooks
+
+from plone.supermodel.fields import TextHandler
+from plone.supermodel.fields import TextLineHandler
+
+from Products.CMFCore.interfaces import ISiteRoot
+
+from plone.dexterity.interfaces import IDexterityFTI
+
+from plone.dexterity.fti import DexterityFTI
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.schema import MODEL_CACHE
+from plone.dexterity.schema import DexteritySchemaPolicy
+from plone.dexterity.schema import SchemaModuleFactory
+from plone.dexterity.utils import portalTypeToSchemaName
+from plone.dexterity.warmup import warmUp
+from plone.dexterity.warmup import warmUpOnTraverse
+
+from plone.dexterity.tests.test_schema_cache import MODEL_V1
+from plone.dexterity.tests.test_schema_cache import MODEL_V2
+from plone.dexterity.tests.test_schema_cache import SchemaGenerationSite
+
+import plone.dexterity.warmup
+import plone.dexterity.schema.generated
+
+class TestWarmUp(MockTestCase):
+
+    def setUp(self):
+        setHooks()
+        SCHEMA_CACHE.clear()
+        MODEL_CACHE.clear()
+        provideUtility(DexteritySchemaPolicy(), name=u"dexterity")
+        provideUtility(SchemaModuleFactory(), name=u"plone.dexterity.schema.generated")
+        provideUtility(TextHandler, name=u"zope.schema.Text")
+        provideUtility(TextLineHandler, name=u"zope.schema.TextLine")
+
+        self.site = SchemaGenerationSite('site')
+        site_manager = self.site.getSiteManager()
+        site_manager.__bases__ = (getGlobalSiteManager(),)
+        site_manager.registerUtility(self.site, ISiteRoot)
+
+        for portal_type, model_source in ((u"one", MODEL_V1), (u"two", MODEL_V2),):
+            fti = DexterityFTI(portal_type)
+            fti.model_source = model_source
+            site_manager.registerUtility(fti, IDexterityFTI, name=portal_type)
+
+        self.schemaNames = [portalTypeToSchemaName(portal_type, prefix='site')
+                            for portal_type in (u"one", u"two")]
+
+    def tearDown(self):
+        super(TestWarmUp, self).tearDown()
+        for name in self.schemaNames:
+            plone.dexterity.schema.generated.__dict__.pop(name, None)
+        plone.dexterity.warmup._warmedSites.clear()
+        getConfiguration().product_config = None
+        SCHEMA_CACHE.clear()
+
+    def test_warmUp(self):
+        timings = warmUp(self.site)
+        self.assertEquals([u"one", u"two"], sorted(timings.keys()))
+        self.assertEquals(2, MODEL_CACHE.misses)
+
+        one = plone.dexterity.schema.generated.__dict__[self.schemaNames[0]]
+        two = plone.dexterity.schema.generated.__dict__[self.schemaNames[1]]
+        self.assertEquals(['title'], one.names())
+        self.assertEquals(['body', 'title'], sorted(two.names()))
+
+        # The schema cache is filled as well
+        self.assertEquals(1, len([key for key in SCHEMA_CACHE._snapshot
+                                  if key[:2] == ('get', u"one")]))
+
+    def test_warmUpOnTraverse_disabled(self):
+        warmUpOnTraverse(self.site, None)
+        self.failIf(self.schemaNames[0] in plone.dexterity.schema.generated.__dict__)
+
+    def test_warmUpOnTraverse_once(self):
+        getConfiguration().product_config = {'plone.dexterity': {'warmup': 'on'}}
+
+        warmUpOnTraverse(self.site, None)
+        self.failUnless(self.schemaNames[0] in plone.dexterity.schema.generated.__dict__)
+        self.assertEquals(2, MODEL_CACHE.misses)
+
+        plone.dexterity.schema.generated.__dict__.pop(self.schemaNames[0])
+        warmUpOnTraverse(self.site, None)
+        self.failIf(self.schemaNames[0] in plone.dexterity.schema.generated.__dict__)
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -917,10 +917,10 @@ class TestFileRepresentation(MockTestCase):
         class ITest(Interface):
             pass
 
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         SCHEMA_CACHE.clear()
         self.expect(fti_mock.lookupSchema()).result(ITest)
-        self.expect(fti_mock.behaviors).result([])
+        self.expect(fti_mock.behaviors).result([]).count(0, None)
 
         self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
 
@@ -939,9 +939,9 @@ class TestFileRepresentation(MockTestCase):
             title = schema.TextLine()
 
         SCHEMA_CACHE.clear()
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITest)
-        self.expect(fti_mock.behaviors).result([])
+        self.expect(fti_mock.behaviors).result([]).count(0, None)
 
         self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
 
@@ -962,9 +962,9 @@ class TestFileRepresentation(MockTestCase):
         alsoProvides(ITest['body'], IPrimaryField)
 
         SCHEMA_CACHE.clear()
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITest)
-        self.expect(fti_mock.behaviors).result([])
+        self.expect(fti_mock.behaviors).result([]).count(0, None)
 
         self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
 
@@ -987,7 +987,7 @@ class TestFileRepresentation(MockTestCase):
         alsoProvides(ITest['stuff'], IPrimaryField)
 
         SCHEMA_CACHE.clear()
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITest)
 
         self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
@@ -1044,7 +1044,7 @@ class TestFileRepresentation(MockTestCase):
             body = schema.Text()
         alsoProvides(ITest['body'], IPrimaryField)
 
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(ITest).count(0, None)
         self.expect(fti_mock.behaviors).result([ITestBehavior.__identifier__]).count(0, None)
 
@@ -1,23 +1,49 @@
+import time
 import logging
+import transaction
+
+from threading import RLock
+from threading import local
+from collections import OrderedDict
+from plone.synchronize import synchronized
 
 from Acquisition import aq_base
 from Acquisition import aq_inner
+from App.config import getConfiguration
 from AccessControl import Unauthorized
+from AccessControl import getSecurityManager
+from AccessControl.Permission import pname
 from DateTime import DateTime
-
-from zope.component import getUtility, queryUtility
+from OFS.event import ObjectWillBeRemovedEvent
+from OFS.subscribers import compatibilityCall
+from webdav.Lockable import ResourceLockedError
+from zExceptions import BadRequest
+
+from zope.component import getUtility
+from zope.component import getAdapter
+from zope.component import getSiteManager
+from zope.component.interfaces import ComponentLookupError
 from zope.component import createObject
+from zope.component.interfaces import IFactory
 
 from zope.dottedname.resolve import resolve
 from zope.event import notify
 from zope.lifecycleevent import ObjectCreatedEvent
+from zope.lifecycleevent import ObjectRemovedEvent
+from zope.container.contained import notifyContainerModified
 
-from plone.behavior.interfaces import IBehavior
 from plone.autoform.interfaces import IFormFieldProvider
 from plone.behavior.interfaces import IBehaviorAssignable
 from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.interfaces import IDexterityContainer
 
 from Products.CMFCore.interfaces import ISiteRoot
+from Products.CMFCore.utils import getToolByName
+from Products.CMFCore.permissions import DeleteObjects
+
+from Products.BTreeFolder2.BTreeFolder2 import BTreeFolder2Base
+from plone.folder.default import DefaultOrdering
+from plone.folder.ordered import OrderedBTreeFolderBase
 
 from zope.container.interfaces import INameChooser
 
@@ -30,16 +56,116 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
-# Not thread safe, but downside of a write conflict is very small
-_dottedCache = {}
+class DottedNameResolver(object):
+    """Resolve dotted names, caching the results.
+
+    Names that cannot be resolved are cached as well, so that e.g. a
+    misspelled behavior name does not cause an import attempt on every
+    request. Failures are retried after `ttl` seconds, and at most
+    `maxFailures` of them are kept. Both caches are cleared whenever an FTI
+    is modified.
+    """
+
+    lock = RLock()
+
+    def __init__(self, ttl=60, maxFailures=1000):
+        self.ttl = ttl
+        self.maxFailures = maxFailures
+        self._resolved = {}
+        self._failures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.failureHits = 0
+
+    def resolve(self, dottedName):
+        try:
+            obj = self._resolved[dottedName]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return obj
+
+        failure = self._failures.get(dottedName)
+        if failure is not None:
+            expires, error = failure
+            if expires > time.time():
+                self.failureHits += 1
+                raise error
+
+        with self.lock:
+            self.misses += 1
+            try:
+                obj = resolve(dottedName)
+            except (ImportError, ValueError), e:
+                self._failures.pop(dottedName, None)
+                self._failures[dottedName] = (time.time() + self.ttl, e)
+                while len(self._failures) > self.maxFailures:
+                    self._failures.popitem(last=False)
+                raise
+            self._failures.pop(dottedName, None)
+            self._resolved[dottedName] = obj
+            return obj
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    failureHits=self.failureHits, size=len(self._resolved),
+                    failures=len(self._failures))
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.failureHits = 0
+
+    @synchronized(lock)
+    def clear(self):
+        self._resolved = {}
+        self._failures = OrderedDict()
+        self.resetStats()
+
+DOTTED_NAME_RESOLVER = DottedNameResolver()
 
 def resolveDottedName(dottedName):
     """Resolve a dotted name to a real object
     """
-    global _dottedCache
-    if dottedName not in _dottedCache:
-        _dottedCache[dottedName] = resolve(dottedName)
-    return _dottedCache[dottedName]
+    return DOTTED_NAME_RESOLVER.resolve(dottedName)
+
+# FTI lookup
+
+def queryFTI(portal_type, default=None):
+    """Return the IDexterityFTI utility for the given portal_type, or
+    default if there is none.
+
+    This is equivalent to queryUtility(IDexterityFTI, name=portal_type), but
+    the results are cached in a volatile attribute of the current site
+    manager's utility registry. The registry's generation changes whenever
+    a utility is registered or unregistered in it or its bases, e.g. by the
+    ftiAdded, ftiRemoved and ftiRenamed handlers, which invalidates the
+    cache.
+    """
+    site_manager = getSiteManager()
+    registry = site_manager.utilities
+    generation = registry._generation
+    cache = getattr(registry, '_v_dexterity_ftis', None)
+    if cache is None or cache[0] != generation:
+        cache = registry._v_dexterity_ftis = (generation, {})
+    ftis = cache[1]
+    try:
+        fti = ftis[portal_type]
+    except KeyError:
+        fti = ftis[portal_type] = site_manager.queryUtility(IDexterityFTI, name=portal_type)
+    if fti is None:
+        return default
+    return fti
+
+def getFTI(portal_type):
+    """Return the IDexterityFTI utility for the given portal_type, like
+    getUtility(IDexterityFTI, name=portal_type)
+    """
+    fti = queryFTI(portal_type)
+    if fti is None:
+        raise ComponentLookupError(IDexterityFTI, portal_type)
+    return fti
 
 # Schema name encoding
 
@@ -68,33 +194,83 @@ class SchemaNameEncoder(object):
     def split(self, s):
         return [self.decode(a) for a in s.split('_0_')]
 
+# Memoized results of portalTypeToSchemaName() and splitSchemaName(). Only
+# valid names are stored, and the caches are emptied if they grow too large,
+# so stray lookups on the generated module cannot fill them up.
+SCHEMA_NAME_CACHE_SIZE = 10000
+_schemaNames = {}
+_schemaNameParts = {}
+
+# Site prefixes, keyed by the site's database and oid
+_sitePrefixes = {}
+
+def getSitePrefix(site=None):
+    """Return the prefix used in the names of generated schemata for the
+    given site, or the ISiteRoot utility if no site is given.
+    """
+    if site is None:
+        site = getUtility(ISiteRoot)
+    oid = getattr(aq_base(site), '_p_oid', None)
+    if oid is None or site._p_jar is None:
+        return '/'.join(site.getPhysicalPath())[1:]
+    key = (site._p_jar.db().database_name, oid)
+    prefix = _sitePrefixes.get(key)
+    if prefix is None:
+        prefix = _sitePrefixes[key] = '/'.join(site.getPhysicalPath())[1:]
+    return prefix
+
+def sitePrefixChanged(site, event):
+    """Forget cached site prefixes when a site is moved or renamed
+    """
+    _sitePrefixes.clear()
+
+def _remember(cache, key, value):
+    if len(cache) > SCHEMA_NAME_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
 def portalTypeToSchemaName(portal_type, schema=u"", prefix=None):
     """Return a canonical interface name for a generated schema interface.
     """
     if prefix is None:
-        prefix = '/'.join(getUtility(ISiteRoot).getPhysicalPath())[1:]
+        prefix = getSitePrefix()
 
-    encoder = SchemaNameEncoder()
-    return encoder.join(prefix, portal_type, schema)
+    parts = (prefix, portal_type, schema or u"")
+    schemaName = _schemaNames.get(parts)
+    if schemaName is None:
+        schemaName = SchemaNameEncoder().join(prefix, portal_type, schema)
+        if prefix and portal_type:
+            _remember(_schemaNames, parts, schemaName)
+    return schemaName
 
 def schemaNameToPortalType(schemaName):
     """Return a the portal_type part of a schema name
     """
+    parts = _schemaNameParts.get(schemaName)
+    if parts is not None:
+        return parts[1]
     encoder = SchemaNameEncoder()
     return encoder.split(schemaName)[1]
 
 def splitSchemaName(schemaName):
     """Return a tuple prefix, portal_type, schemaName
     """
+    parts = _schemaNameParts.get(schemaName)
+    if parts is not None:
+        return parts
+
     encoder = SchemaNameEncoder()
     items = encoder.split(schemaName)
     if len(items) == 2:
-        return items[0], items[1], u""
+        parts = items[0], items[1], u""
     elif len(items) == 3:
-        return items[0], items[1], items[2]
+        parts = items[0], items[1], items[2]
     else:
         raise ValueError("Schema name %s is invalid" % schemaName)
 
+    _remember(_schemaNameParts, schemaName, parts)
+    return parts
+
 
 def iterSchemataForType(portal_type):
     """XXX: came from plone.app.deco.utils, very similar to iterSchemata
@@ -102,7 +278,7 @@ def iterSchemataForType(portal_type):
     Not fully merged codewise with iterSchemata as that breaks
     test_webdav.test_readline_mimetype_additional_schemata.
     """
-    fti = queryUtility(IDexterityFTI, name=portal_type)
+    fti = queryFTI(portal_type)
     if fti is None:
         return
 
@@ -115,7 +291,7 @@ def iterSchemata(content):
     """Return an iterable containing first the object's schema, and then
     any form field schemata for any enabled behaviors.
     """
-    fti = queryUtility(IDexterityFTI, name=content.portal_type)
+    fti = queryFTI(content.portal_type)
     if fti is None:
         return
 
@@ -124,8 +300,32 @@ def iterSchemata(content):
         yield schema
 
 
+def usesFTIBehaviors(content):
+    """Return True if the content's behaviors are the ones enabled in its
+    FTI, i.e. if no IBehaviorAssignable other than the default one applies
+    to it.
+    """
+    # Avoid circular import
+    from plone.dexterity.behavior import DexterityBehaviorAssignable
+    assignable = IBehaviorAssignable(content, None)
+    return assignable is None or \
+        assignable.__class__ is DexterityBehaviorAssignable
+
+
+def getTypeProfile(content):
+    """Return the cached TypeProfile of the content's portal_type, or None if
+    there is none or it does not describe this object, because its
+    behaviors are not the ones enabled in the FTI.
+    """
+    # Avoid circular import
+    from plone.dexterity.schema import SCHEMA_CACHE
+    if not usesFTIBehaviors(content):
+        return None
+    return SCHEMA_CACHE.profile(content.portal_type)
+
+
 def createContent(portal_type, **kw):
-    fti = getUtility(IDexterityFTI, name=portal_type)
+    fti = getFTI(portal_type)
     content = createObject(fti.factory)
 
     # Note: The factory may have done this already, but we want to be sure
@@ -141,6 +341,20 @@ def createContent(portal_type, **kw):
     return content
 
 
+def getNameChooser(container):
+    """Return the INameChooser for content added to the given container.
+
+    This is the named adapter given by the name_chooser property of the
+    container's FTI, if any, and the default name chooser otherwise.
+    """
+    if IDexterityContainer.providedBy(container):
+        fti = queryFTI(container.portal_type)
+        name = getattr(fti, 'name_chooser', None)
+        if name:
+            return getAdapter(container, INameChooser, name=name)
+    return INameChooser(container)
+
+
 def addContentToContainer(container, object, checkConstraints=True):
     """Add an object to a container.
 
@@ -155,14 +369,14 @@ def addContentToContainer(container, object, checkConstraints=True):
     if checkConstraints:
         container_fti = container.getTypeInfo()
 
-        fti = getUtility(IDexterityFTI, name=object.portal_type)
+        fti = getFTI(object.portal_type)
         if not fti.isConstructionAllowed(container):
             raise Unauthorized("Cannot create %s" % object.portal_type)
 
         if container_fti is not None and not container_fti.allowType(object.portal_type):
             raise ValueError("Disallowed subobject type: %s" % object.portal_type)
 
-    name = INameChooser(container).chooseName(None, object)
+    name = getNameChooser(container).chooseName(None, object)
     object.id = name
 
     newName = container._setObject(name, object)
@@ -183,6 +397,261 @@ def createContentInContainer(container, portal_type, checkConstraints=True, **kw
     return addContentToContainer(container, content, checkConstraints=checkConstraints)
 
 
+# Deferred catalog indexing
+
+_indexing = local()
+
+def indexingDeferred(object):
+    """If catalog indexing is being deferred in this thread, queue the given
+    object to be indexed later and return True. Otherwise, return False.
+
+    This is called from DexterityContent.indexObject.
+    """
+    queue = getattr(_indexing, 'queue', None)
+    if queue is None:
+        return False
+    queue.append(object)
+    return True
+
+def _flushIndexing(container, queue):
+    """Index the queued objects in one pass over the catalog
+    """
+    objects = queue[:]
+    del queue[:]
+    if not objects:
+        return
+    from plone.dexterity.indexing import asyncIndexingEnabled
+    from plone.dexterity.indexing import queueAsyncReindex
+    if asyncIndexingEnabled():
+        objects = [object for object in objects if not queueAsyncReindex(object)]
+
+    catalog = getToolByName(container, 'portal_catalog', None)
+    if catalog is None:
+        return
+    for object in objects:
+        catalog.indexObject(object)
+
+def createContentsInContainer(container, items, checkConstraints=True,
+                              deferIndexing=True, batchSize=1000):
+    """Create many content objects and add them to a container.
+
+    items is an iterable of (portal_type, kw) tuples, where kw is a dict of
+    attributes to set, as for createContentInContainer(). It is consumed
+    lazily, so it may be a generator.
+
+    The FTI, factory and constraints are looked up and checked once per
+    portal_type, and the container's name chooser is adapted once. If
+    deferIndexing is True, catalog indexing of the new objects is held back
+    and done in one pass every batchSize objects and at the end. A savepoint
+    is made after each batch, so that memory use stays bounded for large
+    imports.
+
+    Returns the list of new ids.
+    """
+    container = aq_inner(container)
+    container_fti = None
+    if checkConstraints:
+        container_fti = container.getTypeInfo()
+
+    nameChooser = getNameChooser(container)
+    types = {}
+    names = []
+
+    queue = []
+    oldQueue = getattr(_indexing, 'queue', None)
+    if deferIndexing:
+        _indexing.queue = queue
+
+    try:
+        count = 0
+        for portal_type, kw in items:
+            try:
+                fti, factory = types[portal_type]
+            except KeyError:
+                fti = getFTI(portal_type)
+                if checkConstraints:
+                    if not fti.isConstructionAllowed(container):
+                        raise Unauthorized("Cannot create %s" % portal_type)
+                    if container_fti is not None and not container_fti.allowType(portal_type):
+                        raise ValueError("Disallowed subobject type: %s" % portal_type)
+                factory = getUtility(IFactory, fti.factory)
+                types[portal_type] = fti, factory
+
+            content = factory()
+            content.portal_type = fti.getId()
+            for (key, value) in kw.items():
+                setattr(content, key, value)
+            notify(ObjectCreatedEvent(content))
+
+            name = nameChooser.chooseName(None, content)
+            content.id = name
+            names.append(container._setObject(name, content))
+
+            count += 1
+            if count % batchSize == 0:
+                _flushIndexing(container, queue)
+                transaction.savepoint(optimistic=True)
+    finally:
+        _indexing.queue = oldQueue
+        # Objects added before an error are indexed too, as they would
+        # have been without the deferral
+        _flushIndexing(container, queue)
+
+    return names
+
+
+def unindexingDeferred(object):
+    """If catalog unindexing is being deferred in this thread, queue the
+    given object's path to be unindexed later and return True. Otherwise,
+    return False.
+
+    This is called from DexterityContent.unindexObject.
+    """
+    queue = getattr(_indexing, 'removed', None)
+    if queue is None:
+        return False
+    queue.append('/'.join(object.getPhysicalPath()))
+    return True
+
+def _flushUnindexing(container, queue):
+    """Unindex the queued paths in one pass over the catalog
+    """
+    paths = queue[:]
+    del queue[:]
+    if not paths:
+        return
+    catalog = getToolByName(container, 'portal_catalog', None)
+    if catalog is None:
+        return
+    for path in paths:
+        catalog.uncatalog_object(path)
+
+def _deletePermitted(item, permitted, securityManager):
+    """Check the Delete objects permission on an item, given whether the
+    user has it on the item's container.
+
+    Local roles only ever add to the roles a user has in the container, so
+    if the permission is acquired from the container and local roles are
+    not blocked, the answer is the same as for the container, and the
+    expensive role lookup can be skipped.
+    """
+    if permitted:
+        base = aq_base(item)
+        roles = getattr(base, pname(DeleteObjects), None)
+        if (roles is None or isinstance(roles, list)) and \
+                not getattr(base, '__ac_local_roles_block__', False):
+            return True
+    return securityManager.checkPermission(DeleteObjects, item)
+
+def _removeObjects(container, items):
+    """Remove the objects in items, a list of (id, object) tuples, from the
+    container, updating the container's ordering or _objects once rather
+    than once per object, as ObjectManager._delObject() would
+    """
+    ids = [id for id, item in items]
+    ordering = None
+    if isinstance(container, OrderedBTreeFolderBase):
+        ordering = container.getOrdering()
+
+    if isinstance(ordering, DefaultOrdering):
+        # DefaultOrdering.notifyRemoved() rebuilds the position index for
+        # each object removed, which is quadratic when many objects are
+        # deleted
+        for id in ids:
+            super(OrderedBTreeFolderBase, container)._delOb(id)
+        order = ordering._order()
+        if order:
+            removed = set(ids)
+            remaining = [id for id in order if id not in removed]
+            order[:] = remaining
+            pos = ordering._pos()
+            pos.clear()
+            for count, id in enumerate(remaining):
+                pos[id] = count
+    else:
+        if not isinstance(container, BTreeFolder2Base):
+            # A plain ObjectManager also lists its objects in _objects
+            removed = set(ids)
+            container._objects = tuple([i for i in container._objects
+                                        if i['id'] not in removed])
+        for id in ids:
+            container._delOb(id)
+
+    # Indicate to the objects that they have been deleted, which is
+    # necessary for object DB mount points. Broken objects do not accept
+    # attributes.
+    for id, item in items:
+        try:
+            item._v__object_deleted__ = 1
+        except:
+            pass
+
+def deleteContentsInContainer(container, ids, checkPermission=True,
+                              batchSize=1000):
+    """Delete many objects from a container.
+
+    If checkPermission is True, Unauthorized is raised before anything is
+    deleted unless the current user has the Delete objects permission on
+    every object. It is checked once on the container, and only checked on
+    the objects themselves where their permission settings or local roles
+    could give a different answer. Trusted code can pass
+    checkPermission=False to skip the check.
+
+    The objects are deleted in batches of batchSize. For each batch, the
+    IObjectWillBeRemovedEvents are fired, then the objects are removed from
+    the container and its ordering in one go, then the IObjectRemovedEvents
+    are fired. Catalog unindexing is held back and done in one pass per
+    batch, and a savepoint is made after each batch. The container is
+    notified of the modification once, at the end.
+    """
+    container = aq_inner(container)
+    reserved = getattr(container, '_reserved_names', ())
+    securityManager = getSecurityManager()
+    permitted = checkPermission and \
+        securityManager.checkPermission(DeleteObjects, container)
+
+    items = []
+    for id in ids:
+        if id in reserved:
+            raise BadRequest("%s cannot be deleted" % id)
+        item = container._getOb(id, None)
+        if item is None:
+            raise BadRequest("%s does not exist" % id)
+        if item.wl_isLocked():
+            raise ResourceLockedError(
+                'Object "%s" is locked via WebDAV' % item.getId())
+        if checkPermission and not _deletePermitted(item, permitted, securityManager):
+            raise Unauthorized("Do not have permissions to remove this object")
+        items.append((id, item))
+
+    if not items:
+        return
+
+    queue = []
+    oldQueue = getattr(_indexing, 'removed', None)
+    _indexing.removed = queue
+
+    try:
+        for start in range(0, len(items), batchSize):
+            batch = items[start:start + batchSize]
+            for id, item in batch:
+                compatibilityCall('manage_beforeDelete', item, item, container)
+                notify(ObjectWillBeRemovedEvent(item, container, id))
+            _removeObjects(container, batch)
+            for id, item in batch:
+                notify(ObjectRemovedEvent(item, container, id))
+
+            _flushUnindexing(container, queue)
+            transaction.savepoint(optimistic=True)
+    finally:
+        _indexing.removed = oldQueue
+        # Objects unindexed before an error are removed from the catalog
+        # too, as they would have been without the deferral
+        _flushUnindexing(container, queue)
+
+    notifyContainerModified(container)
+
+
 def getAdditionalSchemata(context=None, portal_type=None):
     """Get additional schemata for this context or this portal_type.
 
@@ -199,6 +668,8 @@ def getAdditionalSchemata(context=None, portal_type=None):
               context, portal_type)
     if context is None and portal_type is None:
         return
+    # Avoid circular import
+    from plone.dexterity.behavior import DexterityBehaviorAssignable
     if context:
         behavior_assignable = IBehaviorAssignable(context, None)
     else:
@@ -208,23 +679,16 @@ def getAdditionalSchemata(context=None, portal_type=None):
         # Usually an add-form.
         if portal_type is None:
             portal_type = context.portal_type
-        fti = getUtility(IDexterityFTI, name=portal_type)
-        for behavior_name in fti.behaviors:
-            behavior_interface = None
-            behavior_instance = queryUtility(IBehavior, name=behavior_name)
-            if not behavior_instance:
-                try:
-                    behavior_interface = resolveDottedName(behavior_name)
-                except (ValueError, ImportError):
-                    log.warning("Error resolving behaviour %s", behavior_name)
-                    continue
-            else:
-                behavior_interface = behavior_instance.interface
-
-            if behavior_interface is not None:
-                behavior_schema = IFormFieldProvider(behavior_interface, None)
-                if behavior_schema is not None:
-                    yield behavior_schema
+        # Avoid circular import
+        from plone.dexterity.schema import SCHEMA_CACHE
+        for behavior_schema in SCHEMA_CACHE.behaviorSchemata(portal_type):
+            yield behavior_schema
+    elif behavior_assignable.__class__ is DexterityBehaviorAssignable:
+        # The behaviors are the registered ones enabled in the FTI, whose
+        # schemata are cached per portal_type
+        from plone.dexterity.schema import SCHEMA_CACHE
+        for behavior_schema in SCHEMA_CACHE.registeredBehaviorSchemata(context.portal_type):
+            yield behavior_schema
     else:
         log.debug("Behavior assignable found for context.")
         for behavior_reg in behavior_assignable.enumerateBehaviors():
@@ -233,6 +697,13 @@ def getAdditionalSchemata(context=None, portal_type=None):
                 yield behavior_schema
 
 
+def getProductConfig():
+    """Return the settings from the plone.dexterity <product-config> section
+    in zope.conf, as a dict
+    """
+    product_config = getattr(getConfiguration(), 'product_config', None) or {}
+    return product_config.get('plone.dexterity', {})
+
 def safe_utf8(s):
     if isinstance(s, unicode):
         s = s.encode('utf8')
@@ -0,0 +1,140 @@
+"""Eager generation of dynamic schemata.
+
+Dynamic schemata are normally created lazily, the first time each one is
+used. That happens under a global lock, during the first request for each
+type. The warm-up loads all of a site's models and schemata in one pass
+instead. It is opt-in; enable it in zope.conf to have it run the first time
+each site is traversed after startup:
+
+    <product-config plone.dexterity>
+        warmup on
+    </product-config>
+"""
+import time
+import logging
+import threading
+import Queue
+
+from zope.component import getGlobalSiteManager
+from zope.component.hooks import getSite, setSite
+
+from plone.supermodel.parser import ISchemaPolicy
+
+from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.schema import MODEL_CACHE
+from plone.dexterity.schema import lookupCachedModel
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.schema import _persistentKey
+from plone.dexterity import utils
+
+import plone.dexterity.schema
+
+log = logging.getLogger(__name__)
+
+_warmedSites = set()
+_warmedSitesLock = threading.RLock()
+
+def warmUpEnabled():
+    """Return True if the warm-up has been enabled in zope.conf
+    """
+    return utils.getProductConfig().get('warmup', '').lower() in ('on', 'true', 'yes', '1')
+
+def warmUp(site, threads=4):
+    """Load the models and generate the schemata of all Dexterity types in
+    the given site, and fill SCHEMA_CACHE.
+
+    Models are parsed in parallel by up to `threads` worker threads. The
+    schemata are then generated in the calling thread. Returns a dict
+    mapping each portal_type to a tuple (parse time, build time) in seconds.
+    """
+    ftis = site.getSiteManager().getAllUtilitiesRegisteredFor(IDexterityFTI)
+
+    # Persistent objects must not be shared between threads, so we read
+    # everything the workers need up front. Schema policies are looked up
+    # in the global registry by the workers, so types with local policies
+    # are parsed later, in this thread.
+    jobs = Queue.Queue()
+    site_manager = site.getSiteManager()
+    global_site_manager = getGlobalSiteManager()
+    for fti in ftis:
+        policy = fti.schema_policy
+        if site_manager.queryUtility(ISchemaPolicy, name=policy) is not \
+                global_site_manager.queryUtility(ISchemaPolicy, name=policy):
+            continue
+        try:
+            if fti.model_source:
+                jobs.put((fti.getId(), MODEL_CACHE.loadString, fti.model_source, policy))
+            elif fti.model_file:
+                jobs.put((fti.getId(), MODEL_CACHE.loadFile, fti._absModelFile(), policy))
+        except ValueError, e:
+            log.error("Unable to load model for %s: %s" % (fti.getId(), e))
+
+    parseTimes = {}
+
+    def parse():
+        while True:
+            try:
+                portal_type, loader, source, policy = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            try:
+                loader(source, policy=policy)
+            except Exception, e:
+                log.error("Unable to parse model for %s: %s" % (portal_type, e))
+            parseTimes[portal_type] = time.time() - start
+
+    workers = [threading.Thread(target=parse)
+               for i in range(min(threads, jobs.qsize()))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    prefix = utils.getSitePrefix(site)
+    timings = {}
+
+    oldSite = getSite()
+    setSite(site)
+    try:
+        for fti in ftis:
+            portal_type = fti.getId()
+            start = time.time()
+            try:
+                if fti.model_source or fti.model_file:
+                    for schemaName in lookupCachedModel(fti).schemata:
+                        name = utils.portalTypeToSchemaName(portal_type, schemaName, prefix=prefix)
+                        getattr(plone.dexterity.schema.generated, name)
+                SCHEMA_CACHE.get(portal_type)
+                SCHEMA_CACHE.subtypes(portal_type)
+                SCHEMA_CACHE.defaults(portal_type)
+            except Exception, e:
+                log.error("Unable to load schema for %s: %s" % (portal_type, e))
+                continue
+
+            timings[portal_type] = (parseTimes.get(portal_type, 0.0), time.time() - start)
+            log.info("Loaded schema for %s in %.3fs (parsing took %.3fs)" % (
+                portal_type, timings[portal_type][1], timings[portal_type][0]))
+    finally:
+        setSite(oldSite)
+
+    return timings
+
+def warmUpOnTraverse(site, event):
+    """Warm up each site once, the first time it is traversed
+    """
+    if not warmUpEnabled():
+        return
+
+    key = _persistentKey(site)
+    if key in _warmedSites:
+        return
+
+    with _warmedSitesLock:
+        if key in _warmedSites:
+            return
+        start = time.time()
+        timings = warmUp(site)
+        _warmedSites.add(key)
+
+    log.info("Loaded schemata for %d types in %.3fs" % (len(timings), time.time() - start))
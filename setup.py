@@ -49,6 +49,7 @@ setup(name='plone.dexterity',
           'zope.interface',
           'zope.lifecycleevent',
           'zope.location',
+          'zope.processlifetime',
           'zope.publisher',
           'zope.schema',
           'zope.security',